@@ -0,0 +1,74 @@
+"""
+Analyse des parcours d'un assistant à partir des étapes des sessions
+(funnel, séquences de nœuds fréquentes, temps entre étapes, points d'abandon).
+
+Usage :
+    python analyze_steps.py <assistant_id>                       # 30 derniers jours
+    python analyze_steps.py <assistant_id> --days 180 --path n1,n2,n3
+    python analyze_steps.py <assistant_id> --since 2024-01-01 --until 2024-04-01 --json
+
+Même calcul que GET /api/analytics/step-analysis (app.services.step_analysis).
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+from app.database.mongodb import close_mongo_connection, get_database
+from app.services.step_analysis import MAX_NGRAM, analyze, load_step_columns
+
+
+def print_report(report: dict):
+    print(f"{report['steps']} étape(s), {report['sessions']} session(s), {report['nodes']} nœud(s)")
+
+    if report["funnel"]:
+        print("\nFunnel")
+        for step in report["funnel"]:
+            print(f"  {step['node_id']:<30} {step['sessions']:>10} {step['conversion_rate']:>7.2f}%  -{step['drop_off']} ({step['drop_off_rate']:.2f}%)")
+
+    print("\nSéquences les plus fréquentes")
+    for row in report["paths"]:
+        print(f"  {row['count']:>10} {row['share']:>7.2f}%  {' → '.join(row['path'])}")
+
+    timing = report["time_between_steps"]
+    print(f"\nTemps entre étapes (s) : moyenne {timing['mean']}, p50 {timing['p50']}, p90 {timing['p90']}, p99 {timing['p99']}")
+    for row in timing["by_node"][:10]:
+        print(f"  {row['node_id']:<30} {row['count']:>10}  p50 {row['p50']:>8}  p90 {row['p90']:>8}")
+
+    print("\nPoints d'abandon")
+    for row in report["dropouts"]:
+        print(f"  {row['node_id']:<30} {row['dropouts']:>10} / {row['sessions']:<10} {row['dropout_rate']:>7.2f}%")
+
+
+async def main(args):
+    db = await get_database()
+    until = datetime.fromisoformat(args.until) if args.until else None
+    since = datetime.fromisoformat(args.since) if args.since else (until or datetime.utcnow()) - timedelta(days=args.days)
+    path = [node_id.strip() for node_id in (args.path or "").split(",") if node_id.strip()]
+
+    started = time.perf_counter()
+    columns = await load_step_columns(db, args.assistant_id, since, until)
+    loaded = time.perf_counter()
+    report = analyze(columns, path, args.ngram, args.top)
+    computed = time.perf_counter()
+    await close_mongo_connection()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        print(f"\nChargement {loaded - started:.2f}s, calcul {computed - loaded:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse des parcours d'un assistant (session_steps)")
+    parser.add_argument("assistant_id", help="ID de l'assistant")
+    parser.add_argument("--days", type=int, default=30, help="Nombre de jours à analyser (défaut 30)")
+    parser.add_argument("--since", help="Début de la période (AAAA-MM-JJ), prioritaire sur --days")
+    parser.add_argument("--until", help="Fin de la période (AAAA-MM-JJ, exclue)")
+    parser.add_argument("--path", help="Nœuds du funnel, séparés par des virgules")
+    parser.add_argument("--ngram", type=int, default=3, choices=range(1, MAX_NGRAM + 1), metavar=f"1-{MAX_NGRAM}", help="Longueur des séquences de nœuds (défaut 3)")
+    parser.add_argument("--top", type=int, default=20, help="Nombre de séquences et de points d'abandon affichés (défaut 20)")
+    parser.add_argument("--json", action="store_true", help="Rapport au format JSON")
+    asyncio.run(main(parser.parse_args()))
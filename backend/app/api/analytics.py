@@ -2,24 +2,32 @@
 API pour la gestion des analytics et des statistiques
 """
 from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
 from bson import ObjectId
+import json
 import logging
 
 from app.models.session import AnalyticsOverview, AnalyticsResponse, LeadStatus, SessionStatus
 from app.database.mongodb import get_database
 from app.api.auth import get_current_user
-from app.services.analytics_service import AnalyticsService
+from app.services.analytics_service import (
+    AnalyticsService, RESPONSE_SKETCHES_FIELD, TRANSITION_ENTRY, TRANSITION_EXIT, UNIQUES_FIELD,
+    merge_responses, merge_uniques
+)
+from app.services.assistant_resolver import resolve_assistant
+from app.services.event_log import load_session_messages
+from app.services.step_analysis import analyze_assistant, MAX_ANALYSIS_DAYS, MAX_NGRAM
+from app.utils.rate_limit import rate_limit, body_field
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO)
+# Logger du module (configuré dans app/utils/logging_config.py)
 logger = logging.getLogger(__name__)
 
 # Collections MongoDB
 ANALYTICS_COLLECTION = "analytics"
 SESSIONS_COLLECTION = "sessions"
-MESSAGES_COLLECTION = "messages"
 ASSISTANTS_COLLECTION = "assistants"
 
 router = APIRouter()
@@ -101,6 +109,11 @@ async def get_analytics_overview(
         duration_result = await db[ANALYTICS_COLLECTION].aggregate(pipeline_duration).to_list(1)
         average_session_duration = duration_result[0].get("average_duration", 0) if duration_result else 0
         
+        # Visiteurs et leads uniques : union des HyperLogLog quotidiens
+        uniques = merge_uniques(
+            await db[ANALYTICS_COLLECTION].find(match_query, {UNIQUES_FIELD: 1}).to_list(None)
+        )
+        
         return AnalyticsOverview(
             total_sessions=sessions_count,
             active_sessions=sessions_count - completed_sessions - abandoned_sessions,
@@ -110,10 +123,12 @@ async def get_analytics_overview(
             partial_leads=stats.get("partial_leads", 0),
             complete_leads=stats.get("complete_leads", 0),
             average_completion_percentage=round(completion_rate, 2),
-            average_session_duration=round(average_session_duration, 2)
+            average_session_duration=round(average_session_duration, 2),
+            unique_visitors=uniques["visitors"],
+            unique_leads=uniques["leads"]
         )
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des analytics: {str(e)}")
+        logger.error("Erreur lors de la récupération des analytics: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
 @router.get("/time-series", response_model=Dict[str, List[Dict[str, Any]]])
@@ -211,7 +226,7 @@ async def get_analytics_time_series(
             "leads": leads_data
         }
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des séries temporelles: {str(e)}")
+        logger.error("Erreur lors de la récupération des séries temporelles: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
 @router.get("/leads", response_model=List[Dict[str, Any]])
@@ -261,10 +276,7 @@ async def get_recent_leads(
             assistant = await db[ASSISTANTS_COLLECTION].find_one({"_id": ObjectId(lead["assistant_id"])})
             
             # Récupérer les messages pour extraire les données du formulaire
-            messages = await db[MESSAGES_COLLECTION].find({
-                "session_id": lead_id,
-                "content_type": {"$in": ["form", "form_field"]}
-            }).to_list(100)
+            messages = await load_session_messages(lead, content_types=["form", "form_field"])
             
             # Extraire les informations du lead
             lead_info = {}
@@ -286,7 +298,7 @@ async def get_recent_leads(
         
         return result
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des leads: {str(e)}")
+        logger.error("Erreur lors de la récupération des leads: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
 @router.get("/node-performance", response_model=List[Dict[str, Any]])
@@ -308,9 +320,9 @@ async def get_node_performance(
         analytics_data = await db[ANALYTICS_COLLECTION].find({
             "assistant_id": assistant_id,
             "date": {"$gte": start_date}
-        }).to_list(100)
+        }, {"nodes": 1}).to_list(None)
         
-        # Agréger les données par nœud
+        # Agréger les données par nœud (un document par jour, ou par shard)
         nodes_performance = {}
         
         for data in analytics_data:
@@ -362,7 +374,158 @@ async def get_node_performance(
         
         return result
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des performances par nœud: {str(e)}")
+        logger.error("Erreur lors de la récupération des performances par nœud: %s", e)
+        raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+
+def _sum_transitions(analytics_data: List[Dict[str, Any]]) -> Dict[str, Dict[str, int]]:
+    """
+    Somme des matrices de transitions quotidiennes (`transitions.<depuis>.<vers>`)
+    """
+    transitions: Dict[str, Dict[str, int]] = {}
+    for data in analytics_data:
+        for source, targets in (data.get("transitions") or {}).items():
+            row = transitions.setdefault(source, {})
+            for target, count in targets.items():
+                row[target] = row.get(target, 0) + count
+    return transitions
+
+@router.get("/funnel", response_model=Dict[str, Any])
+async def get_funnel(
+    assistant_id: str,
+    path: Optional[str] = Query(None, description="Nœuds du funnel, séparés par des virgules"),
+    days: int = Query(30, description="Nombre de jours à analyser"),
+    user = Depends(get_current_user)
+):
+    """
+    Funnel et diagramme de Sankey d'un assistant, calculés à partir des
+    compteurs de transitions quotidiens (sans relire les étapes des sessions).
+    
+    - `links` : connexions parcourues (source, cible, nombre), y compris
+      l'entrée dans le flow ("entry") et la sortie de la session ("exit") ;
+    - `steps` : pour chaque nœud de `path`, le nombre de sessions qui
+      l'atteignent et la déperdition vers le nœud suivant. Les compteurs ne
+      gardent pas l'historique de chaque session : le passage d'un nœud au
+      suivant est estimé par la proportion des arrivées sur le nœud qui
+      empruntent la connexion vers le nœud suivant.
+    """
+    try:
+        db = await get_database()
+        
+        # Les compteurs sont écrits sous l'identifiant reçu par la session
+        # (ObjectId ou public_id) : l'assistant est résolu et les deux formes
+        # sont lues ; réservé au propriétaire de l'assistant
+        resolved = await resolve_assistant(assistant_id)
+        assistant = None
+        if resolved:
+            assistant = await db[ASSISTANTS_COLLECTION].find_one(
+                {"_id": ObjectId(resolved["id"]), "user_id": user["id"]}, {"nodes": 1}
+            )
+        if not assistant:
+            raise HTTPException(status_code=404, detail="Assistant non trouvé")
+        assistant_ids = [resolved["id"]] + ([resolved["public_id"]] if resolved.get("public_id") else [])
+        
+        start_date = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d")
+        analytics_data = await db[ANALYTICS_COLLECTION].find(
+            {"assistant_id": {"$in": assistant_ids}, "date": {"$gte": start_date}},
+            {"transitions": 1}
+        ).to_list(None)
+        transitions = _sum_transitions(analytics_data)
+        
+        # Arrivées sur chaque nœud (somme des connexions entrantes)
+        inflow: Dict[str, int] = {}
+        for targets in transitions.values():
+            for target, count in targets.items():
+                inflow[target] = inflow.get(target, 0) + count
+        
+        node_names = {
+            node.get("id"): node.get("name") or node.get("label") or (node.get("data") or {}).get("label")
+            for node in assistant.get("nodes") or []
+        }
+        
+        links = [
+            {"source": source, "target": target, "value": count}
+            for source, targets in transitions.items()
+            for target, count in targets.items()
+        ]
+        links.sort(key=lambda link: link["value"], reverse=True)
+        
+        steps = []
+        node_ids = [node_id.strip() for node_id in (path or "").split(",") if node_id.strip()]
+        reached = float(inflow.get(node_ids[0], 0)) if node_ids else 0.0
+        for index, node_id in enumerate(node_ids):
+            arrivals = inflow.get(node_id, 0)
+            row = transitions.get(node_id, {})
+            next_node_id = node_ids[index + 1] if index + 1 < len(node_ids) else None
+            if next_node_id is not None:
+                continued = reached * row.get(next_node_id, 0) / arrivals if arrivals else 0.0
+            else:
+                continued = reached
+            exits = row.get(TRANSITION_EXIT, 0)
+            steps.append({
+                "node_id": node_id,
+                "node_name": node_names.get(node_id) or "Nœud inconnu",
+                "arrivals": arrivals,
+                "exits": exits,
+                "reached": round(reached, 2),
+                "continued": round(continued, 2) if next_node_id is not None else None,
+                "drop_off": round(reached - continued, 2) if next_node_id is not None else None,
+                "drop_off_rate": (round((reached - continued) / reached * 100, 2) if reached else 0) if next_node_id is not None else None,
+                "exit_rate": round(exits / arrivals * 100, 2) if arrivals else 0
+            })
+            reached = continued
+        
+        entries = sum(transitions.get(TRANSITION_ENTRY, {}).values())
+        return {
+            "assistant_id": assistant_id,
+            "days": days,
+            "entries": entries,
+            "path": node_ids,
+            "steps": steps,
+            "conversion_rate": round(steps[-1]["reached"] / steps[0]["reached"] * 100, 2) if steps and steps[0]["reached"] else 0,
+            "nodes": [
+                {"id": node_id, "name": node_names.get(node_id) or node_id}
+                for node_id in sorted({link["source"] for link in links} | {link["target"] for link in links})
+            ],
+            "links": links
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erreur lors du calcul du funnel: %s", e)
+        raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+
+@router.get("/step-analysis", response_model=Dict[str, Any])
+async def get_step_analysis(
+    assistant_id: str,
+    days: int = Query(30, ge=1, le=MAX_ANALYSIS_DAYS, description="Nombre de jours à analyser"),
+    path: Optional[str] = Query(None, description="Nœuds du funnel, séparés par des virgules"),
+    ngram: int = Query(3, ge=1, le=MAX_NGRAM, description="Longueur des séquences de nœuds"),
+    top: int = Query(20, ge=1, le=200, description="Nombre de séquences et de points d'abandon renvoyés"),
+    user = Depends(get_current_user)
+):
+    """
+    Analyse des parcours à partir des étapes brutes des sessions (funnel strict,
+    séquences fréquentes, temps entre étapes, points d'abandon). Réservée au
+    propriétaire de l'assistant ; calcul vectorisé (voir app.services.step_analysis).
+    """
+    if not ObjectId.is_valid(assistant_id):
+        raise HTTPException(status_code=400, detail="ID d'assistant invalide")
+    try:
+        db = await get_database()
+        assistant = await db[ASSISTANTS_COLLECTION].find_one(
+            {"_id": ObjectId(assistant_id), "user_id": user["id"]}, {"_id": 1}
+        )
+        if not assistant:
+            raise HTTPException(status_code=404, detail="Assistant non trouvé")
+        
+        start = datetime.utcnow() - timedelta(days=days)
+        node_ids = [node_id.strip() for node_id in (path or "").split(",") if node_id.strip()]
+        report = await analyze_assistant(db, assistant_id, start, path=node_ids, ngram=ngram, top=top)
+        return {"assistant_id": assistant_id, "days": days, **report}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erreur lors de l'analyse des parcours: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
 @router.get("/sources", response_model=List[Dict[str, Any]])
@@ -411,9 +574,34 @@ async def get_traffic_sources(
         
         return sources_data
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des sources de trafic: {str(e)}")
+        logger.error("Erreur lors de la récupération des sources de trafic: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
+async def _merged_responses(assistant_id: str, days: int, user: Dict[str, Any]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    db = await get_database()
+    
+    # Réservé au propriétaire de l'assistant ; les compteurs sont écrits sous
+    # l'identifiant reçu par la session (ObjectId ou public_id) : les deux sont lus
+    resolved = await resolve_assistant(assistant_id)
+    owned = None
+    if resolved:
+        owned = await db[ASSISTANTS_COLLECTION].find_one(
+            {"_id": ObjectId(resolved["id"]), "user_id": user["id"]}, {"_id": 1}
+        )
+    if not owned:
+        raise HTTPException(status_code=404, detail="Assistant non trouvé")
+    assistant_ids = [resolved["id"]] + ([resolved["public_id"]] if resolved.get("public_id") else [])
+    
+    # Calculer la date de début
+    start_date = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d")
+    
+    # Seuls les compteurs de réponses et les résumés des champs libres sont lus
+    analytics_data = await db[ANALYTICS_COLLECTION].find(
+        {"assistant_id": {"$in": assistant_ids}, "date": {"$gte": start_date}},
+        {"responses": 1, RESPONSE_SKETCHES_FIELD: 1}
+    ).to_list(None)
+    return merge_responses(analytics_data)
+
 @router.get("/responses", response_model=Dict[str, Dict[str, Dict[str, int]]])
 async def get_user_responses(
     assistant_id: str,
@@ -421,45 +609,115 @@ async def get_user_responses(
     user = Depends(get_current_user)
 ):
     """
-    Récupère les réponses des utilisateurs pour un assistant spécifique.
+    Récupère les réponses des utilisateurs pour un assistant spécifique
+    (toutes les valeurs des champs à choix, les plus fréquentes des champs libres).
     """
     try:
-        db = await get_database()
-        
-        # Calculer la date de début
-        start_date = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d")
-        
-        # Récupérer les données d'analytics
-        analytics_data = await db[ANALYTICS_COLLECTION].find({
-            "assistant_id": assistant_id,
-            "date": {"$gte": start_date}
-        }).to_list(100)
-        
-        # Agréger les réponses
-        responses = {}
-        
-        for data in analytics_data:
-            if "responses" in data:
-                for node_id, fields in data["responses"].items():
-                    if node_id not in responses:
-                        responses[node_id] = {}
-                    
-                    for field_name, values in fields.items():
-                        if field_name not in responses[node_id]:
-                            responses[node_id][field_name] = {}
-                        
-                        for value, count in values.items():
-                            if value not in responses[node_id][field_name]:
-                                responses[node_id][field_name][value] = 0
-                            
-                            responses[node_id][field_name][value] += count
-        
-        return responses
+        merged = await _merged_responses(assistant_id, days, user)
+        return {
+            node_id: {
+                field_name: {row["value"]: row["count"] for row in field["top"]}
+                for field_name, field in fields.items()
+            }
+            for node_id, fields in merged.items()
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erreur lors de la récupération des réponses utilisateurs: %s", e)
+        raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+
+@router.get("/responses/summary", response_model=Dict[str, Dict[str, Dict[str, Any]]])
+async def get_user_responses_summary(
+    assistant_id: str,
+    days: int = Query(30, description="Nombre de jours à analyser"),
+    user = Depends(get_current_user)
+):
+    """
+    Résumé des réponses par nœud et par champ : nature du champ (choix ou
+    saisie libre), nombre de réponses, nombre de valeurs distinctes (estimé
+    pour les champs libres) et valeurs les plus fréquentes avec leur marge
+    d'erreur.
+    """
+    try:
+        return await _merged_responses(assistant_id, days, user)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erreur lors de la récupération du résumé des réponses: %s", e)
+        raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+
+async def _check_session_owner(session_id: str, user: Dict[str, Any]):
+    """
+    Vérifie que la session appartient à un assistant de l'utilisateur (404 sinon)
+    """
+    db = await get_database()
+    session = await db[SESSIONS_COLLECTION].find_one({"_id": ObjectId(session_id)}, {"assistant_id": 1})
+    resolved = await resolve_assistant(session["assistant_id"]) if session else None
+    owned = None
+    if resolved:
+        owned = await db[ASSISTANTS_COLLECTION].find_one(
+            {"_id": ObjectId(resolved["id"]), "user_id": user["id"]}, {"_id": 1}
+        )
+    if not owned:
+        raise HTTPException(status_code=404, detail="Session non trouvée")
+
+@router.get("/sessions/{session_id}/interactions", response_model=Dict[str, Any])
+async def get_session_interactions(
+    session_id: str,
+    user = Depends(get_current_user)
+):
+    """
+    Récupère toutes les interactions d'une session (conversations, Q/R, formulaires).
+    """
+    if not ObjectId.is_valid(session_id):
+        raise HTTPException(status_code=400, detail="ID de session invalide")
+    
+    try:
+        await _check_session_owner(session_id, user)
+        interactions = await AnalyticsService.get_session_interactions(session_id)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des réponses utilisateurs: {str(e)}")
+        logger.error("Erreur lors de la récupération des interactions: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+    
+    if interactions is None:
+        raise HTTPException(status_code=404, detail="Session non trouvée")
+    
+    return interactions
 
-@router.post("/track_message")
+@router.get("/sessions/{session_id}/conversation/stream")
+async def stream_session_conversation(
+    session_id: str,
+    user = Depends(get_current_user)
+):
+    """
+    Diffuse la conversation d'une session au format NDJSON (un message par ligne),
+    lue par lots pour les transcriptions longues.
+    """
+    if not ObjectId.is_valid(session_id):
+        raise HTTPException(status_code=400, detail="ID de session invalide")
+    
+    # Vérifiée avant le début de la diffusion (le statut HTTP est alors envoyé)
+    try:
+        await _check_session_owner(session_id, user)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erreur lors de la lecture de la session %s: %s", session_id, e)
+        raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+    
+    async def generate():
+        async for message in AnalyticsService.stream_session_conversation(session_id):
+            yield json.dumps(jsonable_encoder(message)) + "\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@router.post("/track_message", dependencies=[
+    Depends(rate_limit("track_message_ip")),
+    Depends(rate_limit("track_message_session", body_field("session_id")))
+])
 async def track_message_api(request: Request):
     data = await request.json()
     session_id = data.get("session_id")
@@ -502,10 +760,11 @@ async def debug_analytics(assistant_id: str, request: Request, days: int = 30):
         start_date = end_date - timedelta(days=days)
         
         # Récupérer les données d'analytiques pour la période
+        # (sans les sketches binaires : HyperLogLog des uniques et des réponses libres)
         analytics_data = await db[ANALYTICS_COLLECTION].find({
             "assistant_id": {"$in": [str(query_id), assistant_id]},
             "date": {"$gte": start_date.strftime("%Y-%m-%d"), "$lte": end_date.strftime("%Y-%m-%d")}
-        }).to_list(1000)
+        }, {UNIQUES_FIELD: 0, RESPONSE_SKETCHES_FIELD: 0}).to_list(None)
         
         # Récupérer les sessions pour la période
         sessions_data = await db[SESSIONS_COLLECTION].find({
@@ -1,24 +1,32 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Request, Body
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
-from typing import List, Dict, Any, Union
+from typing import List, Dict, Any, Optional, Union
 from bson import ObjectId, errors as bson_errors
 from datetime import datetime
 import logging
 import json
 import traceback
 import uuid
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
 import os
 from pathlib import Path
 
-from app.models.assistant import AssistantCreate, AssistantUpdate, AssistantResponse, Node, Edge, Element, AssistantPublish, EmbedScriptResponse
+from app.models.assistant import AssistantCreate, AssistantUpdate, AssistantResponse, AssistantSummary, AssistantStats, Node, Edge, Element, AssistantPublish, EmbedScriptResponse
 from app.database.mongodb import get_database
 from app.api.auth import get_current_user
+from app.services.assistant_resolver import reverse_public_id, PUBLIC_ID_REV_FIELD
+from app.services.assistant_snapshots import (
+    publish_snapshot, get_snapshot, get_published_pointer, delete_snapshots,
+    pointer_fields, snapshot_json, PUBLISHED_HASH_FIELD, PUBLISHED_VERSION_FIELD
+)
+from app.services.cache_invalidation import invalidation_bus
+from app.services.flow_graph import COMPILED_FLOW_FIELD, compile_assistant
+from app.utils.cache import TTLCache
+from app.utils.serialization import FastJSONResponse, dumps_document, dumps_list, serialized_cache
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO)
+# Logger du module (configuré dans app/utils/logging_config.py)
 logger = logging.getLogger("assistant_api")
 
 router = APIRouter()
@@ -30,9 +38,30 @@ templates = Jinja2Templates(directory=str(templates_dir))
 
 # Collection MongoDB pour les assistants
 COLLECTION = "assistants"
+ANALYTICS_COLLECTION = "analytics"
 
-# Niveau de log
-logger.setLevel(logging.DEBUG)
+# Statistiques des cartes du dashboard, par utilisateur (rafraîchies au plus toutes les minutes)
+summary_stats_cache = TTLCache("assistant_summary_stats", maxsize=1000, ttl=60)
+
+def forget_cached_responses(assistant_id: str):
+    """
+    Retire des caches de réponses les entrées d'un assistant modifié ou supprimé
+    """
+    serialized_cache.evict_where(lambda key, value: key[1] == assistant_id)
+    summary_stats_cache.evict_where(lambda key, value: assistant_id in value)
+
+invalidation_bus.register(COLLECTION, forget_cached_responses, summary_stats_cache.clear)
+
+# Projection de la liste allégée : le graphe n'est jamais lu, seule sa taille est calculée
+SUMMARY_PROJECTION = {
+    "name": 1,
+    "description": 1,
+    "is_published": 1,
+    "public_id": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "node_count": {"$size": {"$ifNull": ["$nodes", []]}}
+}
 
 # Convertir un document MongoDB en modèle de réponse
 def assistant_to_response(assistant: Dict[str, Any]) -> Dict[str, Any]:
@@ -74,6 +103,8 @@ def assistant_to_response(assistant: Dict[str, Any]) -> Dict[str, Any]:
             "is_published": is_published,
             "publish_date": publish_date,
             "public_id": assistant.get("public_id"),
+            "published_version": assistant.get(PUBLISHED_VERSION_FIELD),
+            "validation_errors": (assistant.get(COMPILED_FLOW_FIELD) or {}).get("errors", []),
             "created_at": created_at,
             "updated_at": updated_at
         }
@@ -85,10 +116,118 @@ def assistant_to_response(assistant: Dict[str, Any]) -> Dict[str, Any]:
             response["embed_script"] = None
         return response
     except Exception as e:
-        logger.error(f"Erreur lors de la conversion de l'assistant: {str(e)}")
+        logger.error("Erreur lors de la conversion de l'assistant: %s", e)
         logger.error(traceback.format_exc())
         return assistant
 
+def flow_to_response(assistant: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Données du flow utilisées par le widget de chat
+    """
+    assistant_data = assistant_to_response(assistant)
+    return {
+        "id": assistant_data["id"],
+        "name": assistant_data["name"],
+        "nodes": assistant_data["nodes"],
+        "edges": assistant_data["edges"]
+    }
+
+async def load_published_snapshot(public_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Snapshot publié d'un assistant public, ou None s'il n'existe pas ou n'est
+    pas publié. Un assistant publié avant l'introduction des snapshots reçoit
+    le sien au premier accès.
+    """
+    pointer = await get_published_pointer(public_id)
+    if not pointer:
+        return None
+    
+    digest = pointer.get(PUBLISHED_HASH_FIELD)
+    snapshot = await get_snapshot(digest) if digest else None
+    if snapshot is None:
+        db = await get_database()
+        assistant = await db[COLLECTION].find_one({"_id": pointer["_id"]})
+        snapshot = await publish_snapshot(assistant, flow_to_response(assistant))
+        await db[COLLECTION].update_one({"_id": pointer["_id"]}, {"$set": pointer_fields(snapshot)})
+    return snapshot
+
+def snapshot_response(snapshot: Dict[str, Any], request: Request, cache_control: str) -> Response:
+    """
+    Sert le flow d'un snapshot ; le hash du contenu sert d'ETag
+    """
+    headers = {
+        "ETag": f'"{snapshot["content_hash"]}"',
+        "Cache-Control": cache_control,
+        "X-Flow-Version": str(snapshot["version"])
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return FastJSONResponse(snapshot_json(snapshot), status_code=status.HTTP_200_OK, headers=headers)
+
+async def get_headline_stats(db, user_id: str, assistants: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Sessions, leads et taux de conversion de chaque assistant, calculés en une
+    seule agrégation sur les compteurs d'analytics puis mis en cache
+    """
+    cached = summary_stats_cache.get(user_id)
+    if cached is not None:
+        return cached
+    
+    # Les compteurs peuvent être rattachés à l'_id ou au public_id de l'assistant
+    keys = {}
+    for assistant in assistants:
+        keys[str(assistant["_id"])] = str(assistant["_id"])
+        if assistant.get("public_id"):
+            keys[assistant["public_id"]] = str(assistant["_id"])
+    
+    stats = {}
+    if keys:
+        pipeline = [
+            {"$match": {"assistant_id": {"$in": list(keys)}}},
+            {"$group": {
+                "_id": "$assistant_id",
+                "sessions_count": {"$sum": "$sessions_count"},
+                "leads_count": {"$sum": "$leads_count"}
+            }}
+        ]
+        async for row in db[ANALYTICS_COLLECTION].aggregate(pipeline):
+            entry = stats.setdefault(keys[row["_id"]], {"sessions_count": 0, "leads_count": 0})
+            entry["sessions_count"] += row.get("sessions_count") or 0
+            entry["leads_count"] += row.get("leads_count") or 0
+    
+    for entry in stats.values():
+        sessions_count = entry["sessions_count"]
+        entry["conversion_rate"] = round(entry["leads_count"] / sessions_count * 100, 2) if sessions_count else 0.0
+    
+    summary_stats_cache.set(user_id, stats)
+    return stats
+
+async def list_assistant_summaries(user_id: str) -> List[Dict[str, Any]]:
+    """
+    Liste allégée des assistants d'un utilisateur (sans nodes ni edges)
+    """
+    db = await get_database()
+    assistants = await db[COLLECTION].aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$project": SUMMARY_PROJECTION}
+    ]).to_list(length=None)
+    
+    stats = await get_headline_stats(db, user_id, assistants)
+    return [
+        {
+            "id": str(assistant["_id"]),
+            "name": assistant.get("name", ""),
+            "description": assistant.get("description", ""),
+            "is_published": assistant.get("is_published", False),
+            "public_id": assistant.get("public_id"),
+            "node_count": assistant.get("node_count", 0),
+            "created_at": assistant.get("created_at"),
+            "updated_at": assistant.get("updated_at"),
+            "stats": stats.get(str(assistant["_id"])) or AssistantStats().dict()
+        }
+        for assistant in assistants
+    ]
+
 @router.post("/", response_model=AssistantResponse, status_code=status.HTTP_201_CREATED)
 async def create_assistant(assistant: AssistantCreate, request: Request, user = Depends(get_current_user)):
     """
@@ -154,6 +293,9 @@ async def create_assistant(assistant: AssistantCreate, request: Request, user =
                 }
             ]
         
+        # Compiler le graphe (progression des sessions, erreurs affichées dans l'éditeur)
+        assistant_dict[COMPILED_FLOW_FIELD] = compile_assistant(assistant_dict)
+        
         # Insérer le document
         result = await collection.insert_one(assistant_dict)
         
@@ -169,7 +311,7 @@ async def create_assistant(assistant: AssistantCreate, request: Request, user =
         )
     
     except Exception as e:
-        logger.error(f"Erreur lors de la création de l'assistant: {str(e)}")
+        logger.error("Erreur lors de la création de l'assistant: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -188,16 +330,34 @@ async def get_assistants(request: Request, user = Depends(get_current_user)):
         # Récupérer uniquement les assistants de l'utilisateur connecté
         assistants = await collection.find({"user_id": user["id"]}).to_list(length=100)
         
-        # Convertir en format de réponse
-        response_data = [assistant_to_response(assistant) for assistant in assistants]
-        
+        # Sérialiser chaque assistant (réutilisé tant qu'il n'est pas modifié)
+        return FastJSONResponse(
+            dumps_list(dumps_document("assistant", assistant, assistant_to_response) for assistant in assistants),
+            status_code=status.HTTP_200_OK
+        )
+    
+    except Exception as e:
+        logger.error("Erreur lors de la récupération des assistants: %s", e)
+        logger.error(traceback.format_exc())
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Une erreur est survenue lors de la récupération des assistants"
+        )
+
+@router.get("/summary", response_model=List[AssistantSummary])
+async def get_assistant_summaries(request: Request, user = Depends(get_current_user)):
+    """
+    Liste allégée des assistants pour les cartes du dashboard : pas de graphe,
+    seulement le nombre de nœuds et les statistiques principales.
+    """
+    try:
         return JSONResponse(
             status_code=status.HTTP_200_OK,
-            content=jsonable_encoder(response_data)
+            content=jsonable_encoder(await list_assistant_summaries(user["id"]))
         )
     
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des assistants: {str(e)}")
+        logger.error("Erreur lors de la récupération des assistants: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -231,18 +391,16 @@ async def get_assistant(assistant_id: str, request: Request, user = Depends(get_
                 detail="Assistant non trouvé"
             )
         
-        # Convertir en format de réponse
-        response_data = assistant_to_response(assistant)
-        
-        return JSONResponse(
-            status_code=status.HTTP_200_OK,
-            content=jsonable_encoder(response_data)
+        # Convertir en format de réponse (octets JSON mis en cache par version)
+        return FastJSONResponse(
+            dumps_document("assistant", assistant, assistant_to_response),
+            status_code=status.HTTP_200_OK
         )
     
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération de l'assistant: {str(e)}")
+        logger.error("Erreur lors de la récupération de l'assistant: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -280,8 +438,13 @@ async def update_assistant(assistant_id: str, assistant_update: AssistantUpdate,
         update_data = assistant_update.dict(exclude_unset=True)
         update_data["updated_at"] = datetime.utcnow()
         
+        # Recompiler le graphe si les nœuds ou les connexions changent
+        if "nodes" in update_data or "edges" in update_data:
+            update_data[COMPILED_FLOW_FIELD] = compile_assistant({**assistant, **update_data})
+        
         # Mettre à jour l'assistant
         await collection.update_one({"_id": object_id}, {"$set": update_data})
+        await invalidation_bus.publish(COLLECTION, assistant_id)
         
         # Récupérer l'assistant mis à jour
         updated_assistant = await collection.find_one({"_id": object_id})
@@ -297,7 +460,7 @@ async def update_assistant(assistant_id: str, assistant_update: AssistantUpdate,
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erreur lors de la mise à jour de l'assistant: {str(e)}")
+        logger.error("Erreur lors de la mise à jour de l'assistant: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -331,8 +494,10 @@ async def delete_assistant(assistant_id: str, request: Request, user = Depends(g
                 detail="Assistant non trouvé"
             )
         
-        # Supprimer l'assistant
+        # Supprimer l'assistant et ses snapshots publiés
         await collection.delete_one({"_id": object_id})
+        await delete_snapshots(assistant_id)
+        await invalidation_bus.publish(COLLECTION, assistant_id)
         
         return JSONResponse(
             status_code=status.HTTP_200_OK,
@@ -342,7 +507,7 @@ async def delete_assistant(assistant_id: str, request: Request, user = Depends(g
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erreur lors de la suppression de l'assistant: {str(e)}")
+        logger.error("Erreur lors de la suppression de l'assistant: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -368,6 +533,16 @@ async def import_assistant(request: Request, assistant_data: Dict[str, Any] = Bo
         if "_id" in assistant_data:
             del assistant_data["_id"]
         
+        # Les snapshots publiés ne sont pas exportés : le pointeur n'a pas de sens ici
+        assistant_data.pop(PUBLISHED_VERSION_FIELD, None)
+        assistant_data.pop(PUBLISHED_HASH_FIELD, None)
+        
+        # Garder la clé de recherche par ID court cohérente avec le public_id importé
+        if isinstance(assistant_data.get("public_id"), str):
+            assistant_data[PUBLIC_ID_REV_FIELD] = reverse_public_id(assistant_data["public_id"])
+        
+        assistant_data[COMPILED_FLOW_FIELD] = compile_assistant(assistant_data)
+        
         # Insérer le document
         result = await collection.insert_one(assistant_data)
         
@@ -383,7 +558,7 @@ async def import_assistant(request: Request, assistant_data: Dict[str, Any] = Bo
         )
     
     except Exception as e:
-        logger.error(f"Erreur lors de l'importation de l'assistant: {str(e)}")
+        logger.error("Erreur lors de l'importation de l'assistant: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -422,7 +597,7 @@ async def publish_assistant(assistant_id: str, publish_data: AssistantPublish, r
         
         # Si on publie l'assistant
         if publish_data.is_published:
-            logger.info(f"Publication de l'assistant {assistant_id}")
+            logger.info("Publication de l'assistant %s", assistant_id)
             
             # Générer ou récupérer un public_id
             public_id = assistant.get("public_id")
@@ -431,14 +606,15 @@ async def publish_assistant(assistant_id: str, publish_data: AssistantPublish, r
                 public_id = f"bot-{str(uuid.uuid4())}"
             
             update_data["public_id"] = public_id
+            update_data[PUBLIC_ID_REV_FIELD] = reverse_public_id(public_id)
             update_data["publish_date"] = datetime.utcnow()
             update_data["is_published"] = True
-            logger.info(f"Identifiant public généré: {public_id}")
+            logger.info("Identifiant public généré: %s", public_id)
             
             # Générer et stocker l'URL public et le script d'intégration
             base_url = str(request.base_url).rstrip('/')
             public_url = f"{base_url}/chat/{public_id}"
-            logger.info(f"URL publique générée: {public_url}")
+            logger.info("URL publique générée: %s", public_url)
             
             # Générer le script d'intégration
             script = f"""
@@ -457,25 +633,36 @@ async def publish_assistant(assistant_id: str, publish_data: AssistantPublish, r
             update_data["public_url"] = public_url
             update_data["embed_script"] = script
             
-            logger.info(f"Données de mise à jour préparées: {update_data}")
+            # Figer le flow actuel dans un snapshot immuable, servi aux visiteurs
+            # jusqu'à la prochaine publication
+            snapshot = await publish_snapshot({**assistant, "public_id": public_id}, flow_to_response(assistant))
+            update_data.update(pointer_fields(snapshot))
+            update_data[COMPILED_FLOW_FIELD] = snapshot.get(COMPILED_FLOW_FIELD) or compile_assistant(assistant)
+            logger.info("Snapshot publié: version %s (%s)", snapshot["version"], snapshot["content_hash"])
+            
+            logger.debug("Données de mise à jour préparées: %s", update_data)
         else:
             # Si on dépublie, on garde les données mais on met is_published à False
             update_data["is_published"] = False
-            logger.info(f"Dépublication de l'assistant {assistant_id}")
+            logger.info("Dépublication de l'assistant %s", assistant_id)
             # Ne pas effacer les autres champs pour permettre une republication facile
         
         # Mettre à jour l'assistant
-        logger.info(f"Mise à jour de l'assistant {assistant_id} avec les données: {update_data}")
+        logger.debug("Mise à jour de l'assistant %s avec les données: %s", assistant_id, update_data)
         result = await collection.update_one({"_id": object_id}, {"$set": update_data})
-        logger.info(f"Résultat de la mise à jour: matched={result.matched_count}, modified={result.modified_count}")
+        logger.info("Résultat de la mise à jour: matched=%s, modified=%s", result.matched_count, result.modified_count)
+        
+        # Le résolveur de tous les workers met en cache la version publiée
+        # enregistrée dans les sessions
+        await invalidation_bus.publish(COLLECTION, assistant_id)
         
         # Récupérer l'assistant mis à jour
         updated_assistant = await collection.find_one({"_id": object_id})
-        logger.info(f"Assistant mis à jour récupéré: {updated_assistant.get('is_published')}, {updated_assistant.get('public_id')}, {updated_assistant.get('public_url') is not None}")
+        logger.info("Assistant mis à jour récupéré: %s, %s, %s", updated_assistant.get('is_published'), updated_assistant.get('public_id'), updated_assistant.get('public_url') is not None)
         
         # Convertir en format de réponse
         response_data = assistant_to_response(updated_assistant)
-        logger.info(f"Données de réponse préparées: {response_data['is_published']}, {response_data['public_id']}, {response_data['public_url'] is not None}")
+        logger.info("Données de réponse préparées: %s, %s, %s", response_data['is_published'], response_data['public_id'], response_data['public_url'] is not None)
         
         return JSONResponse(
             status_code=status.HTTP_200_OK,
@@ -485,7 +672,7 @@ async def publish_assistant(assistant_id: str, publish_data: AssistantPublish, r
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erreur lors de la publication de l'assistant: {str(e)}")
+        logger.error("Erreur lors de la publication de l'assistant: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -574,7 +761,7 @@ async def get_embed_script(assistant_id: str, request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erreur lors de la génération du script d'intégration: {str(e)}")
+        logger.error("Erreur lors de la génération du script d'intégration: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -631,7 +818,7 @@ async def debug_assistant(assistant_id: str, request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erreur lors du diagnostic de l'assistant: {str(e)}")
+        logger.error("Erreur lors du diagnostic de l'assistant: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -710,55 +897,55 @@ async def get_public_assistant_legacy(public_id: str, request: Request):
 @router.get("/{public_id}/flow", response_model=dict)
 async def get_assistant_flow(public_id: str, request: Request):
     """
-    Récupère les données du flow pour un assistant public.
+    Récupère les données du flow pour un assistant public, depuis son snapshot
+    publié (revalidé par ETag).
     """
-    logger.info(f"🔍 Route GET /{public_id}/flow appelée - Récupération du flow pour l'assistant avec public_id: {public_id}")
+    logger.debug("Route GET /%s/flow appelée - Récupération du flow pour l'assistant avec public_id: %s", public_id, public_id)
     try:
-        db = await get_database()
-        collection = db[COLLECTION]
+        snapshot = await load_published_snapshot(public_id)
         
-        # Récupérer l'assistant par son public_id
-        logger.info(f"🔎 Recherche de l'assistant avec public_id: {public_id}")
-        assistant = await collection.find_one({"public_id": public_id})
-        
-        if not assistant:
-            logger.warning(f"❌ Assistant avec public_id {public_id} non trouvé")
+        if not snapshot:
+            logger.warning("Assistant avec public_id %s non trouvé ou non publié", public_id)
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail="Assistant non trouvé"
+                detail="Assistant non trouvé ou non publié"
             )
         
-        # Vérifier si l'assistant est publié
-        logger.info(f"✅ Assistant trouvé, vérification du statut de publication")
-        if not assistant.get("is_published", False):
-            logger.warning(f"❌ Assistant avec public_id {public_id} n'est pas publié")
+        # Retourner uniquement les données nécessaires pour le flow
+        logger.debug("Flow de l'assistant %s servi depuis le snapshot %s", public_id, snapshot["version"])
+        return snapshot_response(snapshot, request, "no-cache")
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Erreur lors de la récupération du flow de l'assistant: %s", e)
+        logger.error(traceback.format_exc())
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Une erreur est survenue lors de la récupération du flow de l'assistant"
+        )
+
+@router.get("/{public_id}/flow/{content_hash}", response_model=dict)
+async def get_assistant_flow_snapshot(public_id: str, content_hash: str, request: Request):
+    """
+    Récupère une version précise du flow par son hash. Le contenu étant immuable,
+    la réponse peut être mise en cache indéfiniment (navigateur, CDN).
+    """
+    try:
+        snapshot = await get_snapshot(content_hash)
+        
+        if not snapshot or snapshot.get("public_id") != public_id or not await get_published_pointer(public_id):
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail="Assistant non trouvé ou non publié"
+                detail="Version du flow non trouvée"
             )
         
-        # Convertir en format de réponse
-        logger.info(f"🔄 Conversion des données de l'assistant en format de réponse")
-        assistant_data = assistant_to_response(assistant)
-        
-        # Retourner uniquement les données nécessaires pour le flow
-        flow_data = {
-            "id": assistant_data["id"],
-            "name": assistant_data["name"],
-            "nodes": assistant_data["nodes"],
-            "edges": assistant_data["edges"]
-        }
-        
-        logger.info(f"✅ Données du flow récupérées avec succès pour l'assistant {public_id}")
-        return JSONResponse(
-            status_code=status.HTTP_200_OK,
-            content=jsonable_encoder(flow_data)
-        )
+        return snapshot_response(snapshot, request, "public, max-age=31536000, immutable")
     
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération du flow de l'assistant: {str(e)}")
+        logger.error("Erreur lors de la récupération du snapshot du flow: %s", e)
         logger.error(traceback.format_exc())
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException, status, Depends, BackgroundTasks, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from app.models.auth import UserRegister, UserLogin, UserResponse, ForgotPassword, ResetPassword, TokenResponse, Token
-from app.services.user_service import create_user, authenticate_user, get_user_by_email, update_user_password
+from app.services.user_service import create_user, authenticate_user, get_user_by_email, get_cached_user_by_email, update_user_password
 from app.utils.auth_utils import create_access_token, decode_token, create_password_reset_token, verify_password_reset_token
 from datetime import datetime, timedelta
 from typing import Optional
@@ -10,6 +10,8 @@ import os
 from passlib.context import CryptContext
 from app.database.mongodb import get_database
 
+logger = logging.getLogger("auth_api")
+
 router = APIRouter()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 JWT_SECRET = os.getenv("JWT_SECRET", "secret")
@@ -22,7 +24,7 @@ async def send_password_reset_email(email: str, token: str, request: Request):
     # Dans un environnement de production, vous utiliseriez un service d'email
     # comme SendGrid, Mailgun, etc.
     reset_url = f"{request.base_url}reset-password?token={token}"
-    logger.info(f"Email de réinitialisation envoyé à {email} avec URL: {reset_url}")
+    logger.info("Email de réinitialisation envoyé à %s avec URL: %s", email, reset_url)
     # Implémentation réelle: appel à un service d'email
 
 # Middleware pour obtenir l'utilisateur actuel
@@ -35,7 +37,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> Optional[dict
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = await get_user_by_email(token_data.sub)
+    user = await get_cached_user_by_email(token_data.sub)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -54,7 +56,7 @@ async def register(user: UserRegister):
     except HTTPException as e:
         raise e
     except Exception as e:
-        logger.error(f"Erreur lors de l'enregistrement: {str(e)}")
+        logger.error("Erreur lors de l'enregistrement: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Une erreur est survenue lors de l'enregistrement"
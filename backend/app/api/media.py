@@ -1,4 +1,4 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
 from fastapi.responses import JSONResponse
 import os
 import uuid
@@ -7,8 +7,9 @@ import logging
 from datetime import datetime
 from typing import Optional
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO)
+from app.utils.rate_limit import rate_limit
+
+# Logger du module (configuré dans app/utils/logging_config.py)
 logger = logging.getLogger("media_api")
 
 # Création du router
@@ -21,7 +22,7 @@ os.makedirs(MEDIA_DIR, exist_ok=True)
 # URL de base pour accéder aux médias
 MEDIA_URL_BASE = "/static/media"
 
-@media_router.post("/upload/media")
+@media_router.post("/upload/media", dependencies=[Depends(rate_limit("upload_ip"))])
 async def upload_media(
     file: UploadFile = File(...),
     type: str = Form(...)
@@ -53,11 +54,11 @@ async def upload_media(
         # Chemin relatif pour l'accès depuis le frontend
         relative_path = f"{MEDIA_URL_BASE}/{type}/{unique_filename}"
         
-        logger.info(f"Fichier média uploadé avec succès: {relative_path}")
+        logger.info("Fichier média uploadé avec succès: %s", relative_path)
         
         return {"path": relative_path}
     
     except Exception as e:
-        logger.error(f"Erreur lors de l'upload du fichier: {str(e)}")
+        logger.error("Erreur lors de l'upload du fichier: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur lors de l'upload du fichier: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erreur lors de l'upload: {str(e)}")
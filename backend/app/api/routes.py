@@ -6,8 +6,7 @@ from app.api.session import router as session_router
 from app.api.analytics import router as analytics_router
 import logging
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO)
+# Logger du module (configuré dans app/utils/logging_config.py)
 logger = logging.getLogger("api")
 
 # Router principal
@@ -1,34 +1,46 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Request, Body
+from fastapi import APIRouter, HTTPException, Depends, status, Request, Response, Body
 from fastapi.responses import JSONResponse
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Awaitable
 from bson import ObjectId
 from datetime import datetime, timedelta
+import asyncio
+import json
 import logging
 import traceback
+from pymongo.errors import BulkWriteError, PyMongoError
 from app.models.session import (
-    SessionCreate, MessageCreate, SessionStepCreate,
-    SessionResponse, MessageResponse, SessionStepResponse,
+    SessionCreate, MessageCreate, SessionStepCreate, AdvanceRequest,
+    SessionResponse, MessageResponse, SessionStepResponse, AdvanceResponse,
     SessionStatus, LeadStatus, MessageSender, MessageContentType,
     AnalyticsOverview, AnalyticsResponse
 )
 from app.database.mongodb import get_database
 from app.api.auth import get_current_user
-from app.services.analytics_service import analytics_service
+from app.services.analytics_service import analytics_service, merge_responses, visitor_id
+from app.services.event_log import load_session_messages
+from app.services.event_spool import event_spool, is_transient_error, DUPLICATE_KEY_ERROR
+from app.services.flow_graph import count_reachable_nodes, remaining_distance, node_flag, is_end_node
+from app.services.flow_engine import compile_flow, node_question, node_responses
+from app.services.assistant_resolver import resolve_assistant, resolve_assistant_id
+from app.services.assistant_snapshots import load_session_flow
+from app.utils.serialization import FastJSONResponse
+from app.utils.rate_limit import rate_limit, path_param, body_field, client_ip
+from app.utils.idempotency import idempotent
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO)
+# Logger du module (configuré dans app/utils/logging_config.py)
 logger = logging.getLogger("session_api")
-logger.setLevel(logging.DEBUG)
 
 router = APIRouter()
 
 # Collections MongoDB
 SESSIONS_COLLECTION = "sessions"
-MESSAGES_COLLECTION = "messages"
 STEPS_COLLECTION = "session_steps"
 ASSISTANTS_COLLECTION = "assistants"
 ANALYTICS_COLLECTION = "analytics"
 
+# Compteur de tours d'une session (POST /advance) : réservation atomique d'un tour
+TURN_FIELD = "turn"
+
 # Convertir un document MongoDB en modèle de réponse
 def session_to_response(session: Dict[str, Any]) -> Dict[str, Any]:
     session_id = str(session["_id"])
@@ -42,7 +54,8 @@ def session_to_response(session: Dict[str, Any]) -> Dict[str, Any]:
         "current_node_id": session.get("current_node_id"),
         "started_at": session.get("started_at", datetime.utcnow()),
         "ended_at": session.get("ended_at"),
-        "completion_percentage": session.get("completion_percentage", 0.0)
+        "completion_percentage": session.get("completion_percentage", 0.0),
+        "flow_version": session.get("flow_version")
     }
 
 def message_to_response(message: Dict[str, Any]) -> Dict[str, Any]:
@@ -68,62 +81,82 @@ def step_to_response(step: Dict[str, Any]) -> Dict[str, Any]:
         "is_completed": step.get("is_completed", True)
     }
 
-@router.post("/", response_model=SessionResponse)
-async def create_session(session: SessionCreate, request: Request):
+def visited_node_update(
+    update_data: Dict[str, Any],
+    node_ids: List[str],
+    reachable_nodes: int,
+    remaining: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Pipeline de mise à jour atomique d'une session : ajoute les nœuds à `visited_nodes`
+    (sans doublon, comme $addToSet) et calcule le pourcentage de complétion à partir
+    de la taille de cet ensemble et, si elle est connue, de la distance restante
+    jusqu'à un nœud final depuis le nœud courant (graphe compilé). À défaut, le
+    dénominateur est le nombre de nœuds atteignables du flow.
+    """
+    visited_nodes = {"$setUnion": [{"$ifNull": ["$visited_nodes", []]}, {"$literal": node_ids}]}
+    visited_count = {"$size": "$visited_nodes"}
+    total = {"$add": [visited_count, remaining]} if remaining is not None else max(reachable_nodes, 1)
+    return [
+        {"$set": {
+            **{key: {"$literal": value} for key, value in update_data.items()},
+            "visited_nodes": visited_nodes
+        }},
+        {"$set": {
+            "visited_nodes_count": visited_count,
+            "completion_percentage": {
+                "$min": [100.0, {"$multiply": [{"$divide": [visited_count, total]}, 100]}]
+            }
+        }}
+    ]
+
+async def _within_budget(read: Awaitable[Any]) -> Any:
+    """
+    Lecture nécessaire à la requête, bornée par le budget de latence du spool :
+    MongoDB lent ou indisponible => 503 (le client réessaie) plutôt qu'une
+    requête bloquée jusqu'au délai du driver
+    """
+    try:
+        return await asyncio.wait_for(read, event_spool.latency_budget)
+    except asyncio.TimeoutError:
+        logger.warning("Lecture MongoDB hors budget de latence (%ss)", event_spool.latency_budget)
+    except PyMongoError as e:
+        if not is_transient_error(e):
+            raise
+        logger.warning("Lecture MongoDB en échec: %s", e)
+    raise HTTPException(status_code=503, detail="Service temporairement indisponible", headers={"Retry-After": "1"})
+
+@router.post("/", response_model=SessionResponse, dependencies=[
+    Depends(rate_limit("session_create_ip")),
+    Depends(rate_limit("session_create_assistant", body_field("assistant_id")))
+])
+async def create_session(session: SessionCreate, request: Request, response: Response):
     """
-    Crée une nouvelle session pour un assistant.
+    Crée une nouvelle session pour un assistant. Une requête renvoyée avec le même
+    en-tête Idempotency-Key reçoit la session déjà créée.
     """
-    logger.info(f"🔍 Route POST / appelée - Création d'une session pour l'assistant: {session.assistant_id}")
-    logger.info(f"📋 Données reçues: {session.dict()}")
+    return await idempotent(request, response, lambda: _create_session(session, request))
+
+async def _create_session(session: SessionCreate, request: Request):
+    logger.debug("Route POST / appelée - Création d'une session pour l'assistant: %s", session.assistant_id)
+    logger.debug("Données reçues: %s", session.dict())
     
     try:
         db = await get_database()
         
-        # Vérifier si l'assistant existe
-        logger.info(f"🔎 Vérification de l'existence de l'assistant: {session.assistant_id}")
-        try:
-            # Essayer de trouver l'assistant par son ID MongoDB
-            object_id = ObjectId(session.assistant_id)
-            logger.info(f"🔄 ObjectId créé avec succès: {object_id}")
-            assistant = await db[ASSISTANTS_COLLECTION].find_one({"_id": object_id})
-            logger.info(f"🔍 Résultat de la recherche par _id: {assistant is not None}")
-            
-            # Si l'assistant n'est pas trouvé par son ID MongoDB, essayer de le trouver par son public_id
-            if not assistant and session.user_info and "public_id" in session.user_info:
-                public_id = session.user_info["public_id"]
-                logger.info(f"🔄 Tentative de recherche par public_id: {public_id}")
-                assistant = await db[ASSISTANTS_COLLECTION].find_one({"public_id": public_id})
-                logger.info(f"🔍 Résultat de la recherche par public_id: {assistant is not None}")
-                
-                # Si l'assistant est trouvé par son public_id, mettre à jour l'assistant_id dans la session
-                if assistant:
-                    logger.info(f"✅ Assistant trouvé par public_id, mise à jour de l'assistant_id")
-                    session.assistant_id = str(assistant["_id"])
-        except Exception as e:
-            logger.error(f"❌ Erreur lors de la recherche de l'assistant: {str(e)}")
-            if session.user_info and "public_id" in session.user_info:
-                public_id = session.user_info["public_id"]
-                logger.info(f"🔄 Tentative de recherche par public_id après erreur: {public_id}")
-                assistant = await db[ASSISTANTS_COLLECTION].find_one({"public_id": public_id})
-                logger.info(f"🔍 Résultat de la recherche par public_id: {assistant is not None}")
-                
-                # Si l'assistant est trouvé par son public_id, mettre à jour l'assistant_id dans la session
-                if assistant:
-                    logger.info(f"✅ Assistant trouvé par public_id, mise à jour de l'assistant_id")
-                    session.assistant_id = str(assistant["_id"])
-                else:
-                    logger.error(f"❌ Assistant non trouvé par public_id")
-                    raise HTTPException(status_code=404, detail="Assistant non trouvé")
-            else:
-                logger.error(f"❌ Erreur lors de la conversion de l'ID en ObjectId et pas de public_id disponible: {str(e)}")
-                raise HTTPException(status_code=400, detail=f"ID d'assistant invalide: {str(e)}")
+        # Résoudre l'assistant (ObjectId, public_id ou ID court), via le cache du résolveur
+        resolved = await resolve_assistant(session.assistant_id)
+        if not resolved and session.user_info and session.user_info.get("public_id"):
+            logger.debug("Assistant %s non trouvé, tentative avec le public_id %s", session.assistant_id, session.user_info["public_id"])
+            resolved = await resolve_assistant(session.user_info["public_id"])
         
-        if not assistant:
-            logger.warning(f"❌ Assistant avec ID {session.assistant_id} non trouvé")
+        if not resolved:
+            logger.warning("Assistant avec ID %s non trouvé", session.assistant_id)
             raise HTTPException(status_code=404, detail="Assistant non trouvé")
+        session.assistant_id = resolved["id"]
         
         # Créer la session
-        logger.info(f"📝 Création d'une nouvelle session pour l'assistant: {session.assistant_id}")
+        logger.debug("Création d'une nouvelle session pour l'assistant: %s", session.assistant_id)
         new_session = {
             "assistant_id": session.assistant_id,
             "user_id": session.user_id,
@@ -131,7 +164,14 @@ async def create_session(session: SessionCreate, request: Request):
             "status": SessionStatus.ACTIVE,
             "lead_status": LeadStatus.NONE,
             "started_at": datetime.utcnow(),
-            "completion_percentage": 0.0
+            "completion_percentage": 0.0,
+            # Version publiée du flow suivie par la session (snapshot immuable)
+            "flow_version": resolved["published_version"],
+            "flow_hash": resolved["published_hash"],
+            # Identifiant anonyme du visiteur (visiteurs et leads uniques)
+            "visitor_id": visitor_id(session.user_id, session.user_info, await client_ip(request)),
+            # Les interactions de la session sont stockées dans le journal d'événements
+            "event_log": True
         }
         
         result = await db[SESSIONS_COLLECTION].insert_one(new_session)
@@ -139,173 +179,451 @@ async def create_session(session: SessionCreate, request: Request):
         
         # Enregistrer le début de session pour les analytics
         session_id = str(result.inserted_id)
-        logger.info(f"📊 Enregistrement du début de session {session_id} pour les analytics")
-        await analytics_service.track_session_start(session_id, session.assistant_id, session.user_info)
+        logger.debug("Enregistrement du début de session %s pour les analytics", session_id)
+        await analytics_service.track_session_start(
+            session_id, session.assistant_id, session.user_info, new_session["visitor_id"]
+        )
         
-        logger.info(f"✅ Session créée avec succès: {session_id}")
+        logger.debug("Session créée avec succès: %s", session_id)
         return session_to_response(new_session)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Erreur lors de la création de la session: {str(e)}")
-        logger.error(f"Type d'erreur: {type(e).__name__}")
-        logger.error(f"Détails de la requête: {request.url}")
+        logger.error("Erreur lors de la création de la session: %s", e)
+        logger.error("Type d'erreur: %s", type(e).__name__)
+        logger.error("Détails de la requête: %s", request.url)
         # logger.error(f"Corps de la requête: {await request.json()}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
-@router.post("/{session_id}/messages", response_model=MessageResponse)
-async def add_message(session_id: str, message: MessageCreate, request: Request):
+@router.post("/{session_id}/messages", response_model=MessageResponse, dependencies=[
+    Depends(rate_limit("message_ip")),
+    Depends(rate_limit("message_session", path_param("session_id")))
+])
+async def add_message(session_id: str, message: MessageCreate, request: Request, response: Response):
     """
     Ajoute un message à une session existante et met à jour le statut de la session.
+    Une requête renvoyée avec le même en-tête Idempotency-Key reçoit le message
+    déjà enregistré, sans nouvelle écriture.
     """
+    return await idempotent(request, response, lambda: _add_message(session_id, message))
+
+async def _add_message(session_id: str, message: MessageCreate):
+    new_message = None
     try:
-        db = await get_database()
-        
-        # Vérifier si la session existe
-        session = await db[SESSIONS_COLLECTION].find_one({"_id": ObjectId(session_id)})
-        if not session:
+        # Vérifier si la session existe : assistant lu dans le cache des sessions
+        # suivies, à défaut dans la session (dans le budget de latence)
+        assistant_id = await _within_budget(analytics_service.get_session_assistant_id(session_id))
+        if not assistant_id:
             raise HTTPException(status_code=404, detail="Session non trouvée")
         
-        # Créer le message
-        new_message = {
-            "session_id": session_id,
-            "sender": message.sender,
-            "content": message.content,
-            "content_type": message.content_type,
-            "node_id": message.node_id,
-            "metadata": message.metadata,
-            "timestamp": datetime.utcnow()
-        }
-        
-        result = await db[MESSAGES_COLLECTION].insert_one(new_message)
-        new_message["_id"] = result.inserted_id
-        
-        # Enregistrer le message pour les analytics
-        await analytics_service.track_message(
+        # Enregistrer le message : une seule écriture dans le journal d'événements,
+        # qui met aussi à jour les compteurs d'analytics
+        new_message = await analytics_service.track_message(
             session_id=session_id,
-            message_type=str(message.content_type),
+            message_type=message.content_type.value,
             content=message.content,
             sender=message.sender,
             node_id=message.node_id,
+            metadata=message.metadata,
             is_question=getattr(message, 'is_question', False)
         )
         
         # Si c'est un message utilisateur avec un node_id, mettre à jour l'étape
         if message.sender == MessageSender.USER and message.node_id:
-            # Vérifier si le node est critique pour le statut de lead
-            assistant = await db[ASSISTANTS_COLLECTION].find_one({"_id": ObjectId(session["assistant_id"])})
-            if assistant and "nodes" in assistant:
-                nodes = assistant["nodes"]
-                current_node = next((node for node in nodes if node.get("id") == message.node_id), None)
-                
-                # Mettre à jour le statut de lead si nécessaire
-                update_data = {"current_node_id": message.node_id}
-                
-                if current_node:
-                    # Vérifier les propriétés du node pour le statut de lead
-                    new_lead_status = None
-                    
-                    # Ajouter des logs pour déboguer
-                    logger.info(f"🔍 Vérification du nœud {message.node_id} pour le statut de lead")
-                    logger.info(f"📊 Propriétés du nœud: is_partial_lead={current_node.get('is_partial_lead', False)}, is_complete_lead={current_node.get('is_complete_lead', False)}, is_final_node={current_node.get('is_final_node', False)}")
-                    logger.info(f"📊 Propriétés du nœud (data): is_partial_lead={current_node.get('data', {}).get('is_partial_lead', False)}, is_complete_lead={current_node.get('data', {}).get('is_complete_lead', False)}, is_final_node={current_node.get('data', {}).get('is_final_node', False)}")
-                    
-                    # Vérifier d'abord dans les propriétés directes du nœud
-                    if current_node.get("is_partial_lead", False) and session["lead_status"] == LeadStatus.NONE:
-                        update_data["lead_status"] = LeadStatus.PARTIAL
-                        new_lead_status = LeadStatus.PARTIAL
-                        logger.info(f"✅ Nœud marqué comme lead partiel (propriété directe)")
-                    
-                    if current_node.get("is_complete_lead", False):
-                        update_data["lead_status"] = LeadStatus.COMPLETE
-                        new_lead_status = LeadStatus.COMPLETE
-                        logger.info(f"✅ Nœud marqué comme lead complet (propriété directe)")
-                    
-                    # Vérifier également dans l'objet data du nœud
-                    if not new_lead_status and current_node.get("data", {}).get("is_partial_lead", False) and session["lead_status"] == LeadStatus.NONE:
-                        update_data["lead_status"] = LeadStatus.PARTIAL
-                        new_lead_status = LeadStatus.PARTIAL
-                        logger.info(f"✅ Nœud marqué comme lead partiel (propriété data)")
-                    
-                    if not new_lead_status or new_lead_status == LeadStatus.PARTIAL:
-                        if current_node.get("data", {}).get("is_complete_lead", False):
-                            update_data["lead_status"] = LeadStatus.COMPLETE
-                            new_lead_status = LeadStatus.COMPLETE
-                            logger.info(f"✅ Nœud marqué comme lead complet (propriété data)")
-                    
-                    # Enregistrer le changement de statut de lead pour les analytics
-                    if new_lead_status:
-                        logger.info(f"📈 Enregistrement du changement de statut de lead: {new_lead_status}")
-                        await analytics_service.track_lead_status_change(session_id, new_lead_status)
-                    
-                    # Si c'est un node final, marquer la session comme complétée
-                    session_status = None
-                    
-                    # Vérifier d'abord dans les propriétés directes du nœud
-                    if current_node.get("is_final_node", False):
-                        update_data["status"] = SessionStatus.COMPLETED
-                        update_data["ended_at"] = datetime.utcnow()
-                        session_status = SessionStatus.COMPLETED
-                        logger.info(f"✅ Nœud marqué comme final (propriété directe)")
-                    
-                    # Vérifier également dans l'objet data du nœud
-                    if not session_status and current_node.get("data", {}).get("is_final_node", False):
-                        update_data["status"] = SessionStatus.COMPLETED
-                        update_data["ended_at"] = datetime.utcnow()
-                        session_status = SessionStatus.COMPLETED
-                        logger.info(f"✅ Nœud marqué comme final (propriété data)")
-                
-                # Calculer le temps passé sur ce nœud
-                time_spent = 0
-                last_step = await db[STEPS_COLLECTION].find_one(
-                    {"session_id": session_id},
-                    sort=[("timestamp", -1)]
-                )
-                
-                current_time = datetime.utcnow()
-                if last_step:
-                    time_spent = (current_time - last_step["timestamp"]).total_seconds()
-                
-                # Enregistrer l'étape
-                new_step = {
-                    "session_id": session_id,
-                    "node_id": message.node_id,
-                    "is_completed": True,
-                    "timestamp": current_time
-                }
-                await db[STEPS_COLLECTION].insert_one(new_step)
-                
-                # Enregistrer la complétion du nœud pour les analytics
-                await analytics_service.track_node_completion(session_id, message.node_id, time_spent)
-                
-                # Calculer le pourcentage de complétion
-                if assistant and "nodes" in assistant:
-                    total_nodes = len(assistant["nodes"])
-                    completed_steps = await db[STEPS_COLLECTION].count_documents({
-                        "session_id": session_id,
-                        "is_completed": True
-                    })
-                    
-                    if total_nodes > 0:
-                        update_data["completion_percentage"] = min(100.0, (completed_steps / total_nodes) * 100)
-                
-                # Mettre à jour la session avec les nouvelles informations
-                if update_data:
-                    logger.info(f"📝 Mise à jour de la session {session_id} avec: {update_data}")
-                    await db[SESSIONS_COLLECTION].update_one(
-                        {"_id": ObjectId(session_id)},
-                        {"$set": update_data}
-                    )
-                    
-                    # Si le statut de la session a changé, enregistrer pour les analytics
-                    if session_status:
-                        logger.info(f"📈 Enregistrement du changement de statut de session: {session_status}")
-                        await analytics_service.track_session_end(session_id, session_status)
+            progress = {
+                "session_id": session_id,
+                "node_id": message.node_id,
+                "content_type": message.content_type.value,
+                "content": message.content,
+                "timestamp": datetime.utcnow()
+            }
+            if event_spool.degraded:
+                # MongoDB est lent ou indisponible : la progression de la session
+                # rejoint le message dans le spool local et sera appliquée au rejeu
+                logger.warning("Mode dégradé : mise à jour de la session %s différée", session_id)
+                await event_spool.defer("message_progress", progress)
+            else:
+                await _record_message_progress(progress)
         
+        return message_to_response(new_message)
+    except HTTPException:
+        raise
+    except PyMongoError as e:
+        if new_message is None:
+            logger.error("Erreur lors de l'ajout du message: %s", e)
+            raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+        # Le message est enregistré : seule la mise à jour de la session a échoué
+        logger.error("Message enregistré, mise à jour de la session %s impossible: %s", session_id, e)
         return message_to_response(new_message)
     except Exception as e:
-        logger.error(f"Erreur lors de l'ajout du message: {str(e)}")
+        logger.error("Erreur lors de l'ajout du message: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
+async def _record_message_progress(progress: Dict[str, Any]):
+    """
+    Met à jour la session après un message de l'utilisateur sur un nœud (réponses,
+    statut de lead, étape, complétion, fin de session). Exécutée avec le message,
+    ou au rejeu du spool local en mode dégradé.
+    """
+    db = await get_database()
+    session_id = progress["session_id"]
+    node_id = progress["node_id"]
+    session = await db[SESSIONS_COLLECTION].find_one({"_id": ObjectId(session_id)})
+    if not session:
+        return
+    
+    # Vérifier si le node est critique pour le statut de lead (dans le
+    # flow publié suivi par la session, et non dans le brouillon de l'éditeur)
+    assistant = await load_session_flow(db, session)
+    if assistant and "nodes" in assistant:
+        nodes = assistant["nodes"]
+        current_node = next((node for node in nodes if node.get("id") == node_id), None)
+        
+        # Mettre à jour le statut de lead si nécessaire
+        update_data = {"current_node_id": node_id}
+        
+        if current_node:
+            # Réponses aux champs du nœud (formulaire, option, saisie libre)
+            for field_name, value in node_responses(current_node, progress["content_type"], progress["content"]):
+                await analytics_service.track_user_response(session_id, node_id, field_name, value)
+            
+            # Vérifier les propriétés du node pour le statut de lead
+            new_lead_status = None
+            
+            # Ajouter des logs pour déboguer
+            logger.debug("Vérification du nœud %s pour le statut de lead", node_id)
+            logger.debug("Propriétés du nœud: is_partial_lead=%s, is_complete_lead=%s, is_final_node=%s", current_node.get('is_partial_lead', False), current_node.get('is_complete_lead', False), current_node.get('is_final_node', False))
+            logger.debug("Propriétés du nœud (data): is_partial_lead=%s, is_complete_lead=%s, is_final_node=%s", current_node.get('data', {}).get('is_partial_lead', False), current_node.get('data', {}).get('is_complete_lead', False), current_node.get('data', {}).get('is_final_node', False))
+            
+            # Vérifier d'abord dans les propriétés directes du nœud
+            if current_node.get("is_partial_lead", False) and session["lead_status"] == LeadStatus.NONE:
+                update_data["lead_status"] = LeadStatus.PARTIAL
+                new_lead_status = LeadStatus.PARTIAL
+                logger.debug("Nœud marqué comme lead partiel (propriété directe)")
+            
+            if current_node.get("is_complete_lead", False):
+                update_data["lead_status"] = LeadStatus.COMPLETE
+                new_lead_status = LeadStatus.COMPLETE
+                logger.debug("Nœud marqué comme lead complet (propriété directe)")
+            
+            # Vérifier également dans l'objet data du nœud
+            if not new_lead_status and current_node.get("data", {}).get("is_partial_lead", False) and session["lead_status"] == LeadStatus.NONE:
+                update_data["lead_status"] = LeadStatus.PARTIAL
+                new_lead_status = LeadStatus.PARTIAL
+                logger.debug("Nœud marqué comme lead partiel (propriété data)")
+            
+            if not new_lead_status or new_lead_status == LeadStatus.PARTIAL:
+                if current_node.get("data", {}).get("is_complete_lead", False):
+                    update_data["lead_status"] = LeadStatus.COMPLETE
+                    new_lead_status = LeadStatus.COMPLETE
+                    logger.debug("Nœud marqué comme lead complet (propriété data)")
+            
+            # Enregistrer le changement de statut de lead pour les analytics
+            if new_lead_status:
+                logger.debug("Enregistrement du changement de statut de lead: %s", new_lead_status)
+                await analytics_service.track_lead_status_change(session_id, new_lead_status)
+            
+            # Si c'est un node final, marquer la session comme complétée
+            session_status = None
+            
+            # Vérifier d'abord dans les propriétés directes du nœud
+            if current_node.get("is_final_node", False):
+                update_data["status"] = SessionStatus.COMPLETED
+                update_data["ended_at"] = datetime.utcnow()
+                session_status = SessionStatus.COMPLETED
+                logger.debug("Nœud marqué comme final (propriété directe)")
+            
+            # Vérifier également dans l'objet data du nœud
+            if not session_status and current_node.get("data", {}).get("is_final_node", False):
+                update_data["status"] = SessionStatus.COMPLETED
+                update_data["ended_at"] = datetime.utcnow()
+                session_status = SessionStatus.COMPLETED
+                logger.debug("Nœud marqué comme final (propriété data)")
+        
+        # Calculer le temps passé sur ce nœud
+        time_spent = 0
+        last_step = await db[STEPS_COLLECTION].find_one(
+            {"session_id": session_id},
+            sort=[("timestamp", -1)]
+        )
+        
+        current_time = progress["timestamp"]
+        if last_step:
+            time_spent = max((current_time - last_step["timestamp"]).total_seconds(), 0)
+        
+        # Connexion parcourue depuis l'étape précédente (matrice de transitions)
+        await analytics_service.track_transitions(
+            session_id, last_step["node_id"] if last_step else None, [node_id]
+        )
+        
+        # Enregistrer l'étape
+        new_step = {
+            "session_id": session_id,
+            "node_id": node_id,
+            "is_completed": True,
+            "timestamp": current_time
+        }
+        await db[STEPS_COLLECTION].insert_one(new_step)
+        
+        # Enregistrer la complétion du nœud pour les analytics
+        await analytics_service.track_node_completion(session_id, node_id, time_spent)
+        
+        # Mettre à jour la session : le nœud rejoint l'ensemble des nœuds visités
+        # et le pourcentage de complétion est recalculé dans la même écriture
+        reachable_nodes = count_reachable_nodes(assistant)
+        if update_data:
+            logger.debug("Mise à jour de la session %s avec: %s", session_id, update_data)
+            await db[SESSIONS_COLLECTION].update_one(
+                {"_id": ObjectId(session_id)},
+                visited_node_update(
+                    update_data, [node_id], reachable_nodes,
+                    remaining_distance(assistant, node_id)
+                )
+            )
+            
+            # Si le statut de la session a changé, enregistrer pour les analytics
+            if session_status:
+                logger.debug("Enregistrement du changement de statut de session: %s", session_status)
+                await analytics_service.track_session_end(session_id, session_status)
+
+@router.post("/{session_id}/advance", response_model=AdvanceResponse, dependencies=[
+    Depends(rate_limit("message_ip")),
+    Depends(rate_limit("message_session", path_param("session_id")))
+])
+async def advance_session(session_id: str, body: AdvanceRequest, request: Request, response: Response):
+    """
+    Fait avancer la conversation côté serveur : enregistre la réponse de
+    l'utilisateur au nœud courant et retourne les nœuds suivants à afficher
+    (sans corps de réponse : nœud de départ, ou nœud courant à la reprise).
+    Remplace les appels du widget à /messages, /nodes/{id}/viewed, /end et
+    /api/analytics/track_message pour un tour de conversation.
+    """
+    base_url = str(request.base_url).rstrip('/')
+    return await idempotent(request, response, lambda: _advance_session(session_id, body, base_url))
+
+def _user_answer(body: AdvanceRequest) -> Optional[Dict[str, str]]:
+    """
+    Réponse de l'utilisateur telle qu'enregistrée dans le journal (même format que le widget)
+    """
+    if body.form_data is not None:
+        return {"content": json.dumps(body.form_data, ensure_ascii=False), "type": MessageContentType.FORM.value}
+    if body.option is not None:
+        return {"content": body.option, "type": MessageContentType.OPTION.value}
+    if body.value is not None:
+        return {"content": body.value, "type": MessageContentType.TEXT.value}
+    return None
+
+def _complete_node(node: Dict[str, Any], lead_status: str, update_data: Dict[str, Any]) -> str:
+    """
+    Applique les propriétés d'un nœud terminé (mêmes règles que add_message) et
+    retourne le nouveau statut de lead
+    """
+    if node_flag(node, "is_complete_lead"):
+        lead_status = LeadStatus.COMPLETE
+    elif node_flag(node, "is_partial_lead") and lead_status == LeadStatus.NONE:
+        lead_status = LeadStatus.PARTIAL
+    if node_flag(node, "is_final_node"):
+        update_data["status"] = SessionStatus.COMPLETED
+    return lead_status
+
+async def _advance_session(session_id: str, body: AdvanceRequest, base_url: str) -> Dict[str, Any]:
+    if not ObjectId.is_valid(session_id):
+        raise HTTPException(status_code=400, detail="ID de session invalide")
+    
+    try:
+        return await _play_turn(session_id, body, base_url)
+    except HTTPException:
+        raise
+    except PyMongoError as e:
+        logger.error("Erreur lors de l'avancement de la session %s: %s", session_id, e)
+        raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+    except Exception as e:
+        logger.error("Erreur lors de l'avancement de la session %s: %s", session_id, e)
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+
+async def _play_turn(session_id: str, body: AdvanceRequest, base_url: str) -> Dict[str, Any]:
+    db = await get_database()
+    session = await _within_budget(db[SESSIONS_COLLECTION].find_one({"_id": ObjectId(session_id)}))
+    if not session:
+        raise HTTPException(status_code=404, detail="Session non trouvée")
+    if session.get("status") != SessionStatus.ACTIVE:
+        raise HTTPException(status_code=409, detail="Session terminée")
+    
+    flow = await load_session_flow(db, session)
+    if not flow:
+        raise HTTPException(status_code=404, detail="Assistant non trouvé")
+    compiled = compile_flow(flow, session.get("flow_hash"))
+    
+    current_node_id = session.get("current_node_id")
+    if current_node_id not in compiled.nodes:
+        current_node_id = None
+    if body.node_id and current_node_id and body.node_id != current_node_id:
+        raise HTTPException(status_code=409, detail="La réponse ne porte pas sur le nœud courant de la session")
+    
+    answer = _user_answer(body)
+    if current_node_id is None:
+        # Démarrage de la conversation
+        answered_node = None
+        chain = compiled.chain_from(compiled.start_node_id)
+    elif answer is None:
+        # Reprise (rechargement du widget) : le nœud courant est renvoyé sans nouvel enregistrement
+        return {
+            "session_id": session_id,
+            "status": session["status"],
+            "lead_status": session.get("lead_status", LeadStatus.NONE),
+            "current_node_id": current_node_id,
+            "nodes": [compiled.render(node_id, base_url) for node_id in compiled.chain_from(current_node_id)],
+            "ended": False
+        }
+    else:
+        answered_node = compiled.nodes[current_node_id]
+        chain = compiled.chain_from(compiled.next_node_id(current_node_id, body.option))
+    
+    now = datetime.utcnow()
+    update_data: Dict[str, Any] = {}
+    steps: List[Dict[str, Any]] = []
+    # Complétions des nœuds : (nœud, temps passé)
+    completions: List[Tuple[str, float]] = []
+    lead_status = session.get("lead_status", LeadStatus.NONE)
+    
+    last_step = await _within_budget(
+        db[STEPS_COLLECTION].find_one({"session_id": session_id}, sort=[("timestamp", -1)])
+    )
+    
+    # Réponse de l'utilisateur : enregistrée sur le nœud auquel elle répond
+    if answered_node is not None:
+        lead_status = _complete_node(answered_node, lead_status, update_data)
+        time_spent = (now - last_step["timestamp"]).total_seconds() if last_step else 0
+        steps.append({"_id": ObjectId(), "session_id": session_id, "node_id": current_node_id, "is_completed": True, "timestamp": now})
+        completions.append((current_node_id, time_spent))
+    
+    # Nœuds affichés : étape « vue »
+    for node_id in chain:
+        node = compiled.nodes[node_id]
+        steps.append({"_id": ObjectId(), "session_id": session_id, "node_id": node_id, "is_completed": False, "timestamp": datetime.utcnow()})
+        completions.append((node_id, 0))
+        if not compiled.awaits_input(node_id):
+            # Nœud sans réponse attendue : il est terminé dès son affichage
+            lead_status = _complete_node(node, lead_status, update_data)
+        if is_end_node(node):
+            update_data["status"] = SessionStatus.COMPLETED
+    
+    visited = ([current_node_id] if answered_node is not None else []) + chain
+    if chain:
+        update_data["current_node_id"] = chain[-1]
+    if lead_status != session.get("lead_status"):
+        update_data["lead_status"] = lead_status
+    if update_data.get("status") == SessionStatus.COMPLETED:
+        update_data["ended_at"] = datetime.utcnow()
+    
+    # Le tour est réservé avant toute écriture : la mise à jour de la session ne
+    # s'applique que si aucune autre requête (double clic, renvoi avec une autre
+    # clé d'idempotence) n'a traité ce tour depuis la lecture de la session
+    pipeline = visited_node_update(
+        update_data, visited, count_reachable_nodes(flow),
+        remaining_distance(flow, update_data.get("current_node_id", current_node_id))
+    )
+    pipeline[0]["$set"][TURN_FIELD] = {"$add": [{"$ifNull": [f"${TURN_FIELD}", 0]}, 1]}
+    claimed = await db[SESSIONS_COLLECTION].update_one(
+        {"_id": ObjectId(session_id), "status": SessionStatus.ACTIVE, TURN_FIELD: session.get(TURN_FIELD)},
+        pipeline
+    )
+    if not claimed.matched_count:
+        raise HTTPException(status_code=409, detail="Ce tour de conversation a déjà été traité")
+    
+    ended = update_data.get("status") == SessionStatus.COMPLETED
+    result = {
+        "session_id": session_id,
+        "status": update_data.get("status", session["status"]),
+        "lead_status": lead_status,
+        "current_node_id": update_data.get("current_node_id", current_node_id),
+        "nodes": [compiled.render(node_id, base_url) for node_id in chain],
+        "ended": ended
+    }
+    
+    try:
+        # Réponse et questions affichées : écrites dans le journal d'événements
+        # (ou dans le spool local si MongoDB est lent)
+        if answered_node is not None:
+            await analytics_service.track_message(
+                session_id=session_id,
+                message_type=answer["type"],
+                content=answer["content"],
+                sender=MessageSender.USER,
+                node_id=current_node_id,
+                session=session
+            )
+            for field_name, value in node_responses(answered_node, answer["type"], answer["content"]):
+                await analytics_service.track_user_response(session_id, current_node_id, field_name, value)
+        for node_id in chain:
+            question = node_question(compiled.nodes[node_id])
+            if question:
+                await analytics_service.track_message(
+                    session_id=session_id,
+                    message_type=question["type"],
+                    content=question["content"],
+                    is_question=True,
+                    sender=MessageSender.BOT,
+                    node_id=node_id,
+                    session=session
+                )
+        
+        # Étapes et analytics du tour
+        turn = {
+            "session": {key: session.get(key) for key in ("_id", "assistant_id", "visitor_id")},
+            "steps": steps,
+            "completions": completions,
+            # Nœud précédent : le nœud courant de la session (les étapes d'un même tour
+            # peuvent avoir le même horodatage), sinon la dernière étape enregistrée
+            "previous_node_id": current_node_id or (last_step["node_id"] if last_step else None),
+            "visited": visited,
+            "lead_changed": "lead_status" in update_data,
+            "ended": ended
+        }
+        if event_spool.degraded:
+            # MongoDB est lent ou indisponible : le tour rejoint les messages dans
+            # le spool local et sera enregistré au rejeu
+            logger.warning("Mode dégradé : étapes et analytics du tour de la session %s différées", session_id)
+            await event_spool.defer("advance_turn", turn)
+        else:
+            await _record_turn(turn)
+    except PyMongoError as e:
+        # Le tour est acquis (session mise à jour) : seules ses analytics sont incomplètes
+        logger.error("Tour de la session %s enregistré, analytics incomplètes: %s", session_id, e)
+    
+    return result
+
+async def _record_turn(turn: Dict[str, Any]):
+    """
+    Enregistre les étapes et les analytics d'un tour de conversation (voir
+    _play_turn). Exécuté avec le tour, ou au rejeu du spool local en mode
+    dégradé : les étapes ont leur identifiant, un rejeu ne les duplique pas.
+    """
+    db = await get_database()
+    session = turn["session"]
+    session_id = str(session["_id"])
+    
+    if turn["steps"]:
+        try:
+            await db[STEPS_COLLECTION].insert_many(turn["steps"], ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+        await analytics_service.track_node_completions(session_id, turn["completions"], session["assistant_id"])
+        await analytics_service.track_transitions(session_id, turn["previous_node_id"], turn["visited"])
+    
+    if turn["lead_changed"]:
+        await analytics_service.track_unique_lead(session)
+    
+    if turn["ended"]:
+        await analytics_service.track_session_end(session_id, SessionStatus.COMPLETED)
+
+# Tâches différées du mode dégradé, exécutées au rejeu du spool local
+event_spool.register_handler("message_progress", _record_message_progress)
+event_spool.register_handler("advance_turn", _record_turn)
+
 @router.post("/{session_id}/nodes/{node_id}/viewed")
 async def mark_node_viewed(session_id: str, node_id: str, request: Request):
     """
@@ -319,6 +637,10 @@ async def mark_node_viewed(session_id: str, node_id: str, request: Request):
         if not session:
             raise HTTPException(status_code=404, detail="Session non trouvée")
         
+        # Connexion parcourue depuis l'étape précédente (matrice de transitions)
+        last_step = await db[STEPS_COLLECTION].find_one({"session_id": session_id}, sort=[("timestamp", -1)])
+        await analytics_service.track_transitions(session_id, last_step["node_id"] if last_step else None, [node_id])
+        
         # Enregistrer l'étape dans la collection des étapes
         step_data = {
             "session_id": session_id,
@@ -334,7 +656,7 @@ async def mark_node_viewed(session_id: str, node_id: str, request: Request):
         
         return {"status": "success"}
     except Exception as e:
-        logger.error(f"Erreur lors du marquage du nœud comme vu: {str(e)}")
+        logger.error("Erreur lors du marquage du nœud comme vu: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
 @router.put("/{session_id}/end", response_model=SessionResponse)
@@ -369,7 +691,7 @@ async def end_session(session_id: str, request: Request):
         
         return session_to_response(updated_session)
     except Exception as e:
-        logger.error(f"Erreur lors de la fin de la session: {str(e)}")
+        logger.error("Erreur lors de la fin de la session: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
 @router.get("/{session_id}", response_model=SessionResponse)
@@ -387,7 +709,7 @@ async def get_session(session_id: str, request: Request):
         
         return session_to_response(session)
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération de la session: {str(e)}")
+        logger.error("Erreur lors de la récupération de la session: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
 @router.get("/{session_id}/messages", response_model=List[MessageResponse])
@@ -404,13 +726,13 @@ async def get_session_messages(session_id: str, request: Request):
             raise HTTPException(status_code=404, detail="Session non trouvée")
         
         # Récupérer les messages
-        messages = []
-        async for message in db[MESSAGES_COLLECTION].find({"session_id": session_id}).sort("timestamp", 1):
-            messages.append(message_to_response(message))
+        messages = await load_session_messages(session)
         
-        return messages
+        return FastJSONResponse([message_to_response(message) for message in messages])
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des messages: {str(e)}")
+        logger.error("Erreur lors de la récupération des messages: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
 @router.get("/by-assistant/{assistant_id}/leads", response_model=List[Dict[str, Any]])
@@ -422,11 +744,8 @@ async def get_assistant_leads(assistant_id: str, request: Request, lead_type: st
         db = await get_database()
         
         # Vérifier si l'assistant existe
-        assistant = await db[ASSISTANTS_COLLECTION].find_one({"_id": ObjectId(assistant_id)})
-        if not assistant:
-            assistant = await db[ASSISTANTS_COLLECTION].find_one({"public_id": assistant_id})
-        
-        if not assistant:
+        resolved_id = await resolve_assistant_id(assistant_id)
+        if not resolved_id:
             raise HTTPException(status_code=404, detail="Assistant non trouvé")
         
         # Déterminer le statut de lead à filtrer
@@ -435,23 +754,23 @@ async def get_assistant_leads(assistant_id: str, request: Request, lead_type: st
         # Récupérer les sessions avec le statut de lead spécifié
         sessions = []
         async for session in db[SESSIONS_COLLECTION].find({
-            "assistant_id": str(assistant["_id"]),
+            "assistant_id": resolved_id,
             "lead_status": lead_status
         }).sort("started_at", -1):
             session_data = session_to_response(session)
             
             # Récupérer les messages de cette session
-            messages = []
-            async for message in db[MESSAGES_COLLECTION].find({"session_id": session_data["id"]}).sort("timestamp", 1):
-                messages.append(message_to_response(message))
+            messages = await load_session_messages(session)
             
             # Ajouter les messages à la session
-            session_data["messages"] = messages
+            session_data["messages"] = [message_to_response(message) for message in messages]
             sessions.append(session_data)
         
-        return sessions
+        return FastJSONResponse(sessions)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des leads: {str(e)}")
+        logger.error("Erreur lors de la récupération des leads: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
 @router.get("/by-assistant/{assistant_id}", response_model=List[SessionResponse])
@@ -462,40 +781,22 @@ async def get_assistant_sessions(assistant_id: str, request: Request):
     try:
         db = await get_database()
         
-        # Vérifier si l'assistant existe
-        assistant = None
-        try:
-            # Essayer d'abord avec l'ObjectId
-            object_id = ObjectId(assistant_id)
-            assistant = await db[ASSISTANTS_COLLECTION].find_one({"_id": object_id})
-            if assistant:
-                # Si trouvé par ObjectId, utiliser cet ID pour la recherche des sessions
-                assistant_id = str(assistant["_id"])
-        except Exception as e:
-            logger.info(f"L'ID {assistant_id} n'est pas un ObjectId valide, tentative avec public_id")
-            
-        # Si non trouvé par ObjectId, essayer avec public_id
-        if not assistant:
-            assistant = await db[ASSISTANTS_COLLECTION].find_one({"public_id": assistant_id})
-            if not assistant:
-                # Essayer avec un ID court (sans le préfixe)
-                assistant = await db[ASSISTANTS_COLLECTION].find_one({"public_id": {"$regex": f".*{assistant_id}$"}})
-            
-            if assistant:
-                # Si trouvé par public_id, utiliser l'ObjectId pour la recherche des sessions
-                assistant_id = str(assistant["_id"])
-        
-        if not assistant:
+        # Vérifier si l'assistant existe (ObjectId, public_id ou ID court)
+        resolved_id = await resolve_assistant_id(assistant_id)
+        if not resolved_id:
             raise HTTPException(status_code=404, detail="Assistant non trouvé")
+        assistant_id = resolved_id
         
         # Récupérer les sessions
         sessions = []
         async for session in db[SESSIONS_COLLECTION].find({"assistant_id": assistant_id}).sort("started_at", -1):
             sessions.append(session_to_response(session))
         
-        return sessions
+        return FastJSONResponse(sessions)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des sessions: {str(e)}")
+        logger.error("Erreur lors de la récupération des sessions: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
 @router.get("/by-assistant/{assistant_id}/analytics", response_model=AnalyticsResponse)
@@ -504,29 +805,16 @@ async def get_assistant_analytics(assistant_id: str, request: Request, days: int
     Récupère les analytics pour un assistant spécifique
     """
     try:
-        db = request.app.state.db
+        db = await get_database()
         
-        # Convertir en ObjectId si c'est un ID MongoDB valide
-        try:
-            if ObjectId.is_valid(assistant_id):
-                query_id = ObjectId(assistant_id)
-                assistant = await db[ASSISTANTS_COLLECTION].find_one({"_id": query_id})
-                if assistant and "public_id" in assistant:
-                    public_id = assistant["public_id"]
-                else:
-                    public_id = str(query_id)
-            else:
-                # Rechercher l'assistant par public_id pour obtenir son _id
-                assistant = await db[ASSISTANTS_COLLECTION].find_one({"public_id": assistant_id})
-                if not assistant:
-                    raise HTTPException(status_code=404, detail="Assistant not found")
-                query_id = assistant["_id"]
-                public_id = assistant_id
-        except Exception as e:
-            logger.error(f"Erreur lors de la conversion de l'ID d'assistant: {str(e)}")
-            raise HTTPException(status_code=400, detail=f"Invalid assistant ID format: {str(e)}")
-        
-        logger.info(f"🔍 Récupération des analytics pour l'assistant: ID={assistant_id}, query_id={query_id}, public_id={public_id}")
+        # Les compteurs d'analytics peuvent être indexés par _id ou par public_id
+        resolved = await resolve_assistant(assistant_id)
+        if not resolved:
+            raise HTTPException(status_code=404, detail="Assistant not found")
+        query_id = resolved["id"]
+        public_id = resolved["public_id"] or query_id
+        
+        logger.debug("Récupération des analytics pour l'assistant: ID=%s, query_id=%s, public_id=%s", assistant_id, query_id, public_id)
         
         # Calculer la date de début pour la période spécifiée
         end_date = datetime.utcnow()
@@ -536,9 +824,9 @@ async def get_assistant_analytics(assistant_id: str, request: Request, days: int
         analytics_data = await db[ANALYTICS_COLLECTION].find({
             "assistant_id": {"$in": [str(query_id), public_id]},
             "date": {"$gte": start_date.strftime("%Y-%m-%d"), "$lte": end_date.strftime("%Y-%m-%d")}
-        }).to_list(1000)
+        }).to_list(None)
         
-        logger.info(f"📊 Données d'analytiques trouvées: {len(analytics_data)} documents")
+        logger.debug("Données d'analytiques trouvées: %s documents", len(analytics_data))
         
         # Initialiser les compteurs
         total_sessions = 0
@@ -593,7 +881,7 @@ async def get_assistant_analytics(assistant_id: str, request: Request, days: int
             "completion_rate": completion_rate
         }
         
-        logger.info(f"📊 Overview calculé: {overview}")
+        logger.debug("Overview calculé: %s", overview)
         
         # Récupérer les données par jour
         sessions_by_day = {}
@@ -631,20 +919,14 @@ async def get_assistant_analytics(assistant_id: str, request: Request, days: int
             else:
                 time_by_node[node_id] = 0
         
-        # Récupérer les réponses populaires
+        # Récupérer les réponses populaires (tous champs du nœud confondus)
         popular_responses = {}
         
-        for item in analytics_data:
-            user_responses = item.get("user_responses", {})
-            for node_id, responses in user_responses.items():
-                if node_id not in popular_responses:
-                    popular_responses[node_id] = {}
-                
-                for response, count in responses.items():
-                    if response not in popular_responses[node_id]:
-                        popular_responses[node_id][response] = 0
-                    
-                    popular_responses[node_id][response] += count
+        for node_id, fields in merge_responses(analytics_data).items():
+            node_responses = popular_responses.setdefault(node_id, {})
+            for field in fields.values():
+                for row in field["top"]:
+                    node_responses[row["value"]] = node_responses.get(row["value"], 0) + row["count"]
         
         # Récupérer les sessions récentes avec statut de lead
         recent_leads = await db[SESSIONS_COLLECTION].find({
@@ -659,7 +941,7 @@ async def get_assistant_analytics(assistant_id: str, request: Request, days: int
             if "user_id" in lead and isinstance(lead["user_id"], ObjectId):
                 lead["user_id"] = str(lead["user_id"])
         
-        logger.info(f"📊 Leads récents trouvés: {len(recent_leads)}")
+        logger.debug("Leads récents trouvés: %s", len(recent_leads))
         
         return {
             "overview": overview,
@@ -670,6 +952,8 @@ async def get_assistant_analytics(assistant_id: str, request: Request, days: int
             "average_time_by_node": time_by_node,
             "recent_leads": recent_leads
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Erreur lors de la récupération des analytics: {str(e)}")
+        logger.error("Erreur lors de la récupération des analytics: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
@@ -0,0 +1,79 @@
+"""
+Création des index MongoDB utilisés par l'API
+"""
+from pymongo import ASCENDING
+
+from app.database.mongodb import get_database
+
+# Collections MongoDB
+EVENTS_COLLECTION = "session_events"
+STEPS_COLLECTION = "session_steps"
+SESSIONS_COLLECTION = "sessions"
+ASSISTANTS_COLLECTION = "assistants"
+ANALYTICS_COLLECTION = "analytics"
+SNAPSHOTS_COLLECTION = "assistant_snapshots"
+RATE_LIMITS_COLLECTION = "rate_limits"
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+SPOOL_TASKS_COLLECTION = "spool_tasks"
+
+# Conservation des tâches différées rejouées (marqueurs d'idempotence du rejeu)
+SPOOL_TASK_RETENTION_SECONDS = 30 * 24 * 3600
+
+
+async def ensure_indexes():
+    """
+    Crée les index nécessaires s'ils n'existent pas encore.
+    L'opération est idempotente et peut être appelée à chaque démarrage.
+    """
+    db = await get_database()
+
+    # Journal d'événements : lecture chronologique des événements d'une session
+    await db[EVENTS_COLLECTION].create_index(
+        [("session_id", ASCENDING), ("timestamp", ASCENDING)],
+        name="session_timestamp"
+    )
+
+    # Étapes : dernière étape d'une session (calcul du temps passé sur un nœud)
+    await db[STEPS_COLLECTION].create_index(
+        [("session_id", ASCENDING), ("timestamp", ASCENDING)],
+        name="session_timestamp"
+    )
+
+    # Assistants : résolution par public_id et par ID court (public_id inversé,
+    # voir app.services.assistant_resolver)
+    await db[ASSISTANTS_COLLECTION].create_index([("public_id", ASCENDING)], name="public_id", sparse=True)
+    await db[ASSISTANTS_COLLECTION].create_index([("public_id_rev", ASCENDING)], name="public_id_rev", sparse=True)
+
+    # Snapshots publiés : une version par assistant, lecture par hash du contenu
+    await db[SNAPSHOTS_COLLECTION].create_index(
+        [("assistant_id", ASCENDING), ("version", ASCENDING)],
+        name="assistant_version",
+        unique=True
+    )
+    await db[SNAPSHOTS_COLLECTION].create_index([("content_hash", ASCENDING)], name="content_hash")
+
+    # Assistants d'un utilisateur (liste du dashboard)
+    await db[ASSISTANTS_COLLECTION].create_index([("user_id", ASCENDING)], name="user_id")
+
+    # Sessions d'un assistant sur une période (analyse des parcours)
+    await db[SESSIONS_COLLECTION].create_index(
+        [("assistant_id", ASCENDING), ("started_at", ASCENDING)],
+        name="assistant_started_at"
+    )
+
+    # Compteurs d'analytics : lecture par assistant et par période
+    await db[ANALYTICS_COLLECTION].create_index(
+        [("assistant_id", ASCENDING), ("date", ASCENDING)],
+        name="assistant_date"
+    )
+
+    # Limitation de débit partagée (RATE_LIMIT_BACKEND=mongo) : seaux inactifs supprimés
+    await db[RATE_LIMITS_COLLECTION].create_index("expires_at", name="expires_at_ttl", expireAfterSeconds=0)
+
+    # Clés d'idempotence (unicité assurée par `_id`) : réponses expirées supprimées
+    await db[IDEMPOTENCY_COLLECTION].create_index("expires_at", name="expires_at_ttl", expireAfterSeconds=0)
+
+    # Tâches différées du spool (mode dégradé) : marqueurs supprimés après 30 jours
+    await db[SPOOL_TASKS_COLLECTION].create_index(
+        "created_at", name="created_at_ttl", expireAfterSeconds=SPOOL_TASK_RETENTION_SECONDS
+    )
@@ -3,6 +3,8 @@ from typing import Optional
 import os
 from dotenv import load_dotenv
 
+from app.utils.metrics import mongo_event_listeners
+
 # Charger les variables d'environnement
 load_dotenv()
 
@@ -20,7 +22,7 @@ async def get_database():
     """
     global client
     if client is None:
-        client = AsyncIOMotorClient(MONGODB_URL)
+        client = AsyncIOMotorClient(MONGODB_URL, event_listeners=mongo_event_listeners())
     return client[DB_NAME]
 
 async def close_mongo_connection():
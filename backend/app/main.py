@@ -1,22 +1,33 @@
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse
 from app.api.routes import api_router
 from app.database.mongodb import get_database, close_mongo_connection
+from app.database.indexes import ensure_indexes
+from app.services.assistant_resolver import backfill_public_id_rev
+from app.api.assistant import flow_to_response, load_published_snapshot
+from app.services.assistant_snapshots import backfill_snapshots, snapshot_flow
+from app.services.cache_invalidation import invalidation_bus
+from app.services.event_spool import event_spool
+from app.utils.metrics import registry, route_template, REQUEST_LATENCY, REQUESTS_IN_FLIGHT
+from app.utils.logging_config import configure_logging, RequestLogSampler
+from app.utils.admission import AdmissionControlMiddleware
+from app.utils.cache import TTLCache
+from app.utils.serialization import dumps_for_script
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
+import gzip
+import hashlib
 import logging
 import time
 import traceback
 from fastapi import HTTPException
 
-# Configuration du logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configuration du logging (JSON, niveaux par logger, voir app/utils/logging_config.py)
+configure_logging()
 logger = logging.getLogger("leadflow-api")
+request_log_sampler = RequestLogSampler.from_env()
 
 app = FastAPI(
     title="leadflow API",
@@ -32,6 +43,18 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates_dir = Path(__file__).parent / "templates"
 templates = Jinja2Templates(directory=str(templates_dir))
 
+# Pages de chat rendues, par (public_id, hash du snapshot publié, base_url) :
+# le contenu d'un snapshot étant immuable, les pages n'expirent pas
+chat_page_cache = TTLCache("chat_pages", maxsize=256, ttl=float("inf"))
+invalidation_bus.register(
+    "assistants",
+    lambda assistant_id: chat_page_cache.evict_where(lambda key, page: page["assistant_id"] == assistant_id)
+)
+
+# Limites de concurrence par groupe de routes (chat public, dashboard, analytics) :
+# au plus près de l'application pour que les 503 passent par CORS et les logs
+app.add_middleware(AdmissionControlMiddleware)
+
 # Middleware pour compresser les réponses (utile pour les gros objets JSON)
 app.add_middleware(GZipMiddleware, minimum_size=1000)
 
@@ -42,7 +65,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Length", "Content-Encoding"],
+    expose_headers=["Content-Length", "Content-Encoding", "Idempotent-Replayed"],
     max_age=600  # 10 minutes de cache pour les requêtes preflight
 )
 
@@ -50,29 +73,39 @@ app.add_middleware(
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     start_time = time.time()
-    
-    # Log de la requête entrante
-    logger.info(f"Requête entrante: {request.method} {request.url.path}")
+    status_code = 500
+    REQUESTS_IN_FLIGHT.inc()
     
     try:
         response = await call_next(request)
+        status_code = response.status_code
         process_time = time.time() - start_time
         response.headers["X-Process-Time"] = str(process_time)
-        
-        # Log du temps de traitement
-        logger.info(f"Requête traitée: {request.method} {request.url.path} - Statut: {response.status_code} - Temps: {process_time:.4f}s")
-        
         return response
-    except Exception as e:
-        # Log de l'erreur
-        logger.error(f"Erreur lors du traitement de la requête {request.method} {request.url.path}: {str(e)}")
-        logger.error(traceback.format_exc())
+    except Exception:
+        logger.exception("Erreur lors du traitement de la requête %s %s", request.method, request.url.path)
         
         # Retourner une réponse d'erreur
         return JSONResponse(
             status_code=500,
             content={"detail": "Une erreur interne s'est produite lors du traitement de la requête"}
         )
+    finally:
+        process_time = time.time() - start_time
+        route = route_template(request.app, request.scope)
+        
+        # Latence par gabarit de route (et non par URL) pour borner le nombre de séries
+        REQUESTS_IN_FLIGHT.dec()
+        REQUEST_LATENCY.observe(process_time, method=request.method, route=route, status=str(status_code))
+        
+        # Une seule ligne par requête ; les requêtes réussies sont échantillonnées
+        duration_ms = process_time * 1000
+        if request_log_sampler.should_log(status_code, duration_ms):
+            logger.info(
+                "%s %s %s %.1fms", request.method, request.url.path, status_code, duration_ms,
+                extra={"method": request.method, "path": request.url.path, "route": route,
+                       "status": status_code, "duration_ms": round(duration_ms, 2)}
+            )
 
 # Inclure les routes de l'API
 app.include_router(api_router, prefix="/api", tags=["api"])
@@ -83,13 +116,78 @@ async def startup_db_client():
     # Initialiser la connexion à MongoDB
     await get_database()
     logger.info("Connexion à MongoDB établie")
+    
+    # Créer les index manquants
+    await ensure_indexes()
+    
+    # Renseigner la clé de recherche par ID court des assistants déjà publiés
+    backfilled = await backfill_public_id_rev()
+    if backfilled:
+        logger.info("public_id_rev renseigné pour %s assistant(s)", backfilled)
+    
+    # Créer le snapshot des assistants publiés avant l'introduction des snapshots
+    snapshotted = await backfill_snapshots(flow_to_response)
+    if snapshotted:
+        logger.info("Snapshot publié créé pour %s assistant(s)", snapshotted)
+    
+    # Propager les modifications d'assistants et d'utilisateurs aux caches des autres workers
+    await invalidation_bus.start()
+    
+    # Rejeu des événements écrits dans le spool local pendant une indisponibilité de MongoDB
+    await event_spool.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await invalidation_bus.stop()
+    await event_spool.stop()
+    
     # Fermer la connexion à MongoDB
     await close_mongo_connection()
     logger.info("Connexion à MongoDB fermée")
 
+def render_chat_page(snapshot: dict, base_url: str) -> dict:
+    """
+    Rend la page de chat avec les données du snapshot publié incluses, et
+    prépare sa version compressée et son ETag
+    """
+    flow = snapshot_flow(snapshot)
+    html = templates.get_template("chat.html").render(
+        assistant={"id": snapshot["assistant_id"], "public_id": snapshot["public_id"], "name": flow["name"]},
+        flow_json=dumps_for_script(flow),
+        base_url=base_url
+    )
+    body = html.encode("utf-8")
+    return {
+        "assistant_id": snapshot["assistant_id"],
+        "body": body,
+        "gzip": gzip.compress(body, compresslevel=9),
+        "etag": '"' + hashlib.sha1(body).hexdigest() + '"'
+    }
+
+def chat_page_response(page: dict, request: Request) -> Response:
+    """
+    Sert une page de chat mise en cache (304 si le navigateur a déjà cette version)
+    """
+    headers = {
+        "ETag": page["etag"],
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding"
+    }
+    if request.headers.get("if-none-match") == page["etag"]:
+        return Response(status_code=304, headers=headers)
+    
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(page["gzip"], media_type="text/html; charset=utf-8", headers=headers)
+    return Response(page["body"], media_type="text/html; charset=utf-8", headers=headers)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Métriques au format texte Prometheus
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     return {"message": "Bienvenue sur l'API leadflow"}
@@ -98,41 +196,43 @@ async def root():
 async def get_chat_page(public_id: str, request: Request):
     """
     Affiche la page de chat pour un assistant public.
+    La page est rendue une fois par snapshot publié, avec le flow inclus dans
+    la page, puis servie depuis le cache (brute ou compressée en gzip).
     """
     try:
-        db = await get_database()
-        collection = db["assistants"]
-        
-        # Récupérer l'assistant par son public_id
-        assistant = await collection.find_one({"public_id": public_id})
-        
-        if not assistant:
-            raise HTTPException(
-                status_code=404,
-                detail="Assistant non trouvé"
-            )
+        # Lecture légère du pointeur de publication, puis snapshot en cache
+        snapshot = await load_published_snapshot(public_id)
         
-        # Vérifier si l'assistant est publié
-        if not assistant.get("is_published", False):
+        if not snapshot:
             raise HTTPException(
                 status_code=404,
                 detail="Assistant non trouvé ou non publié"
             )
         
-        # Convertir en format de réponse
-        from app.api.assistant import assistant_to_response
-        assistant_data = assistant_to_response(assistant)
+        base_url = str(request.base_url).rstrip('/')
+        cache_key = (public_id, snapshot["content_hash"], base_url)
+        page = chat_page_cache.get(cache_key)
+        if page is None:
+            page = render_chat_page(snapshot, base_url)
+            chat_page_cache.set(cache_key, page)
         
-        # Rendre le template HTML
-        return templates.TemplateResponse(
-            "chat.html",
-            {
-                "request": request,
-                "assistant": assistant_data,
-                "base_url": str(request.base_url).rstrip('/')
-            }
+        return chat_page_response(page, request)
+
+    except HTTPException as e:
+        return HTMLResponse(
+            content=f"""
+            <html>
+                <head>
+                    <title>Assistant introuvable</title>
+                </head>
+                <body>
+                    <h1>Assistant introuvable</h1>
+                    <p>{e.detail}</p>
+                </body>
+            </html>
+            """,
+            status_code=e.status_code
         )
-    
     except Exception as e:
         logger.error(f"Erreur lors de l'affichage de la page de chat: {str(e)}")
         logger.error(traceback.format_exc())
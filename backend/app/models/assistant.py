@@ -69,6 +69,7 @@ class AssistantModel(BaseModel):
     is_published: bool = False
     publish_date: Optional[datetime] = None
     public_id: Optional[str] = None
+    published_version: Optional[int] = None  # Version du snapshot servi aux visiteurs
     public_url: Optional[str] = None
     embed_script: Optional[str] = None
     user_id: Optional[str] = None  # ID de l'utilisateur propriétaire
@@ -106,12 +107,32 @@ class AssistantResponse(BaseModel):
     is_published: bool = False
     publish_date: Optional[datetime] = None
     public_id: Optional[str] = None
+    published_version: Optional[int] = None  # Version du snapshot servi aux visiteurs
     public_url: Optional[str] = None
     embed_script: Optional[str] = None
+    validation_errors: List[Dict[str, Any]] = []  # Erreurs du graphe compilé (nœuds inaccessibles, impasses...)
     user_id: Optional[str] = None  # ID de l'utilisateur propriétaire
     created_at: datetime
     updated_at: datetime
 
+# Statistiques principales d'un assistant (cartes du dashboard)
+class AssistantStats(BaseModel):
+    sessions_count: int = 0
+    leads_count: int = 0
+    conversion_rate: float = 0.0
+
+# Modèle allégé pour la liste des assistants (sans nodes ni edges)
+class AssistantSummary(BaseModel):
+    id: str
+    name: str
+    description: Optional[str] = None
+    is_published: bool = False
+    public_id: Optional[str] = None
+    node_count: int = 0
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    stats: AssistantStats = AssistantStats()
+
 # Modèle pour la publication d'un assistant
 class AssistantPublish(BaseModel):
     is_published: bool
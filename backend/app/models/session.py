@@ -27,6 +27,12 @@ class MessageContentType(str, Enum):
     QUICK_REPLY = "quick_reply"
     OPTION = "option"
 
+class SessionEventType(str, Enum):
+    MESSAGE = "message"
+    USER_RESPONSE = "user_response"
+    QA_PAIR = "qa_pair"
+    FORM_SUBMISSION = "form_submission"
+
 class SessionCreate(BaseModel):
     assistant_id: str
     user_id: Optional[str] = None
@@ -39,6 +45,21 @@ class MessageCreate(BaseModel):
     node_id: Optional[str] = None
     metadata: Optional[Dict[str, Any]] = None
 
+class AdvanceRequest(BaseModel):
+    """Réponse de l'utilisateur au nœud courant (aucune au démarrage de la conversation)"""
+    node_id: Optional[str] = None  # nœud auquel l'utilisateur répond (contrôle de cohérence)
+    option: Optional[str] = None  # texte ou identifiant de l'option choisie
+    value: Optional[str] = None  # saisie libre
+    form_data: Optional[Dict[str, Any]] = None
+
+class AdvanceResponse(BaseModel):
+    session_id: str
+    status: SessionStatus
+    lead_status: LeadStatus
+    current_node_id: Optional[str] = None
+    nodes: List[Dict[str, Any]] = []  # nœuds à afficher, dans l'ordre
+    ended: bool = False
+
 class SessionStepCreate(BaseModel):
     session_id: str
     node_id: str
@@ -55,6 +76,7 @@ class SessionResponse(BaseModel):
     started_at: datetime
     ended_at: Optional[datetime] = None
     completion_percentage: float = 0.0
+    flow_version: Optional[int] = None  # Version publiée du flow suivie par la session
     
 class MessageResponse(BaseModel):
     id: str
@@ -83,6 +105,8 @@ class AnalyticsOverview(BaseModel):
     complete_leads: int
     average_completion_percentage: float
     average_session_duration: float  # en secondes
+    unique_visitors: int = 0  # estimation (HyperLogLog), visiteurs revenus plusieurs fois comptés une fois
+    unique_leads: int = 0
 
 class AnalyticsResponse(BaseModel):
     overview: AnalyticsOverview
@@ -0,0 +1,392 @@
+"""
+Reconstruction des analytics quotidiennes à partir des données brutes
+
+Les documents `analytics` sont tenus à jour par incréments au fil des sessions
+(sessions abandonnées et leads partiels pré-incrémentés au démarrage, corrigés
+à la fin) : une session terminée un autre jour que son démarrage, une écriture
+perdue ou un bug passé faussent les compteurs pour de bon. Ce module les
+recalcule à partir des sessions, des étapes (`session_steps`) et des messages
+et réponses (journal `session_events`, plus les anciennes collections
+`messages` et `user_responses` pour les sessions non migrées).
+
+Le travail est découpé en partitions (assistant, jour) réparties sur un pool
+de processus, chacun avec son propre client PyMongo synchrone. Toutes les
+données d'une session sont rattachées au jour de son démarrage. Le document
+reconstruit remplace ceux de la journée (shards compris, voir
+`analytics_key`) par des `bulk_write` groupés.
+"""
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import DESCENDING, DeleteMany, MongoClient, ReplaceOne
+
+from app.models.session import LeadStatus, SessionEventType, SessionStatus
+from app.services.analytics_service import (
+    ANALYTICS_COLLECTION, ASSISTANTS_COLLECTION, IN_QUERY_CHUNK_SIZE, MAX_RESPONSE_VALUE_LENGTH,
+    RESPONSE_SKETCHES_FIELD, RESPONSE_SKETCH_PRECISION, RESPONSE_SKETCH_TOPK, SESSIONS_COLLECTION,
+    STEPS_COLLECTION, TRANSITION_EXIT, UNIQUES_FIELD, UNIQUES_PRECISION, response_key, step_transitions
+)
+from app.services.assistant_snapshots import SNAPSHOTS_COLLECTION
+from app.services.event_log import EVENTS_COLLECTION, LEGACY_MESSAGES_COLLECTION, LEGACY_USER_RESPONSES_COLLECTION
+from app.services.flow_graph import CATEGORICAL_FIELD, COMPILED_FLOW_FIELD, response_field
+from app.utils.sketches import HyperLogLog, SpaceSaving
+
+# Opérations envoyées par bulk_write
+BULK_WRITE_SIZE = 500
+
+# Partitions envoyées à la fois à un processus du pool
+MAP_CHUNK_SIZE = 8
+
+# Partition : (assistant_id, jour AAAA-MM-JJ)
+Partition = Tuple[str, str]
+
+# Client et caches propres à chaque processus du pool (voir `init_worker`)
+_db = None
+_flows: Dict[str, Dict[str, Any]] = {}
+_response_fields: Dict[Tuple[str, str, str], Optional[Dict[str, Any]]] = {}
+
+
+def _inc(document: Dict[str, Any], path: str, amount: float = 1):
+    """
+    Équivalent local d'un `$inc` sur un chemin pointé (`nodes.<id>.visits`)
+    """
+    *parents, key = path.split(".")
+    for parent in parents:
+        document = document.setdefault(parent, {})
+    document[key] = document.get(key, 0) + amount
+
+
+def _push(document: Dict[str, Any], path: str, value: Any):
+    """
+    Équivalent local d'un `$push` sur un chemin pointé
+    """
+    *parents, key = path.split(".")
+    for parent in parents:
+        document = document.setdefault(parent, {})
+    document.setdefault(key, []).append(value)
+
+
+def day_bounds(date: str) -> Tuple[datetime, datetime]:
+    start = datetime.strptime(date, "%Y-%m-%d")
+    return start, start + timedelta(days=1)
+
+
+def build_daily_analytics(
+    assistant_id: str,
+    date: str,
+    sessions: List[Dict[str, Any]],
+    steps: List[Dict[str, Any]],
+    messages: List[Dict[str, Any]],
+    responses: List[Dict[str, Any]],
+    field_of: Callable[[Dict[str, Any], str, str], Optional[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """
+    Document d'analytics d'un assistant pour un jour, à partir des sessions
+    démarrées ce jour-là et de leurs étapes, messages et réponses.
+
+    Les compteurs gardent la signification de ceux tenus en direct : une
+    session non terminée compte comme abandonnée et comme lead partiel
+    (pré-incrémentation), les durées et la sortie du flow ne concernent que
+    les sessions terminées. `field_of(session, node_id, field_name)` donne le
+    champ de réponse déclaré dans le flow, ou None (voir `response_field`).
+    """
+    completed = sum(1 for session in sessions if session.get("status") == SessionStatus.COMPLETED.value)
+    ended = [session for session in sessions if session.get("ended_at") and session.get("started_at")]
+    durations = [(session["ended_at"] - session["started_at"]).total_seconds() for session in ended]
+
+    doc: Dict[str, Any] = {
+        "date": date,
+        "assistant_id": assistant_id,
+        "sessions_count": len(sessions),
+        "active_sessions": len(sessions) - len(ended),
+        "completed_sessions": completed,
+        "abandoned_sessions": len(sessions) - completed,
+        "partial_leads": len(sessions) - completed,
+        "complete_leads": completed,
+        "leads_count": completed,
+        "session_durations": durations,
+        "messages_count": 0,
+        "rebuilt_at": datetime.utcnow()
+    }
+
+    visitors = HyperLogLog(UNIQUES_PRECISION)
+    leads = HyperLogLog(UNIQUES_PRECISION)
+    for session in sessions:
+        source = (session.get("user_info") or {}).get("source")
+        if source:
+            _inc(doc, f"sources.{source}")
+        if session.get("visitor_id"):
+            visitors.add(session["visitor_id"])
+        if session.get("lead_status") in (LeadStatus.PARTIAL.value, LeadStatus.COMPLETE.value):
+            leads.add(session.get("visitor_id") or str(session["_id"]))
+    for kind, registers in (("visitors", visitors), ("leads", leads)):
+        if any(registers.registers):
+            doc.setdefault(UNIQUES_FIELD, {})[kind] = {"hll": registers.to_binary(), "version": 1}
+
+    # Étapes : chaque étape est une complétion du nœud (temps passé depuis
+    # l'étape précédente pour une réponse, 0 pour un nœud affiché)
+    steps_by_session: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for step in steps:
+        steps_by_session[step["session_id"]].append(step)
+    ended_ids = {str(session["_id"]) for session in ended}
+    for session_id, session_steps in steps_by_session.items():
+        session_steps.sort(key=lambda step: (step["timestamp"], step["_id"]))
+        previous = None
+        for step in session_steps:
+            node_id = step.get("node_id")
+            if node_id:
+                time_spent = (step["timestamp"] - previous["timestamp"]).total_seconds() if previous and step.get("is_completed") else 0
+                _inc(doc, f"nodes.{node_id}.completions")
+                _push(doc, f"nodes.{node_id}.times", time_spent)
+            previous = step
+        node_ids = [step.get("node_id") for step in session_steps]
+        for source, target in step_transitions(None, node_ids):
+            _inc(doc, f"transitions.{source}.{target}")
+        last_node_id = next((node_id for node_id in reversed(node_ids) if node_id), None)
+        if session_id in ended_ids and last_node_id:
+            _inc(doc, f"transitions.{last_node_id}.{TRANSITION_EXIT}")
+
+    for message in messages:
+        content_type = message.get("content_type") or "text"
+        doc["messages_count"] += 1
+        _inc(doc, f"messages_by_type.{content_type}")
+        if message.get("node_id"):
+            _inc(doc, f"nodes.{message['node_id']}.visits")
+
+    # Réponses : compteurs exacts pour les valeurs déclarées des champs à choix, résumés
+    # top-K et HyperLogLog pour le reste (comme `track_user_response`)
+    sessions_by_id = {str(session["_id"]): session for session in sessions}
+    sketches: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for response in responses:
+        node_id, field_name, value = response.get("node_id"), response.get("field_name"), response.get("response_value")
+        session = sessions_by_id.get(response["session_id"])
+        if not node_id or not field_name or value is None or session is None:
+            continue
+        field = field_of(session, node_id, field_name)
+        if field is None:
+            continue
+        node_key, field_key, value = response_key(node_id), response_key(field_name), str(value)
+        if field["kind"] == CATEGORICAL_FIELD and value in field["values"]:
+            _inc(doc, f"responses.{node_key}.{field_key}.{response_key(value)}")
+            continue
+        sketch = sketches.setdefault((node_key, field_key), {
+            "total": 0,
+            "top": SpaceSaving(RESPONSE_SKETCH_TOPK),
+            "distinct": HyperLogLog(RESPONSE_SKETCH_PRECISION)
+        })
+        sketch["total"] += 1
+        sketch["top"].add(value[:MAX_RESPONSE_VALUE_LENGTH])
+        sketch["distinct"].add(value)
+    for (node_key, field_key), sketch in sketches.items():
+        doc.setdefault(RESPONSE_SKETCHES_FIELD, {}).setdefault(node_key, {})[field_key] = {
+            "total": sketch["total"],
+            "top": sketch["top"].to_doc(),
+            "distinct": sketch["distinct"].to_binary(),
+            "version": 1
+        }
+
+    return doc
+
+
+def replace_operations(assistant_id: str, date: str, doc: Optional[Dict[str, Any]]) -> List[Any]:
+    """
+    Opérations qui remplacent les documents d'une journée par `doc` (un seul
+    document, sans shard), ou les suppriment si aucune session n'a démarré ce
+    jour-là
+    """
+    key = {"date": date, "assistant_id": assistant_id}
+    if doc is None:
+        return [DeleteMany(key)]
+    return [
+        DeleteMany({**key, "shard": {"$exists": True}}),
+        ReplaceOne({**key, "shard": {"$exists": False}}, doc, upsert=True)
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Processus du pool
+# ---------------------------------------------------------------------------
+
+def init_worker(mongodb_url: str, db_name: str):
+    """
+    Initialisation d'un processus du pool : un client PyMongo par processus
+    """
+    global _db
+    _db = MongoClient(mongodb_url)[db_name]
+
+
+def _session_flow(db, session: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Flow suivi par une session (version synchrone de `load_session_flow`)
+    """
+    key = session.get("flow_hash") or session["assistant_id"]
+    flow = _flows.get(key)
+    if flow is not None:
+        return flow
+
+    flow = None
+    if session.get("flow_hash"):
+        snapshot = db[SNAPSHOTS_COLLECTION].find_one(
+            {"content_hash": session["flow_hash"]}, {"flow": 1, COMPILED_FLOW_FIELD: 1}, sort=[("version", DESCENDING)]
+        )
+        if snapshot:
+            flow = {**snapshot["flow"], COMPILED_FLOW_FIELD: snapshot.get(COMPILED_FLOW_FIELD)}
+    if flow is None and ObjectId.is_valid(session["assistant_id"]):
+        flow = db[ASSISTANTS_COLLECTION].find_one({"_id": ObjectId(session["assistant_id"])}, {"nodes": 1})
+    _flows[key] = flow or {}
+    return _flows[key]
+
+
+def _field_of(db) -> Callable[[Dict[str, Any], str, str], Optional[Dict[str, Any]]]:
+    def field_of(session: Dict[str, Any], node_id: str, field_name: str) -> Optional[Dict[str, Any]]:
+        key = (session.get("flow_hash") or session["assistant_id"], node_id, field_name)
+        if key not in _response_fields:
+            _response_fields[key] = response_field(_session_flow(db, session), node_id, field_name)
+        return _response_fields[key]
+    return field_of
+
+
+def _find_in(db, collection: str, session_ids: List[str], query: Dict[str, Any], projection: Dict[str, int]) -> List[Dict[str, Any]]:
+    """
+    Documents des sessions `session_ids`, par requêtes $in de taille bornée
+    """
+    documents: List[Dict[str, Any]] = []
+    for i in range(0, len(session_ids), IN_QUERY_CHUNK_SIZE):
+        chunk = session_ids[i:i + IN_QUERY_CHUNK_SIZE]
+        documents.extend(db[collection].find({"session_id": {"$in": chunk}, **query}, projection))
+    return documents
+
+
+def load_partition(db, assistant_id: str, date: str) -> Tuple[List[Dict[str, Any]], ...]:
+    """
+    Sessions démarrées ce jour-là, avec leurs étapes, messages et réponses
+    """
+    start, end = day_bounds(date)
+    sessions = list(db[SESSIONS_COLLECTION].find(
+        {"assistant_id": assistant_id, "started_at": {"$gte": start, "$lt": end}},
+        {"status": 1, "started_at": 1, "ended_at": 1, "lead_status": 1, "visitor_id": 1,
+         "user_info.source": 1, "flow_hash": 1, "assistant_id": 1, "event_log": 1}
+    ))
+    session_ids = [str(session["_id"]) for session in sessions]
+    # Sessions non migrées : début dans les anciennes collections, suite dans le journal
+    legacy = [str(session["_id"]) for session in sessions if not session.get("event_log")]
+
+    steps = _find_in(db, STEPS_COLLECTION, session_ids, {}, {"session_id": 1, "node_id": 1, "is_completed": 1, "timestamp": 1})
+
+    events = _find_in(
+        db, EVENTS_COLLECTION, session_ids,
+        {"type": {"$in": [SessionEventType.MESSAGE.value, SessionEventType.USER_RESPONSE.value]}},
+        {"session_id": 1, "type": 1, "node_id": 1, "content_type": 1, "field_name": 1, "response_value": 1}
+    )
+    messages = [event for event in events if event["type"] == SessionEventType.MESSAGE.value]
+    responses = [event for event in events if event["type"] == SessionEventType.USER_RESPONSE.value]
+    if legacy:
+        messages += _find_in(db, LEGACY_MESSAGES_COLLECTION, legacy, {}, {"session_id": 1, "node_id": 1, "content_type": 1})
+        responses += _find_in(
+            db, LEGACY_USER_RESPONSES_COLLECTION, legacy, {}, {"session_id": 1, "node_id": 1, "field_name": 1, "response_value": 1}
+        )
+    return sessions, steps, messages, responses
+
+
+def rebuild_partition(partition: Partition) -> Tuple[str, str, Optional[Dict[str, Any]], Dict[str, int]]:
+    """
+    Recalcule le document d'une partition (exécuté dans un processus du pool).
+    Retourne la partition, le document (None si aucune session) et le volume
+    de données lues.
+    """
+    assistant_id, date = partition
+    sessions, steps, messages, responses = load_partition(_db, assistant_id, date)
+    volume = {"sessions": len(sessions), "steps": len(steps), "events": len(messages) + len(responses)}
+    if not sessions:
+        return assistant_id, date, None, volume
+    doc = build_daily_analytics(assistant_id, date, sessions, steps, messages, responses, _field_of(_db))
+    return assistant_id, date, doc, volume
+
+
+# ---------------------------------------------------------------------------
+# Orchestration
+# ---------------------------------------------------------------------------
+
+def list_partitions(db, since: datetime, until: datetime, assistant_ids: Optional[Iterable[str]] = None) -> List[Partition]:
+    """
+    Partitions (assistant, jour) à reconstruire : jours où des sessions ont
+    démarré, et jours qui ont déjà un document d'analytics (à supprimer s'il
+    n'y a plus de session)
+    """
+    match: Dict[str, Any] = {"started_at": {"$gte": since, "$lt": until}}
+    analytics_match: Dict[str, Any] = {"date": {"$gte": since.strftime("%Y-%m-%d"), "$lt": until.strftime("%Y-%m-%d")}}
+    if assistant_ids:
+        match["assistant_id"] = analytics_match["assistant_id"] = {"$in": list(assistant_ids)}
+
+    partitions = {
+        (row["_id"]["assistant_id"], row["_id"]["date"])
+        for row in db[SESSIONS_COLLECTION].aggregate([
+            {"$match": match},
+            {"$group": {"_id": {
+                "assistant_id": "$assistant_id",
+                "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$started_at"}}
+            }}}
+        ], allowDiskUse=True)
+    }
+    partitions.update(
+        (row["_id"]["assistant_id"], row["_id"]["date"])
+        for row in db[ANALYTICS_COLLECTION].aggregate([
+            {"$match": analytics_match},
+            {"$group": {"_id": {"assistant_id": "$assistant_id", "date": "$date"}}}
+        ])
+    )
+    return sorted(partitions)
+
+
+def rebuild_analytics(
+    mongodb_url: str,
+    db_name: str,
+    since: datetime,
+    until: datetime,
+    assistant_ids: Optional[Iterable[str]] = None,
+    workers: Optional[int] = None,
+    dry_run: bool = False,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> Dict[str, Any]:
+    """
+    Reconstruit les documents d'analytics de la période [since, until[ et
+    retourne les volumes traités et le débit. Avec `dry_run`, les documents
+    sont calculés mais pas écrits. `progress` est appelé avec les statistiques
+    courantes après chaque bulk_write.
+    """
+    started = time.perf_counter()
+    db = MongoClient(mongodb_url)[db_name]
+    partitions = list_partitions(db, since, until, assistant_ids)
+    stats = {"partitions": len(partitions), "done": 0, "documents": 0, "deleted_days": 0,
+             "sessions": 0, "steps": 0, "events": 0, "writes": 0}
+
+    operations: List[Any] = []
+
+    def flush():
+        if operations and not dry_run:
+            db[ANALYTICS_COLLECTION].bulk_write(operations, ordered=False)
+            stats["writes"] += 1
+        operations.clear()
+        if progress:
+            progress({**stats, "elapsed": time.perf_counter() - started})
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(mongodb_url, db_name)) as pool:
+        for assistant_id, date, doc, volume in pool.map(rebuild_partition, partitions, chunksize=MAP_CHUNK_SIZE):
+            for key, count in volume.items():
+                stats[key] += count
+            stats["done"] += 1
+            stats["documents" if doc is not None else "deleted_days"] += 1
+            operations.extend(replace_operations(assistant_id, date, doc))
+            if len(operations) >= BULK_WRITE_SIZE:
+                flush()
+        flush()
+
+    elapsed = time.perf_counter() - started
+    stats["elapsed"] = elapsed
+    stats["partitions_per_second"] = stats["done"] / elapsed if elapsed else 0
+    stats["sessions_per_second"] = stats["sessions"] / elapsed if elapsed else 0
+    return stats
@@ -1,15 +1,36 @@
 """
 Service pour la gestion des analytics et le suivi des conversations
 """
+import asyncio
+import hashlib
+import logging
+import os
+import random
+from collections import Counter
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, AsyncIterator, Tuple
+from urllib.parse import unquote
 from bson import ObjectId
+from pymongo.errors import PyMongoError
 
 from app.database.mongodb import get_database
-from app.models.session import LeadStatus, SessionStatus
+from app.models.session import LeadStatus, SessionStatus, MessageSender, SessionEventType
+from app.services.event_log import (
+    STREAM_BATCH_SIZE, append_event, merge_by_timestamp, new_event, write_event, get_session_events, iter_session_events,
+    project_messages, project_qa_pairs, project_user_responses, project_form_submissions
+)
+from app.services.assistant_snapshots import load_session_flow
+from app.services.event_spool import counter_update, event_spool
+from app.services.flow_graph import CATEGORICAL_FIELD, FREE_TEXT_FIELD, response_field
+from app.utils.cache import TTLCache
+from app.utils.sketches import HyperLogLog, SpaceSaving, update_sketch
+
+logger = logging.getLogger(__name__)
 
 # Collections MongoDB
 SESSIONS_COLLECTION = "sessions"
+# Anciennes collections de conversation, lues uniquement pour les sessions non migrées
+# vers le journal d'événements (voir app.services.event_log)
 CONVERSATIONS_COLLECTION = "conversations"
 STEPS_COLLECTION = "session_steps"
 ASSISTANTS_COLLECTION = "assistants"
@@ -18,26 +39,314 @@ USER_RESPONSES_COLLECTION = "user_responses"
 QA_PAIRS_COLLECTION = "qa_pairs"
 FORM_SUBMISSIONS_COLLECTION = "form_submissions"
 
+# Nombre maximal d'identifiants par requête $in
+IN_QUERY_CHUNK_SIZE = 1000
+
+# Compteurs quotidiens répartis sur plusieurs documents `{date, assistant_id,
+# shard}` (shard tiré au hasard à chaque écriture) pour les assistants à fort
+# trafic : les écritures concurrentes ne se disputent plus un seul document.
+# Les lectures additionnent tous les documents d'une journée.
+# - ANALYTICS_SHARDS : nombre de documents par assistant et par jour (défaut 1,
+#   un seul document sans champ `shard`)
+# - ANALYTICS_SHARDED_ASSISTANTS : assistants concernés, séparés par des
+#   virgules (défaut : tous)
+ANALYTICS_SHARDS = max(1, int(os.getenv("ANALYTICS_SHARDS", "1")))
+ANALYTICS_SHARDED_ASSISTANTS = {
+    assistant_id.strip() for assistant_id in os.getenv("ANALYTICS_SHARDED_ASSISTANTS", "").split(",") if assistant_id.strip()
+}
+
+# Réponses libres (e-mails, noms...) : résumé top-K et nombre de valeurs
+# distinctes par champ (`response_sketches.<nœud>.<champ>`) au lieu d'un
+# compteur par valeur ; les champs à choix gardent des compteurs exacts
+# (`responses.<nœud>.<champ>.<valeur>`) pour les valeurs déclarées dans le flow.
+# Les clés sont encodées (voir `response_key`).
+RESPONSE_SKETCHES_FIELD = "response_sketches"
+RESPONSE_SKETCH_TOPK = int(os.getenv("RESPONSE_SKETCH_TOPK", "32"))
+RESPONSE_SKETCH_PRECISION = 10
+# Longueur maximale d'une valeur conservée dans le top-K
+MAX_RESPONSE_VALUE_LENGTH = 200
+
+# Visiteurs et leads uniques du jour (`uniques.visitors`, `uniques.leads`) :
+# registres HyperLogLog stockés en binaire, fusionnés sur la période lue
+UNIQUES_FIELD = "uniques"
+UNIQUES_PRECISION = 12
+
+# Pseudo-nœuds de la matrice de transitions (`transitions.<depuis>.<vers>` du
+# document d'analytics quotidien) : entrée dans le flow et sortie de la session
+TRANSITION_ENTRY = "entry"
+TRANSITION_EXIT = "exit"
+
+# Assistant de chaque session active (ne change jamais) : le suivi des messages
+# n'a pas à relire la session, et continue de fonctionner si MongoDB est
+# indisponible (les événements vont alors dans le spool local)
+_session_assistants = TTLCache("session_assistants", maxsize=50000, ttl=3600)
+
+async def _session_assistant_id(db, session_id: str) -> Optional[str]:
+    assistant_id = _session_assistants.get(session_id)
+    if assistant_id is None:
+        session = await db[SESSIONS_COLLECTION].find_one({"_id": ObjectId(session_id)}, {"assistant_id": 1})
+        if not session:
+            return None
+        assistant_id = session["assistant_id"]
+        _session_assistants.set(session_id, assistant_id)
+    return assistant_id
+
+def analytics_key(assistant_id: str, date: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Filtre du document d'analytics quotidien où écrire : `{date, assistant_id}`,
+    plus un numéro de shard si les compteurs de l'assistant sont répartis
+    """
+    key: Dict[str, Any] = {"date": date or datetime.utcnow().strftime("%Y-%m-%d"), "assistant_id": assistant_id}
+    if ANALYTICS_SHARDS > 1 and (not ANALYTICS_SHARDED_ASSISTANTS or assistant_id in ANALYTICS_SHARDED_ASSISTANTS):
+        key["shard"] = random.randrange(ANALYTICS_SHARDS)
+    return key
+
+# Champs de réponse déclarés, par flow suivi (hash du snapshot ou assistant), nœud et champ
+_session_flows = TTLCache("session_flows", maxsize=50000, ttl=3600)
+_response_fields = TTLCache("response_fields", maxsize=10000, ttl=300)
+
+async def _response_field(db, session_id: str, node_id: str, field_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Champ de réponse déclaré dans le flow suivi par la session (voir
+    `flow_graph.response_field`), ou None
+    """
+    session = _session_flows.get(session_id)
+    if session is None:
+        session = await db[SESSIONS_COLLECTION].find_one(
+            {"_id": ObjectId(session_id)}, {"assistant_id": 1, "flow_hash": 1}
+        ) or {}
+        _session_flows.set(session_id, session)
+    if not session:
+        return None
+    
+    key = (session.get("flow_hash") or session["assistant_id"], node_id, field_name)
+    field = _response_fields.get(key)
+    if field is None:
+        flow = await load_session_flow(db, session)
+        # {} : champ absent du flow (mis en cache comme les autres)
+        field = response_field(flow or {}, node_id, field_name) or {}
+        _response_fields.set(key, field)
+    return field or None
+
+def response_key(value: str) -> str:
+    """
+    Clé de document utilisable dans un chemin MongoDB pour une valeur fournie par
+    le visiteur ou par le flow (nœud, champ, valeur de réponse) : « % », « . »,
+    « $ » et le caractère nul sont encodés comme dans une URL, la clé vide
+    devient « % »
+    """
+    if value == "":
+        return "%"
+    return value.replace("%", "%25").replace(".", "%2E").replace("$", "%24").replace("\x00", "%00")
+
+def decode_response_key(key: str) -> str:
+    """
+    Inverse de `response_key`
+    """
+    return "" if key == "%" else unquote(key)
+
+def _add_response(value: str):
+    """
+    Mise à jour du sketch d'un champ libre (voir `update_sketch`)
+    """
+    def apply(current: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        current = current or {}
+        top = SpaceSaving.from_doc(current.get("top"), RESPONSE_SKETCH_TOPK)
+        top.add(value[:MAX_RESPONSE_VALUE_LENGTH])
+        distinct = HyperLogLog.from_binary(current.get("distinct"), RESPONSE_SKETCH_PRECISION)
+        distinct.add(value)
+        return {"total": current.get("total", 0) + 1, "top": top.to_doc(), "distinct": distinct.to_binary()}
+    return apply
+
+def merge_responses(analytics_data: List[Dict[str, Any]], limit: int = RESPONSE_SKETCH_TOPK) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Fusionne les réponses de plusieurs documents d'analytics quotidiens, par
+    nœud et par champ : nature du champ, nombre de réponses, nombre de valeurs
+    distinctes (estimé pour les champs libres) et valeurs les plus fréquentes
+    """
+    exact: Dict[Tuple[str, str], Counter] = {}
+    sketches: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    
+    for data in analytics_data:
+        for node_id, fields in (data.get("responses") or {}).items():
+            for field_name, values in fields.items():
+                counts = exact.setdefault((decode_response_key(node_id), decode_response_key(field_name)), Counter())
+                for value, count in values.items():
+                    # Sous-documents : valeurs écrites sans encodage (chemin coupé sur un « . »)
+                    if isinstance(count, (int, float)):
+                        counts[decode_response_key(value)] += count
+        for node_id, fields in (data.get(RESPONSE_SKETCHES_FIELD) or {}).items():
+            for field_name, sketch in fields.items():
+                merged = sketches.setdefault((decode_response_key(node_id), decode_response_key(field_name)), {
+                    "total": 0,
+                    "top": SpaceSaving(RESPONSE_SKETCH_TOPK),
+                    "distinct": HyperLogLog(RESPONSE_SKETCH_PRECISION)
+                })
+                merged["total"] += sketch.get("total", 0)
+                merged["top"].merge(SpaceSaving.from_doc(sketch.get("top"), RESPONSE_SKETCH_TOPK))
+                merged["distinct"].merge(HyperLogLog.from_binary(sketch.get("distinct"), RESPONSE_SKETCH_PRECISION))
+    
+    result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for node_id, field_name in set(exact) | set(sketches):
+        counts = exact.get((node_id, field_name), Counter())
+        sketch = sketches.get((node_id, field_name))
+        if sketch is None:
+            result.setdefault(node_id, {})[field_name] = {
+                "kind": CATEGORICAL_FIELD,
+                "total": sum(counts.values()),
+                "distinct": len(counts),
+                "top": [{"value": value, "count": count, "error": 0} for value, count in counts.most_common(limit)]
+            }
+            continue
+        
+        # Champ libre (les compteurs exacts viennent des jours antérieurs aux sketches)
+        for value, count in counts.items():
+            sketch["top"].add(value, count)
+            sketch["distinct"].add(value)
+        result.setdefault(node_id, {})[field_name] = {
+            "kind": FREE_TEXT_FIELD,
+            "total": sketch["total"] + sum(counts.values()),
+            "distinct": sketch["distinct"].count(),
+            "top": [
+                {"value": value, "count": count, "error": error}
+                for value, count, error in sketch["top"].top(limit)
+            ]
+        }
+    return result
+
+def visitor_id(user_id: Optional[str], user_info: Optional[Dict[str, Any]], client_ip: Optional[str]) -> Optional[str]:
+    """
+    Identifiant anonyme d'un visiteur : identifiant fourni par le site ou par le
+    widget (`user_id`, `user_info.visitor_id`), à défaut adresse IP et
+    navigateur. Seul un hash est conservé.
+    """
+    info = user_info or {}
+    raw = user_id or info.get("visitor_id")
+    if not raw:
+        if not client_ip:
+            return None
+        raw = f"{client_ip}|{info.get('userAgent', '')}"
+    return hashlib.sha256(str(raw).encode("utf-8")).hexdigest()[:32]
+
+def _add_unique(visitor: str):
+    def apply(current: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        registers = HyperLogLog.from_binary((current or {}).get("hll"), UNIQUES_PRECISION)
+        if not registers.add(visitor) and current:
+            # Visiteur déjà compté (ou masqué) : pas d'écriture
+            return None
+        return {"hll": registers.to_binary()}
+    return apply
+
+async def _track_unique(db, assistant_id: str, kind: str, visitor: Optional[str]):
+    """
+    Ajoute `visitor` aux uniques du jour (`kind` : "visitors" ou "leads")
+    """
+    if not visitor or event_spool.degraded:
+        return
+    try:
+        await update_sketch(
+            db[ANALYTICS_COLLECTION],
+            analytics_key(assistant_id),
+            f"{UNIQUES_FIELD}.{kind}",
+            _add_unique(visitor),
+            sketch=f"unique_{kind}"
+        )
+    except PyMongoError as e:
+        logger.error("Uniques (%s) de l'assistant %s non mis à jour: %s", kind, assistant_id, e)
+
+def merge_uniques(analytics_data: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Visiteurs et leads uniques sur l'ensemble des documents quotidiens
+    (union des HyperLogLog : un visiteur revenu plusieurs jours compte une fois)
+    """
+    merged = {kind: HyperLogLog(UNIQUES_PRECISION) for kind in ("visitors", "leads")}
+    for data in analytics_data:
+        for kind, sketch in (data.get(UNIQUES_FIELD) or {}).items():
+            if kind in merged and sketch.get("hll"):
+                merged[kind].merge(HyperLogLog.from_binary(sketch["hll"], UNIQUES_PRECISION))
+    return {kind: registers.count() for kind, registers in merged.items()}
+
+def step_transitions(previous_node_id: Optional[str], node_ids: List[str]) -> List[Tuple[str, str]]:
+    """
+    Connexions parcourues quand les étapes `node_ids` suivent le nœud
+    `previous_node_id` (None au début de la session). Les étapes répétées sur un
+    même nœud (question puis réponse) ne sont pas des transitions.
+    """
+    transitions = []
+    source = previous_node_id or TRANSITION_ENTRY
+    for node_id in node_ids:
+        if node_id and node_id != source:
+            transitions.append((source, node_id))
+            source = node_id
+    return transitions
+
+def conversation_to_dict(msg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Format d'un message de conversation dans les réponses de l'API
+    """
+    return {
+        "id": str(msg["_id"]),
+        "content": msg["content"],
+        "sender": msg["sender"],
+        "timestamp": msg["timestamp"],
+        "content_type": msg.get("content_type", "text"),
+        "is_question": msg.get("is_question", False)
+    }
+
+async def _find_by_ids(db, collection: str, ids: List[str]) -> List[Dict[str, Any]]:
+    """
+    Récupère des documents par leurs identifiants avec des requêtes $in (par lots,
+    en parallèle) en conservant l'ordre des identifiants
+    """
+    object_ids = [ObjectId(doc_id) for doc_id in ids if ObjectId.is_valid(doc_id)]
+    if not object_ids:
+        return []
+    
+    chunks = [object_ids[i:i + IN_QUERY_CHUNK_SIZE] for i in range(0, len(object_ids), IN_QUERY_CHUNK_SIZE)]
+    results = await asyncio.gather(*[
+        db[collection].find({"_id": {"$in": chunk}}).to_list(length=None) for chunk in chunks
+    ])
+    
+    docs_by_id = {doc["_id"]: doc for docs in results for doc in docs}
+    return [docs_by_id[doc_id] for doc_id in object_ids if doc_id in docs_by_id]
+
 class AnalyticsService:
     """
     Service pour gérer les analytics des conversations et des leads
     """
     
     @staticmethod
-    async def track_session_start(session_id: str, assistant_id: str, user_info: Optional[Dict[str, Any]] = None):
+    async def get_session_assistant_id(session_id: str) -> Optional[str]:
+        """
+        Assistant d'une session, lu dans le cache des sessions suivies (sans
+        accès à la base), à défaut dans la session ; None si elle n'existe pas
+        """
+        db = await get_database()
+        return await _session_assistant_id(db, session_id)
+    
+    @staticmethod
+    async def track_session_start(
+        session_id: str,
+        assistant_id: str,
+        user_info: Optional[Dict[str, Any]] = None,
+        visitor: Optional[str] = None
+    ):
         """
         Enregistre le début d'une session et met à jour les analytics
+        (`visitor` : identifiant anonyme du visiteur, voir `visitor_id`)
         """
         db = await get_database()
         today = datetime.utcnow().strftime("%Y-%m-%d")
+        _session_assistants.set(session_id, assistant_id)
         
-        print(f" [Analytics] Début de session {session_id} pour l'assistant {assistant_id}")
+        logger.debug("Début de session %s pour l'assistant %s", session_id, assistant_id)
         
         # Mettre à jour les compteurs d'analytics pour aujourd'hui
         # On incrémente abandoned_sessions et partial_leads par défaut
         # Ces compteurs seront décrémentés si la session se termine correctement
+        analytics_filter = analytics_key(assistant_id, today)
         await db[ANALYTICS_COLLECTION].update_one(
-            {"date": today, "assistant_id": assistant_id},
+            analytics_filter,
             {
                 "$inc": {
                     "sessions_count": 1,
@@ -54,12 +363,14 @@ class AnalyticsService:
             upsert=True
         )
         
-        print(f" [Analytics] Session {session_id} marquée comme potentiellement abandonnée et lead partiel par défaut")
+        logger.debug("Session %s marquée comme potentiellement abandonnée et lead partiel par défaut", session_id)
+        
+        await _track_unique(db, assistant_id, "visitors", visitor)
         
         # Enregistrer la source du trafic si disponible
         if user_info and "source" in user_info:
             await db[ANALYTICS_COLLECTION].update_one(
-                {"date": today, "assistant_id": assistant_id},
+                analytics_filter,
                 {
                     "$inc": {
                         f"sources.{user_info['source']}": 1
@@ -68,99 +379,64 @@ class AnalyticsService:
             )
     
     @staticmethod
-    async def track_message(session_id: str, message_type: str, content: str, is_question: bool, node_id: Optional[str] = None):
-        print("[DEBUG] >>> track_message called", session_id, message_type, content, is_question, node_id)
+    async def track_message(
+        session_id: str,
+        message_type: str,
+        content: str,
+        is_question: bool = False,
+        node_id: Optional[str] = None,
+        sender: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        session: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Enregistre un message dans le journal d'événements de la session et met à
+        jour les compteurs d'analytics. Retourne l'événement créé.
+        """
+        logger.debug("track_message session=%s type=%s is_question=%s node=%s", session_id, message_type, is_question, node_id)
         db = await get_database()
         
-        # Récupérer la session
-        session = await db[SESSIONS_COLLECTION].find_one({"_id": ObjectId(session_id)})
-        if not session:
-            print(f"[track_message] Session {session_id} introuvable !")
-            return
+        # Récupérer l'assistant de la session (sauf si l'appelant l'a déjà chargée)
+        if session is not None:
+            assistant_id = session["assistant_id"]
+        else:
+            assistant_id = await _session_assistant_id(db, session_id)
+        if not assistant_id:
+            logger.warning("track_message: session %s introuvable", session_id)
+            return None
         
-        assistant_id = session["assistant_id"]
         today = datetime.utcnow().strftime("%Y-%m-%d")
         
-        # Détection du type de message (formulaire ou non)
-        is_form = message_type == "form"
-        
-        # On déduit sender côté backend : si is_question=True => sender="bot", sinon sender="user"
-        sender = "bot" if is_question else "user"
-        
-        # Identification explicite des flags is_form et is_question
-        is_form = message_type == "form"
-        is_question_flag = bool(is_question)
-        
-        if not is_question_flag and sender == "user":
-            # On retrouve la dernière question (du bot) sans réponse pour ce node/session
-            last_qa_pair = await db[QA_PAIRS_COLLECTION].find_one({
-                "session_id": session_id,
-                "node_id": node_id,
-                "is_question": True,
-                "answer": None
-            }, sort=[("timestamp", -1)])
-            answer_text = content
-            if last_qa_pair:
-                # Met à jour le doc QA_PAIR avec la réponse et is_question à False
-                await db[QA_PAIRS_COLLECTION].update_one(
-                    {"_id": last_qa_pair["_id"]},
-                    {"$set": {"answer": answer_text, "is_form": is_form, "is_question": False}}
-                )
-                print(f"[track_message] QA_PAIR (update): {last_qa_pair['_id']} <- {answer_text}")
-            else:
-                # Optionnel : insérer un doc orphelin si aucune question trouvée
-                pass
-        
-        # On conserve l'insertion classique dans conversations pour l'historique complet
-        conversation_doc = {
-            "session_id": session_id,
-            "content": content,
-            "sender": sender,
-            "timestamp": datetime.utcnow(),
-            "content_type": message_type,
-            "is_question": is_question_flag,
-            "is_form": is_form,
-            "node_id": node_id
-        }
-        print(f"[track_message] Insertion dans {CONVERSATIONS_COLLECTION}: {conversation_doc}")
-        await db[CONVERSATIONS_COLLECTION].insert_one(conversation_doc)
-        
-        # Si c'est une question (bot ou formulaire), enregistrer aussi dans QA_PAIRS_COLLECTION
-        if is_question_flag:
-            doc = {
-                "question": content,
-                "answer": None,
-                "is_form": is_form,
-                "is_question": True,
-                "node_id": node_id,
-                "session_id": session_id,
-                "timestamp": datetime.utcnow()
-            }
-            print(f"[track_message] QA_PAIR (question): {doc}")
-            await db[QA_PAIRS_COLLECTION].insert_one(doc)
-        
-        # Mettre à jour les compteurs d'analytics
-        await db[ANALYTICS_COLLECTION].update_one(
-            {"date": today, "assistant_id": assistant_id},
-            {
-                "$inc": {
-                    "messages_count": 1,
-                    f"messages_by_type.{message_type}": 1
-                }
-            },
-            upsert=True
+        # Si l'expéditeur n'est pas fourni : is_question=True => "bot", sinon "user"
+        if sender is None:
+            sender = MessageSender.BOT if is_question else MessageSender.USER
+        
+        # Une seule écriture par message : les paires question/réponse et les
+        # conversations sont des projections du journal
+        event = new_event(
+            session_id,
+            SessionEventType.MESSAGE,
+            node_id=node_id,
+            sender=sender,
+            content=content,
+            content_type=message_type,
+            metadata=metadata,
+            is_question=bool(is_question),
+            is_form=message_type == "form"
         )
         
-        # Si c'est un message avec un node_id, mettre à jour les statistiques du nœud
+        # Compteurs d'analytics (et statistiques du nœud), écrits avec l'événement
+        # (ou rejoués avec lui depuis le spool local)
+        counters = {
+            "messages_count": 1,
+            f"messages_by_type.{message_type}": 1
+        }
         if node_id:
-            await db[ANALYTICS_COLLECTION].update_one(
-                {"date": today, "assistant_id": assistant_id},
-                {
-                    "$inc": {
-                        f"nodes.{node_id}.visits": 1
-                    }
-                }
-            )
+            counters[f"nodes.{node_id}.visits"] = 1
+        
+        return await write_event(event, [
+            counter_update(ANALYTICS_COLLECTION, analytics_key(assistant_id, today), {"$inc": counters})
+        ])
     
     @staticmethod
     async def track_lead_status_change(session_id: str, new_status: str):
@@ -177,8 +453,8 @@ class AnalyticsService:
         assistant_id = session["assistant_id"]
         today = datetime.utcnow().strftime("%Y-%m-%d")
         
-        print(f" [Analytics] Enregistrement du changement de statut de lead pour la session {session_id}: {new_status}")
-        print(f" [Analytics] NOTE: Les compteurs de leads ne sont plus mis à jour ici, mais uniquement lors de la fin de session")
+        logger.debug("Enregistrement du changement de statut de lead pour la session %s: %s", session_id, new_status)
+        logger.debug("NOTE: Les compteurs de leads ne sont plus mis à jour ici, mais uniquement lors de la fin de session")
         
         # Nous ne mettons plus à jour les compteurs ici, car nous le faisons uniquement 
         # lors de la fin de session réussie (track_session_end)
@@ -189,7 +465,20 @@ class AnalyticsService:
             {"$set": {"lead_status": new_status}}
         )
         
-        print(f" [Analytics] Statut de lead mis à jour pour la session {session_id}: {new_status}")
+        if new_status in (LeadStatus.PARTIAL, LeadStatus.COMPLETE):
+            await AnalyticsService.track_unique_lead(session)
+        
+        logger.debug("Statut de lead mis à jour pour la session %s: %s", session_id, new_status)
+    
+    @staticmethod
+    async def track_unique_lead(session: Dict[str, Any]):
+        """
+        Compte le visiteur de la session parmi les leads uniques du jour (les
+        sessions antérieures à l'identifiant de visiteur comptent chacune pour un)
+        """
+        db = await get_database()
+        visitor = session.get("visitor_id") or str(session["_id"])
+        await _track_unique(db, session["assistant_id"], "leads", visitor)
     
     @staticmethod
     async def track_session_end(session_id: str, status: str):
@@ -206,84 +495,39 @@ class AnalyticsService:
         assistant_id = session["assistant_id"]
         today = datetime.utcnow().strftime("%Y-%m-%d")
         
-        print(f" [Analytics] Enregistrement de la fin de session {session_id} avec statut: {status}")
+        logger.debug("Enregistrement de la fin de session %s avec statut: %s", session_id, status)
         
         # Calculer la durée de la session
         started_at = session.get("started_at")
         ended_at = datetime.utcnow()
         duration_seconds = (ended_at - started_at).total_seconds() if started_at else 0
         
-        print(f" [Analytics] Durée de la session: {duration_seconds} secondes")
-        
-        # Récupérer les analytics actuels pour calculer la nouvelle durée moyenne et le taux de complétion
-        analytics = await db[ANALYTICS_COLLECTION].find_one({"date": today, "assistant_id": assistant_id})
-        
-        # Calculer la nouvelle durée moyenne
-        avg_duration = 0
-        sessions_count = 0
-        completion_rate = 0
-        
-        if analytics:
-            # Récupérer la durée moyenne actuelle et le nombre de sessions
-            avg_duration = analytics.get("avg_session_duration", 0)
-            completed_sessions = analytics.get("completed_sessions", 0)
-            abandoned_sessions = analytics.get("abandoned_sessions", 0)
-            total_sessions = analytics.get("sessions_count", 0)
-            
-            # Calculer le nombre de sessions terminées (complétées + abandonnées)
-            sessions_count = completed_sessions + abandoned_sessions
-            
-            # Calculer la nouvelle durée moyenne
-            if sessions_count > 0:
-                # Calculer la nouvelle moyenne: ((moyenne actuelle * nb sessions) + nouvelle durée) / (nb sessions + 1)
-                total_duration = avg_duration * sessions_count
-                new_total_duration = total_duration + duration_seconds
-                new_sessions_count = sessions_count + 1
-                avg_duration = new_total_duration / new_sessions_count
-                print(f" [Analytics] Nouvelle durée moyenne: {avg_duration:.2f} secondes (après {new_sessions_count} sessions)")
-            else:
-                # Première session terminée
-                avg_duration = duration_seconds
-                print(f" [Analytics] Première durée moyenne: {avg_duration:.2f} secondes")
-            
-            # Calculer le nouveau taux de complétion
-            if status == SessionStatus.COMPLETED:
-                # Si cette session est complétée, incrémenter le nombre de sessions complétées
-                new_completed_sessions = completed_sessions + 1
-            else:
-                new_completed_sessions = completed_sessions
-            
-            # Le taux de complétion est le pourcentage de sessions complétées par rapport au total
-            if total_sessions > 0:
-                completion_rate = (new_completed_sessions / total_sessions) * 100
-                print(f" [Analytics] Nouveau taux de complétion: {completion_rate:.2f}% ({new_completed_sessions}/{total_sessions} sessions)")
-        else:
-            # Première session terminée
-            avg_duration = duration_seconds
-            print(f" [Analytics] Première durée moyenne: {avg_duration:.2f} secondes")
-            
-            # Pour la première session, le taux de complétion est soit 100% (si complétée) soit 0% (si abandonnée)
-            if status == SessionStatus.COMPLETED:
-                completion_rate = 100
-                print(f" [Analytics] Premier taux de complétion: 100% (1/1 session)")
-            else:
-                completion_rate = 0
-                print(f" [Analytics] Premier taux de complétion: 0% (0/1 session)")
+        logger.debug("Durée de la session: %s secondes", duration_seconds)
+        
+        # Durée moyenne et taux de complétion sont calculés à la lecture (somme
+        # des durées et des compteurs de tous les documents du jour) : le shard
+        # mis à jour ne reçoit que des incréments
+        analytics_filter = analytics_key(assistant_id, today)
         
         # Mettre à jour les compteurs selon le statut
         update_data = {
             "$inc": {
                 "active_sessions": -1
             },
-            "$set": {
-                "avg_session_duration": avg_duration,
-                "completion_rate": completion_rate
-            },
             "$push": {
                 "session_durations": duration_seconds
             }
         }
         
+        # Sortie du flow depuis le dernier nœud atteint (matrice de transitions)
+        last_step = await db[STEPS_COLLECTION].find_one(
+            {"session_id": session_id},
+            {"node_id": 1},
+            sort=[("timestamp", -1)]
+        )
+        if last_step and last_step.get("node_id"):
+            update_data["$inc"][f"transitions.{last_step['node_id']}.{TRANSITION_EXIT}"] = 1
+        
         if status == SessionStatus.COMPLETED:
             # Si la session est complétée, on décrémente abandoned_sessions (qui a été incrémenté au début)
             # et on incrémente completed_sessions, complete_leads et leads_count
@@ -292,50 +536,88 @@ class AnalyticsService:
             update_data["$inc"]["partial_leads"] = -1       # Décrémentation car ce n'est plus un lead partiel
             update_data["$inc"]["complete_leads"] = 1        # Incrémentation des leads complets
             update_data["$inc"]["leads_count"] = 1           # Incrémentation du nombre total de leads
-            print(f" [Analytics] Session {session_id} marquée comme complétée pour l'assistant {assistant_id}")
-            print(f" [Analytics] Décrémentation des compteurs abandoned_sessions et partial_leads")
-            print(f" [Analytics] Incrémentation des compteurs complete_leads et leads_count")
+            logger.debug("Session %s marquée comme complétée pour l'assistant %s", session_id, assistant_id)
+            logger.debug("Décrémentation des compteurs abandoned_sessions et partial_leads")
+            logger.debug("Incrémentation des compteurs complete_leads et leads_count")
         elif status == SessionStatus.ABANDONED:
             # Si la session est déjà marquée comme abandonnée au début, on ne fait rien de plus pour abandoned_sessions
             # car le compteur a déjà été incrémenté lors de la création de la session
-            print(f" [Analytics] Session {session_id} confirmée comme abandonnée pour l'assistant {assistant_id}")
+            logger.debug("Session %s confirmée comme abandonnée pour l'assistant %s", session_id, assistant_id)
         
         result = await db[ANALYTICS_COLLECTION].update_one(
-            {"date": today, "assistant_id": assistant_id},
+            analytics_filter,
             update_data,
             upsert=True
         )
-        print(f" [Analytics] Résultat de la mise à jour: {result.modified_count} document(s) modifié(s)")
+        logger.debug("Résultat de la mise à jour: %s document(s) modifié(s)", result.modified_count)
     
     @staticmethod
     async def track_node_completion(session_id: str, node_id: str, time_spent: float):
         """
         Enregistre la complétion d'un nœud et le temps passé
         """
-        db = await get_database()
-        
-        # Récupérer la session
-        session = await db[SESSIONS_COLLECTION].find_one({"_id": ObjectId(session_id)})
-        if not session:
+        await AnalyticsService.track_node_completions(session_id, [(node_id, time_spent)])
+    
+    @staticmethod
+    async def track_node_completions(
+        session_id: str,
+        completions: List[Tuple[str, float]],
+        assistant_id: Optional[str] = None
+    ):
+        """
+        Enregistre en une seule écriture la complétion de plusieurs nœuds
+        (`completions` : nœud et temps passé). `assistant_id` évite de relire
+        la session quand l'appelant l'a déjà chargée.
+        """
+        if not completions:
             return
         
-        assistant_id = session["assistant_id"]
+        db = await get_database()
+        if assistant_id is None:
+            assistant_id = await _session_assistant_id(db, session_id)
+            if not assistant_id:
+                return
+        
         today = datetime.utcnow().strftime("%Y-%m-%d")
+        counts: Counter = Counter()
+        times: Dict[str, List[float]] = {}
+        for node_id, time_spent in completions:
+            counts[f"nodes.{node_id}.completions"] += 1
+            times.setdefault(f"nodes.{node_id}.times", []).append(time_spent)
         
-        # Mettre à jour les statistiques du nœud
+        # Mettre à jour les statistiques des nœuds
         await db[ANALYTICS_COLLECTION].update_one(
-            {"date": today, "assistant_id": assistant_id},
+            analytics_key(assistant_id, today),
             {
-                "$inc": {
-                    f"nodes.{node_id}.completions": 1,
-                },
-                "$push": {
-                    f"nodes.{node_id}.times": time_spent
-                }
+                "$inc": dict(counts),
+                "$push": {path: {"$each": values} for path, values in times.items()}
             },
             upsert=True
         )
     
+    @staticmethod
+    async def track_transitions(session_id: str, previous_node_id: Optional[str], node_ids: List[str]):
+        """
+        Incrémente les compteurs de transitions du jour pour les étapes
+        `node_ids` qui suivent `previous_node_id` (voir `step_transitions`)
+        """
+        transitions = step_transitions(previous_node_id, node_ids)
+        if not transitions:
+            return
+        
+        db = await get_database()
+        assistant_id = await _session_assistant_id(db, session_id)
+        if not assistant_id:
+            return
+        
+        today = datetime.utcnow().strftime("%Y-%m-%d")
+        counters = Counter(f"transitions.{source}.{target}" for source, target in transitions)
+        await db[ANALYTICS_COLLECTION].update_one(
+            analytics_key(assistant_id, today),
+            {"$inc": dict(counters)},
+            upsert=True
+        )
+    
     @staticmethod
     async def track_user_response(session_id: str, node_id: str, field_name: str, response_value: str):
         """
@@ -343,46 +625,55 @@ class AnalyticsService:
         """
         db = await get_database()
         
-        # Récupérer la session
-        session = await db[SESSIONS_COLLECTION].find_one({"_id": ObjectId(session_id)})
-        if not session:
+        # Récupérer l'assistant de la session
+        assistant_id = await _session_assistant_id(db, session_id)
+        if not assistant_id:
             return
         
-        assistant_id = session["assistant_id"]
         today = datetime.utcnow().strftime("%Y-%m-%d")
+        analytics_filter = analytics_key(assistant_id, today)
+        event = new_event(
+            session_id,
+            SessionEventType.USER_RESPONSE,
+            node_id=node_id,
+            field_name=field_name,
+            response_value=response_value
+        )
         
-        # Créer le document de réponse utilisateur
-        user_response_doc = {
-            "session_id": session_id,
-            "node_id": node_id,
-            "field_name": field_name,
-            "response_value": response_value,
-            "timestamp": datetime.utcnow()
-        }
-        
-        # Insérer la réponse dans la collection user_responses
-        await db[USER_RESPONSES_COLLECTION].insert_one(user_response_doc)
+        # Champ absent du flow (nom de champ de formulaire inventé) : la réponse
+        # reste dans le journal, sans compteur ni résumé
+        field = await _response_field(db, session_id, node_id, field_name)
+        if field is None:
+            await write_event(event)
+            return
         
-        # Mettre à jour les compteurs de réponses
-        await db[ANALYTICS_COLLECTION].update_one(
-            {"date": today, "assistant_id": assistant_id},
-            {
-                "$inc": {
-                    f"responses.{node_id}.{field_name}.{response_value}": 1
-                }
-            },
-            upsert=True
-        )
+        # Valeur déclarée d'un champ à choix : compteur exact, écrit avec l'événement
+        value = str(response_value)
+        node_key, field_key = response_key(node_id), response_key(field_name)
+        if field["kind"] == CATEGORICAL_FIELD and value in field["values"]:
+            await write_event(event, [counter_update(
+                ANALYTICS_COLLECTION,
+                analytics_filter,
+                {"$inc": {f"responses.{node_key}.{field_key}.{response_key(value)}": 1}}
+            )])
+            return
         
-        # Mettre à jour la session avec la référence à la réponse
-        await db[SESSIONS_COLLECTION].update_one(
-            {"_id": ObjectId(session_id)},
-            {
-                "$push": {
-                    "user_responses_ids": str(user_response_doc["_id"])
-                }
-            }
-        )
+        # Champ libre ou valeur hors des options : une valeur par visiteur, le
+        # document du jour ne garde qu'un résumé de taille bornée (non mis à jour
+        # si la base est lente : la réponse reste dans le journal)
+        await write_event(event)
+        if event_spool.degraded:
+            return
+        try:
+            await update_sketch(
+                db[ANALYTICS_COLLECTION],
+                analytics_filter,
+                f"{RESPONSE_SKETCHES_FIELD}.{node_key}.{field_key}",
+                _add_response(value),
+                sketch="responses"
+            )
+        except PyMongoError as e:
+            logger.error("Résumé des réponses de %s.%s non mis à jour: %s", node_id, field_name, e)
     
     @staticmethod
     async def track_question_answer(session_id: str, question: str, answer: str, node_id: Optional[str] = None):
@@ -396,28 +687,13 @@ class AnalyticsService:
         if not session:
             return
         
-        # Créer le document de question/réponse
-        qa_doc = {
-            "session_id": session_id,
-            "question": question,
-            "answer": answer,
-            "timestamp": datetime.utcnow()
-        }
-        
-        if node_id:
-            qa_doc["node_id"] = node_id
-        
-        # Insérer la paire Q/R dans la collection qa_pairs
-        result = await db[QA_PAIRS_COLLECTION].insert_one(qa_doc)
-        
-        # Mettre à jour la session avec la référence à la paire Q/R
-        await db[SESSIONS_COLLECTION].update_one(
-            {"_id": ObjectId(session_id)},
-            {
-                "$push": {
-                    "qa_pairs_ids": str(result.inserted_id)
-                }
-            }
+        # Enregistrer la paire Q/R dans le journal d'événements
+        await append_event(
+            session_id,
+            SessionEventType.QA_PAIR,
+            node_id=node_id,
+            question=question,
+            answer=answer
         )
         
         # Mettre à jour le statut du lead si nécessaire
@@ -436,27 +712,12 @@ class AnalyticsService:
         if not session:
             return
         
-        # Créer le document de soumission de formulaire
-        form_doc = {
-            "session_id": session_id,
-            "form_data": form_data,
-            "timestamp": datetime.utcnow()
-        }
-        
-        if node_id:
-            form_doc["node_id"] = node_id
-        
-        # Insérer la soumission dans la collection form_submissions
-        result = await db[FORM_SUBMISSIONS_COLLECTION].insert_one(form_doc)
-        
-        # Mettre à jour la session avec la référence à la soumission
-        await db[SESSIONS_COLLECTION].update_one(
-            {"_id": ObjectId(session_id)},
-            {
-                "$push": {
-                    "form_submissions_ids": str(result.inserted_id)
-                }
-            }
+        # Enregistrer la soumission dans le journal d'événements
+        await append_event(
+            session_id,
+            SessionEventType.FORM_SUBMISSION,
+            node_id=node_id,
+            form_data=form_data
         )
         
         # Mettre à jour le statut du lead
@@ -470,42 +731,34 @@ class AnalyticsService:
         """
         db = await get_database()
         
-        # Récupérer la session avec toutes les interactions
-        session = await db[SESSIONS_COLLECTION].find_one({"_id": ObjectId(session_id)})
+        # La session et son journal d'événements sont lus en parallèle
+        session, events = await asyncio.gather(
+            db[SESSIONS_COLLECTION].find_one({"_id": ObjectId(session_id)}),
+            get_session_events(session_id)
+        )
         if not session:
             return None
         
-        # Récupérer les conversations
-        conversations = await db[CONVERSATIONS_COLLECTION].find(
-            {"session_id": session_id}
-        ).sort("timestamp", 1).to_list(length=1000)
-        
-        # Récupérer les questions/réponses
-        qa_pairs = []
-        if "qa_pairs_ids" in session:
-            qa_ids = session.get("qa_pairs_ids", [])
-            for qa_id in qa_ids:
-                qa = await db[QA_PAIRS_COLLECTION].find_one({"_id": ObjectId(qa_id)})
-                if qa:
-                    qa_pairs.append(qa)
-        
-        # Récupérer les réponses utilisateur
-        user_responses = []
-        if "user_responses_ids" in session:
-            response_ids = session.get("user_responses_ids", [])
-            for response_id in response_ids:
-                response = await db[USER_RESPONSES_COLLECTION].find_one({"_id": ObjectId(response_id)})
-                if response:
-                    user_responses.append(response)
-        
-        # Récupérer les soumissions de formulaire
-        form_submissions = []
-        if "form_submissions_ids" in session:
-            form_ids = session.get("form_submissions_ids", [])
-            for form_id in form_ids:
-                form = await db[FORM_SUBMISSIONS_COLLECTION].find_one({"_id": ObjectId(form_id)})
-                if form:
-                    form_submissions.append(form)
+        # Les interactions sont des projections du journal d'événements
+        conversations = project_messages(events)
+        qa_pairs = project_qa_pairs(events)
+        user_responses = project_user_responses(events)
+        form_submissions = project_form_submissions(events)
+        
+        if not session.get("event_log"):
+            # Session antérieure au journal d'événements (pas encore migrée) : le
+            # début est dans les anciennes collections (une requête $in par
+            # collection, en parallèle), la suite dans le journal
+            legacy = await asyncio.gather(
+                db[CONVERSATIONS_COLLECTION].find({"session_id": session_id}).sort("timestamp", 1).to_list(length=None),
+                _find_by_ids(db, QA_PAIRS_COLLECTION, session.get("qa_pairs_ids", [])),
+                _find_by_ids(db, USER_RESPONSES_COLLECTION, session.get("user_responses_ids", [])),
+                _find_by_ids(db, FORM_SUBMISSIONS_COLLECTION, session.get("form_submissions_ids", []))
+            )
+            conversations, qa_pairs, user_responses, form_submissions = (
+                merge_by_timestamp(legacy_documents, logged)
+                for legacy_documents, logged in zip(legacy, (conversations, qa_pairs, user_responses, form_submissions))
+            )
         
         # Préparer les données à retourner
         return {
@@ -517,16 +770,7 @@ class AnalyticsService:
                 "status": session.get("status"),
                 "lead_status": session.get("lead_status")
             },
-            "conversations": [
-                {
-                    "id": str(msg["_id"]),
-                    "content": msg["content"],
-                    "sender": msg["sender"],
-                    "timestamp": msg["timestamp"],
-                    "content_type": msg.get("content_type", "text"),
-                    "is_question": msg.get("is_question", False)
-                } for msg in conversations
-            ],
+            "conversations": [conversation_to_dict(msg) for msg in conversations],
             "user_responses": [
                 {
                     "id": str(resp["_id"]),
@@ -556,6 +800,30 @@ class AnalyticsService:
             "user_info": session.get("user_info", {}),
             "lead_info": session.get("lead_info", {})
         }
+    
+    @staticmethod
+    async def stream_session_conversation(session_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Parcourt la conversation d'une session par lots, sans la charger entièrement
+        en mémoire (transcriptions longues)
+        """
+        db = await get_database()
+        
+        session = await db[SESSIONS_COLLECTION].find_one({"_id": ObjectId(session_id)}, {"event_log": 1})
+        if not session:
+            return
+        
+        if not session.get("event_log"):
+            # Session non migrée : son début est dans l'ancienne collection, et
+            # précède tout ce qui a été écrit dans le journal depuis
+            cursor = db[CONVERSATIONS_COLLECTION].find(
+                {"session_id": session_id}, batch_size=STREAM_BATCH_SIZE
+            ).sort("timestamp", 1)
+            async for msg in cursor:
+                yield conversation_to_dict(msg)
+        
+        async for msg in iter_session_events(session_id, [SessionEventType.MESSAGE]):
+            yield conversation_to_dict(msg)
 
 # Créer une instance du service
 analytics_service = AnalyticsService()
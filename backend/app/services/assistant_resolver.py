@@ -0,0 +1,139 @@
+"""
+Résolution des identifiants d'assistants
+
+Un assistant peut être désigné par son ObjectId, son public_id
+("bot-<uuid>") ou un suffixe de son public_id (ID court). Toutes les formes sont
+ramenées à l'identifiant canonique (str de l'ObjectId) par une recherche
+indexée, puis mises en cache.
+
+La recherche par suffixe utilise le champ `public_id_rev` (public_id inversé) :
+un suffixe devient un préfixe, donc une regex ancrée exploitable par l'index.
+"""
+import re
+from typing import Dict, Any, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.database.mongodb import get_database
+from app.services.assistant_snapshots import PUBLISHED_HASH_FIELD, PUBLISHED_VERSION_FIELD
+from app.services.cache_invalidation import invalidation_bus
+from app.utils.cache import TTLCache
+from app.utils.singleflight import SingleFlight
+
+ASSISTANTS_COLLECTION = "assistants"
+PUBLIC_ID_REV_FIELD = "public_id_rev"
+
+# Longueur minimale d'un ID court (évite les correspondances ambiguës)
+MIN_SUFFIX_LENGTH = 8
+
+_PROJECTION = {"_id": 1, "public_id": 1, PUBLISHED_VERSION_FIELD: 1, PUBLISHED_HASH_FIELD: 1}
+
+# identifiant demandé -> {"id", "public_id", "published_version", "published_hash"}
+_cache = TTLCache("assistant_resolver", maxsize=10000, ttl=600)
+
+# Recherches concurrentes d'un même identifiant (ex. pic de création de sessions)
+_lookups = SingleFlight("assistant_resolver")
+
+# Incrémenté à chaque invalidation : une recherche lancée avant une
+# modification ne doit ni être rejointe ensuite ni remplir le cache
+_generation = 0
+
+
+def reverse_public_id(public_id: str) -> str:
+    return public_id[::-1]
+
+
+def _to_resolved(assistant: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": str(assistant["_id"]),
+        "public_id": assistant.get("public_id"),
+        "published_version": assistant.get(PUBLISHED_VERSION_FIELD),
+        "published_hash": assistant.get(PUBLISHED_HASH_FIELD)
+    }
+
+
+async def resolve_assistant(identifier: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Retourne {"id", "public_id", "published_version", "published_hash"} de
+    l'assistant désigné par `identifier` (ObjectId, public_id ou ID court), ou
+    None s'il n'existe pas
+    """
+    if not identifier:
+        return None
+
+    resolved = _cache.get(identifier)
+    if resolved is not None:
+        return resolved
+
+    generation = _generation
+    return await _lookups.do((identifier, generation), lambda: _lookup(identifier, generation))
+
+
+async def _lookup(identifier: str, generation: int) -> Optional[Dict[str, Any]]:
+    db = await get_database()
+    collection = db[ASSISTANTS_COLLECTION]
+    assistant = None
+
+    if ObjectId.is_valid(identifier):
+        assistant = await collection.find_one({"_id": ObjectId(identifier)}, _PROJECTION)
+
+    if not assistant:
+        assistant = await collection.find_one({"public_id": identifier}, _PROJECTION)
+
+    if not assistant and len(identifier) >= MIN_SUFFIX_LENGTH:
+        prefix = re.escape(reverse_public_id(identifier))
+        assistant = await collection.find_one({PUBLIC_ID_REV_FIELD: {"$regex": f"^{prefix}"}}, _PROJECTION)
+
+    if not assistant:
+        return None
+
+    resolved = _to_resolved(assistant)
+    if generation == _generation:
+        _cache.set(identifier, resolved)
+    return resolved
+
+
+async def resolve_assistant_id(identifier: Optional[str]) -> Optional[str]:
+    """
+    Identifiant canonique (str de l'ObjectId) de l'assistant, ou None
+    """
+    resolved = await resolve_assistant(identifier)
+    return resolved["id"] if resolved else None
+
+
+def forget_assistant(assistant_id: str):
+    """
+    Retire du cache toutes les formes d'identifiant d'un assistant
+    (appelé par le bus d'invalidation à chaque modification de l'assistant)
+    """
+    global _generation
+    _generation += 1
+    _cache.evict_where(lambda key, value: value["id"] == assistant_id)
+
+
+invalidation_bus.register(ASSISTANTS_COLLECTION, forget_assistant, _cache.clear)
+
+
+async def backfill_public_id_rev() -> int:
+    """
+    Renseigne `public_id_rev` pour les assistants publiés avant l'ajout du champ.
+    Retourne le nombre d'assistants mis à jour.
+    """
+    db = await get_database()
+    collection = db[ASSISTANTS_COLLECTION]
+
+    operations = []
+    cursor = collection.find(
+        {"public_id": {"$type": "string"}, PUBLIC_ID_REV_FIELD: {"$exists": False}},
+        {"public_id": 1}
+    )
+    async for assistant in cursor:
+        operations.append(UpdateOne(
+            {"_id": assistant["_id"]},
+            {"$set": {PUBLIC_ID_REV_FIELD: reverse_public_id(assistant["public_id"])}}
+        ))
+
+    if operations:
+        await collection.bulk_write(operations, ordered=False)
+    return len(operations)
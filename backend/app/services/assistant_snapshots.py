@@ -0,0 +1,192 @@
+"""
+Snapshots publiés des assistants
+
+La publication fige le flow (nœuds, arêtes, nom) dans un document immuable de
+`assistant_snapshots` : numéro de version, contenu et hash du contenu.
+L'assistant ne garde qu'un pointeur vers le snapshot publié (`published_version`,
+`published_hash`), si bien que les modifications dans l'éditeur n'affectent
+pas les visiteurs tant que l'assistant n'est pas republié.
+
+Un snapshot ne changeant jamais, il est mis en cache sans expiration, par hash.
+"""
+import hashlib
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from bson import ObjectId
+
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from app.database.mongodb import get_database
+from app.services.cache_invalidation import invalidation_bus
+from app.services.flow_graph import COMPILED_FLOW_FIELD, compile_assistant
+from app.utils.cache import TTLCache
+from app.utils.singleflight import SingleFlight
+from app.utils.serialization import dumps
+
+SNAPSHOTS_COLLECTION = "assistant_snapshots"
+ASSISTANTS_COLLECTION = "assistants"
+PUBLISHED_VERSION_FIELD = "published_version"
+PUBLISHED_HASH_FIELD = "published_hash"
+
+# Lecture légère de l'assistant pour connaître le snapshot publié
+POINTER_PROJECTION = {"_id": 1, "public_id": 1, "is_published": 1, PUBLISHED_VERSION_FIELD: 1, PUBLISHED_HASH_FIELD: 1}
+
+# Snapshots et leur JSON par hash : immuables, seule la taille du cache est bornée
+_snapshots = TTLCache("assistant_snapshots", maxsize=512, ttl=float("inf"))
+_snapshot_json = TTLCache("assistant_snapshot_json", maxsize=512, ttl=float("inf"))
+
+# Lectures concurrentes du même assistant public (pic de visiteurs d'un embed)
+_pointer_lookups = SingleFlight("assistant_published_pointer")
+_snapshot_lookups = SingleFlight("assistant_snapshot")
+
+
+def content_hash(flow: Dict[str, Any]) -> str:
+    """
+    Hash SHA-256 du flow sérialisé de façon canonique (clés triées)
+    """
+    return hashlib.sha256(dumps(flow, sort_keys=True)).hexdigest()
+
+
+def snapshot_flow(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Données du flow servies au widget, avec la version et le hash du snapshot
+    """
+    return {**snapshot["flow"], "version": snapshot["version"], "hash": snapshot["content_hash"]}
+
+
+def snapshot_json(snapshot: Dict[str, Any]) -> bytes:
+    """
+    JSON du flow d'un snapshot, sérialisé une seule fois
+    """
+    payload = _snapshot_json.get(snapshot["content_hash"])
+    if payload is None:
+        payload = dumps(snapshot_flow(snapshot))
+        _snapshot_json.set(snapshot["content_hash"], payload)
+    return payload
+
+
+def _remember(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    snapshot.pop("_id", None)
+    _snapshots.set(snapshot["content_hash"], snapshot)
+    return snapshot
+
+
+async def publish_snapshot(assistant: Dict[str, Any], flow: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fige `flow` dans un nouveau snapshot de l'assistant et retourne ce snapshot.
+    Si le contenu n'a pas changé depuis le dernier snapshot, celui-ci est réutilisé.
+    """
+    db = await get_database()
+    collection = db[SNAPSHOTS_COLLECTION]
+    assistant_id = str(assistant["_id"])
+    digest = content_hash(flow)
+
+    while True:
+        latest = await collection.find_one({"assistant_id": assistant_id}, sort=[("version", DESCENDING)])
+        if latest and latest["content_hash"] == digest:
+            return _remember(latest)
+
+        snapshot = {
+            "assistant_id": assistant_id,
+            "public_id": assistant.get("public_id"),
+            "version": (latest["version"] if latest else 0) + 1,
+            "content_hash": digest,
+            "flow": flow,
+            # Graphe compilé (progression des sessions), dérivé du flow : hors du hash
+            COMPILED_FLOW_FIELD: compile_assistant(flow),
+            "created_at": datetime.utcnow()
+        }
+        try:
+            await collection.insert_one(snapshot)
+        except DuplicateKeyError:
+            # Publication concurrente du même assistant : relire la dernière version
+            continue
+        return _remember(snapshot)
+
+
+async def get_snapshot(digest: str) -> Optional[Dict[str, Any]]:
+    """
+    Snapshot identifié par son hash, ou None
+    """
+    snapshot = _snapshots.get(digest)
+    if snapshot is not None:
+        return snapshot
+
+    return await _snapshot_lookups.do(digest, lambda: _load_snapshot(digest))
+
+
+async def _load_snapshot(digest: str) -> Optional[Dict[str, Any]]:
+    db = await get_database()
+    snapshot = await db[SNAPSHOTS_COLLECTION].find_one({"content_hash": digest}, sort=[("version", DESCENDING)])
+    return _remember(snapshot) if snapshot else None
+
+
+async def load_session_flow(db, session: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Flow suivi par une session : le snapshot publié à son démarrage, ou
+    l'assistant lui-même pour les sessions antérieures aux snapshots
+    """
+    if session.get("flow_hash"):
+        snapshot = await get_snapshot(session["flow_hash"])
+        if snapshot:
+            return {**snapshot["flow"], COMPILED_FLOW_FIELD: snapshot.get(COMPILED_FLOW_FIELD)}
+    return await db[ASSISTANTS_COLLECTION].find_one({"_id": ObjectId(session["assistant_id"])})
+
+
+async def get_published_pointer(public_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Pointeur vers le snapshot publié d'un assistant (lecture légère), ou None
+    si l'assistant n'existe pas ou n'est pas publié. Les lectures concurrentes
+    d'un même public_id partagent une seule requête.
+    """
+    assistant = await _pointer_lookups.do(public_id, lambda: _load_pointer(public_id))
+    if not assistant or not assistant.get("is_published", False):
+        return None
+    return assistant
+
+
+async def _load_pointer(public_id: str) -> Optional[Dict[str, Any]]:
+    db = await get_database()
+    return await db[ASSISTANTS_COLLECTION].find_one({"public_id": public_id}, POINTER_PROJECTION)
+
+
+def pointer_fields(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Champs de l'assistant qui désignent le snapshot publié
+    """
+    return {PUBLISHED_VERSION_FIELD: snapshot["version"], PUBLISHED_HASH_FIELD: snapshot["content_hash"]}
+
+
+def forget_snapshots(assistant_id: str):
+    """
+    Retire du cache les snapshots d'un assistant modifié ou supprimé (le JSON
+    déjà sérialisé n'est plus accessible sans eux et sort du cache LRU)
+    """
+    _snapshots.evict_where(lambda key, value: value["assistant_id"] == assistant_id)
+
+
+invalidation_bus.register(ASSISTANTS_COLLECTION, forget_snapshots)
+
+
+async def delete_snapshots(assistant_id: str):
+    db = await get_database()
+    await db[SNAPSHOTS_COLLECTION].delete_many({"assistant_id": assistant_id})
+
+
+async def backfill_snapshots(build_flow: Callable[[Dict[str, Any]], Dict[str, Any]]) -> int:
+    """
+    Crée le snapshot des assistants publiés avant l'introduction des snapshots.
+    Retourne le nombre d'assistants mis à jour.
+    """
+    db = await get_database()
+    collection = db[ASSISTANTS_COLLECTION]
+
+    count = 0
+    cursor = collection.find({"is_published": True, PUBLISHED_HASH_FIELD: {"$exists": False}})
+    async for assistant in cursor:
+        snapshot = await publish_snapshot(assistant, build_flow(assistant))
+        await collection.update_one({"_id": assistant["_id"]}, {"$set": pointer_fields(snapshot)})
+        count += 1
+    return count
@@ -0,0 +1,212 @@
+"""
+Invalidation des caches en mémoire entre workers
+
+Chaque worker (processus uvicorn, pod) a ses propres caches (résolveur
+d'assistants, snapshots, utilisateurs...). Une écriture faite sur un worker doit
+donc être propagée aux autres : le bus suit un change stream MongoDB sur les
+collections `assistants` et `users` et appelle, pour chaque document modifié,
+les fonctions d'éviction enregistrées par les modules propriétaires des caches.
+
+Sans replica set (mongod standalone, tests), les change streams ne sont pas
+disponibles : les écrivains publient alors un événement dans la collection
+`cache_invalidations`, que chaque worker relit à intervalle régulier.
+
+Dans les deux cas, le worker qui écrit évince ses propres entrées immédiatement ;
+les autres le font dans un délai borné (latence du change stream ou intervalle
+de relecture).
+
+Variables d'environnement :
+- CACHE_INVALIDATION_MODE : auto (défaut), change_stream, polling ou off
+- CACHE_INVALIDATION_POLL_SECONDS : intervalle de relecture en mode polling (défaut 1)
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from bson import ObjectId
+
+from app.database.mongodb import get_database
+from app.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+INVALIDATIONS_COLLECTION = "cache_invalidations"
+
+# Collections dont les modifications invalident des caches
+WATCHED_COLLECTIONS = ("assistants", "users")
+
+# Durée de conservation des événements en mode polling (index TTL)
+EVENT_RETENTION_SECONDS = 3600
+
+# Marge de relecture en mode polling : les ObjectId sont générés par des
+# processus dont les horloges peuvent légèrement différer (les événements déjà
+# appliqués dans cette fenêtre sont ignorés)
+POLL_GRACE_SECONDS = 5
+
+# Délai avant de relancer le suivi après une erreur
+RETRY_DELAY_SECONDS = 2
+
+CACHE_INVALIDATIONS = registry.counter(
+    "cache_invalidations_total",
+    "Invalidations de cache appliquées, par collection et origine",
+    ["collection", "source"]
+)
+
+# fonction d'éviction : reçoit l'identifiant (str de l'ObjectId) du document modifié
+Handler = Callable[[str], None]
+
+
+class CacheInvalidationBus:
+    """
+    Propage les écritures sur `assistants` et `users` aux caches de tous les workers
+    """
+
+    def __init__(self, mode: Optional[str] = None, poll_interval: Optional[float] = None):
+        self.mode = (mode or os.getenv("CACHE_INVALIDATION_MODE", "auto")).lower()
+        self.poll_interval = poll_interval or float(os.getenv("CACHE_INVALIDATION_POLL_SECONDS", "1"))
+        self.active_mode: Optional[str] = None
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._full_clears: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, collection: str, handler: Handler, clear: Optional[Callable[[], None]] = None):
+        """
+        Enregistre une fonction d'éviction pour les documents de `collection`.
+        `clear` vide entièrement le cache concerné ; il est appelé quand des
+        événements ont pu être perdus (reprise du change stream impossible).
+        """
+        self._handlers.setdefault(collection, []).append(handler)
+        if clear is not None:
+            self._full_clears.append(clear)
+
+    def apply(self, collection: str, document_id: str, source: str = "local"):
+        """
+        Évince localement les entrées liées au document
+        """
+        for handler in self._handlers.get(collection, []):
+            try:
+                handler(document_id)
+            except Exception:
+                logger.exception("Erreur lors de l'invalidation du cache (%s %s)", collection, document_id)
+        CACHE_INVALIDATIONS.inc(collection=collection, source=source)
+
+    def clear_all(self):
+        for clear in self._full_clears:
+            clear()
+
+    async def publish(self, collection: str, document_id: str):
+        """
+        À appeler après une écriture : évince les entrées du worker courant et,
+        en mode polling, signale l'écriture aux autres workers. Avec un change
+        stream, l'écriture elle-même sert de signal.
+        """
+        self.apply(collection, document_id)
+        if self.active_mode != "polling":
+            return
+        try:
+            db = await get_database()
+            await db[INVALIDATIONS_COLLECTION].insert_one({
+                "collection": collection,
+                "document_id": document_id,
+                "created_at": datetime.utcnow()
+            })
+        except Exception as e:
+            logger.error("Impossible de publier l'invalidation %s %s: %s", collection, document_id, e)
+
+    async def start(self):
+        """
+        Choisit le mode de suivi (change stream si disponible) et démarre la
+        tâche de fond
+        """
+        if self.mode == "off" or self._task is not None:
+            return
+
+        mode = self.mode
+        if mode == "auto":
+            mode = "change_stream" if await self._change_streams_supported() else "polling"
+
+        if mode == "polling":
+            db = await get_database()
+            await db[INVALIDATIONS_COLLECTION].create_index(
+                "created_at", name="created_at_ttl", expireAfterSeconds=EVENT_RETENTION_SECONDS
+            )
+            runner = self._poll
+        else:
+            runner = self._watch
+
+        self.active_mode = mode
+        self._task = asyncio.create_task(runner())
+        logger.info("Invalidation des caches entre workers : mode %s", mode)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self.active_mode = None
+
+    async def _change_streams_supported(self) -> bool:
+        try:
+            db = await get_database()
+            async with db.watch(self._pipeline(), max_await_time_ms=1) as stream:
+                await stream.try_next()
+            return True
+        except Exception as e:
+            logger.info("Change streams indisponibles (%s), relecture de %s", e, INVALIDATIONS_COLLECTION)
+            return False
+
+    @staticmethod
+    def _pipeline() -> List[dict]:
+        return [{"$match": {
+            "ns.coll": {"$in": list(WATCHED_COLLECTIONS)},
+            "operationType": {"$in": ["update", "replace", "delete"]}
+        }}]
+
+    async def _watch(self):
+        resume_token = None
+        while True:
+            try:
+                db = await get_database()
+                async with db.watch(self._pipeline(), resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self.apply(change["ns"]["coll"], str(change["documentKey"]["_id"]), source="change_stream")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Des événements ont pu être manqués : repartir de caches vides
+                logger.error("Change stream interrompu: %s", e)
+                resume_token = None
+                self.clear_all()
+                await asyncio.sleep(RETRY_DELAY_SECONDS)
+
+    async def _poll(self):
+        since = datetime.utcnow()
+        seen = set()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                polled_at = datetime.utcnow()
+                db = await get_database()
+                lower_bound = ObjectId.from_datetime(since - timedelta(seconds=POLL_GRACE_SECONDS))
+                cursor = db[INVALIDATIONS_COLLECTION].find({"_id": {"$gte": lower_bound}})
+                async for event in cursor:
+                    if event["_id"] not in seen:
+                        seen.add(event["_id"])
+                        self.apply(event["collection"], event["document_id"], source="polling")
+                # Seuls les événements encore dans la fenêtre de relecture sont retenus
+                seen = {event_id for event_id in seen if event_id >= lower_bound}
+                since = polled_at
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Erreur lors de la relecture des invalidations: %s", e)
+
+
+invalidation_bus = CacheInvalidationBus()
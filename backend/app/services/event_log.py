@@ -0,0 +1,378 @@
+"""
+Journal d'événements des sessions
+
+Chaque interaction d'une session (message, réponse utilisateur, paire
+question/réponse explicite, soumission de formulaire) est écrite une seule fois
+dans la collection `session_events`. Les anciennes vues (messages,
+conversations, qa_pairs, user_responses, form_submissions) sont des projections
+calculées à la lecture à partir de ce journal.
+"""
+import json
+from datetime import datetime
+from enum import Enum
+from typing import Dict, List, Any, Optional, Iterable, AsyncIterator
+
+from bson import ObjectId
+from pymongo import ReplaceOne
+
+from app.database.mongodb import get_database
+from app.models.session import SessionEventType, MessageSender
+from app.services.event_spool import event_spool
+
+# Collection canonique (append-only)
+EVENTS_COLLECTION = "session_events"
+SESSIONS_COLLECTION = "sessions"
+
+# Anciennes collections, remplacées par le journal d'événements
+LEGACY_MESSAGES_COLLECTION = "messages"
+LEGACY_CONVERSATIONS_COLLECTION = "conversations"
+LEGACY_QA_PAIRS_COLLECTION = "qa_pairs"
+LEGACY_USER_RESPONSES_COLLECTION = "user_responses"
+LEGACY_FORM_SUBMISSIONS_COLLECTION = "form_submissions"
+LEGACY_ID_FIELDS = ("qa_pairs_ids", "user_responses_ids", "form_submissions_ids")
+
+# Écart maximal (en secondes) pour considérer qu'un document de `conversations`
+# est le doublon d'un document de `messages` lors de la migration
+DUPLICATE_WINDOW_SECONDS = 5
+
+# Taille des lots lus depuis MongoDB lors du parcours d'un journal
+STREAM_BATCH_SIZE = 200
+
+
+def _value(value: Any) -> Any:
+    """Retourne la valeur brute d'un Enum (str(Enum) n'est pas fiable en Python 3.11)"""
+    return value.value if isinstance(value, Enum) else value
+
+
+def new_event(session_id: str, event_type: SessionEventType, node_id: Optional[str] = None, **fields) -> Dict[str, Any]:
+    """
+    Construit un événement du journal. L'`_id` est généré ici pour que l'écriture
+    puisse être rejouée sans doublon depuis le spool local.
+    """
+    return {
+        "_id": ObjectId(),
+        "session_id": session_id,
+        "type": event_type.value,
+        "node_id": node_id,
+        "timestamp": datetime.utcnow(),
+        **{key: _value(value) for key, value in fields.items()}
+    }
+
+
+async def write_event(event: Dict[str, Any], updates: Iterable[Dict[str, Any]] = ()) -> Dict[str, Any]:
+    """
+    Écrit un événement et ses mises à jour de compteurs (voir
+    `event_spool.counter_update`), dans MongoDB ou, si la base est lente ou
+    indisponible, dans le spool local
+    """
+    await event_spool.write(EVENTS_COLLECTION, event, updates)
+    return event
+
+
+async def append_event(session_id: str, event_type: SessionEventType, node_id: Optional[str] = None, **fields) -> Dict[str, Any]:
+    """
+    Ajoute un événement au journal d'une session et retourne le document inséré
+    """
+    return await write_event(new_event(session_id, event_type, node_id, **fields))
+
+
+async def get_session_events(session_id: str, event_types: Optional[Iterable[SessionEventType]] = None) -> List[Dict[str, Any]]:
+    """
+    Récupère les événements d'une session dans l'ordre chronologique
+    """
+    db = await get_database()
+    query: Dict[str, Any] = {"session_id": session_id}
+    if event_types:
+        query["type"] = {"$in": [event_type.value for event_type in event_types]}
+
+    return await db[EVENTS_COLLECTION].find(query).sort([("timestamp", 1), ("_id", 1)]).to_list(length=None)
+
+
+async def iter_session_events(
+    session_id: str,
+    event_types: Optional[Iterable[SessionEventType]] = None,
+    batch_size: int = STREAM_BATCH_SIZE
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Parcourt les événements d'une session par lots, dans l'ordre chronologique
+    """
+    db = await get_database()
+    query: Dict[str, Any] = {"session_id": session_id}
+    if event_types:
+        query["type"] = {"$in": [event_type.value for event_type in event_types]}
+
+    cursor = db[EVENTS_COLLECTION].find(query, batch_size=batch_size).sort([("timestamp", 1), ("_id", 1)])
+    async for event in cursor:
+        yield event
+
+
+def merge_by_timestamp(*sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Fusionne, dans l'ordre chronologique, des documents lus dans les anciennes
+    collections et dans le journal d'événements
+    """
+    merged = [document for documents in sources for document in documents]
+    merged.sort(key=lambda document: document.get("timestamp") or datetime.min)
+    return merged
+
+
+async def load_session_messages(session: Dict[str, Any], content_types: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Récupère les messages d'une session depuis le journal d'événements. Une
+    session antérieure au journal et pas encore migrée (sans `event_log`) a ses
+    premiers messages dans l'ancienne collection `messages` et les suivants dans
+    le journal : les deux sont lus et fusionnés.
+    """
+    db = await get_database()
+    session_id = str(session["_id"])
+
+    query: Dict[str, Any] = {"session_id": session_id, "type": SessionEventType.MESSAGE.value}
+    legacy_query: Dict[str, Any] = {"session_id": session_id}
+    if content_types:
+        query["content_type"] = legacy_query["content_type"] = {"$in": content_types}
+
+    events = await db[EVENTS_COLLECTION].find(query).sort([("timestamp", 1), ("_id", 1)]).to_list(length=None)
+    if session.get("event_log"):
+        return events
+
+    legacy = await db[LEGACY_MESSAGES_COLLECTION].find(legacy_query).sort("timestamp", 1).to_list(length=None)
+    return merge_by_timestamp(legacy, events)
+
+
+# ---------------------------------------------------------------------------
+# Projections
+# ---------------------------------------------------------------------------
+
+def project_messages(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Vue `messages` / `conversations` : tous les messages échangés
+    """
+    return [event for event in events if event["type"] == SessionEventType.MESSAGE.value]
+
+
+def project_qa_pairs(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Vue `qa_pairs` : chaque question du bot est associée à la réponse utilisateur
+    suivante sur le même nœud, à laquelle s'ajoutent les paires explicites
+    """
+    pairs = []
+    pending: Dict[Optional[str], Dict[str, Any]] = {}
+
+    for event in events:
+        event_type = event["type"]
+        if event_type == SessionEventType.QA_PAIR.value:
+            pairs.append({
+                "_id": event["_id"],
+                "question": event.get("question"),
+                "answer": event.get("answer"),
+                "node_id": event.get("node_id"),
+                "timestamp": event["timestamp"]
+            })
+        elif event_type == SessionEventType.MESSAGE.value:
+            node_id = event.get("node_id")
+            if event.get("is_question"):
+                pair = {
+                    "_id": event["_id"],
+                    "question": event.get("content"),
+                    "answer": None,
+                    "node_id": node_id,
+                    "timestamp": event["timestamp"]
+                }
+                pairs.append(pair)
+                pending[node_id] = pair
+            elif event.get("sender") == MessageSender.USER.value and node_id in pending:
+                pending.pop(node_id)["answer"] = event.get("content")
+
+    return pairs
+
+
+def project_user_responses(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Vue `user_responses` : réponses aux champs nommés
+    """
+    return [
+        {
+            "_id": event["_id"],
+            "node_id": event.get("node_id"),
+            "field_name": event.get("field_name"),
+            "response_value": event.get("response_value"),
+            "timestamp": event["timestamp"]
+        }
+        for event in events if event["type"] == SessionEventType.USER_RESPONSE.value
+    ]
+
+
+def project_form_submissions(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Vue `form_submissions` : soumissions explicites et messages de formulaire
+    envoyés par le widget (contenu JSON)
+    """
+    submissions = []
+    for event in events:
+        event_type = event["type"]
+        form_data = None
+
+        if event_type == SessionEventType.FORM_SUBMISSION.value:
+            form_data = event.get("form_data")
+        elif (
+            event_type == SessionEventType.MESSAGE.value
+            and event.get("is_form")
+            and event.get("sender") == MessageSender.USER.value
+        ):
+            try:
+                form_data = json.loads(event.get("content") or "")
+            except ValueError:
+                form_data = None
+            if not isinstance(form_data, dict):
+                continue
+
+        if form_data is not None:
+            submissions.append({
+                "_id": event["_id"],
+                "form_data": form_data,
+                "node_id": event.get("node_id"),
+                "timestamp": event["timestamp"]
+            })
+
+    return submissions
+
+
+# ---------------------------------------------------------------------------
+# Migration des anciennes collections
+# ---------------------------------------------------------------------------
+
+def _is_duplicate(conversation: Dict[str, Any], messages: List[Dict[str, Any]]) -> bool:
+    """
+    Vérifie si un document de `conversations` double un document de `messages`
+    """
+    for message in messages:
+        if (
+            message.get("sender") == conversation.get("sender")
+            and message.get("content") == conversation.get("content")
+            and message.get("node_id") == conversation.get("node_id")
+            and abs((message["timestamp"] - conversation["timestamp"]).total_seconds()) <= DUPLICATE_WINDOW_SECONDS
+        ):
+            return True
+    return False
+
+
+async def _legacy_events_for_session(db, session: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Convertit les documents des anciennes collections d'une session en événements.
+    Les `_id` d'origine sont conservés pour rendre la migration idempotente.
+    """
+    session_id = str(session["_id"])
+    events = []
+
+    messages = await db[LEGACY_MESSAGES_COLLECTION].find({"session_id": session_id}).to_list(length=None)
+    for message in messages:
+        events.append({
+            "_id": message["_id"],
+            "session_id": session_id,
+            "type": SessionEventType.MESSAGE.value,
+            "node_id": message.get("node_id"),
+            "timestamp": message.get("timestamp", datetime.utcnow()),
+            "sender": message.get("sender"),
+            "content": message.get("content"),
+            "content_type": message.get("content_type"),
+            "metadata": message.get("metadata"),
+            "is_question": message.get("is_question", False),
+            "is_form": message.get("content_type") == "form"
+        })
+
+    async for conversation in db[LEGACY_CONVERSATIONS_COLLECTION].find({"session_id": session_id}):
+        if _is_duplicate(conversation, messages):
+            continue
+        events.append({
+            "_id": conversation["_id"],
+            "session_id": session_id,
+            "type": SessionEventType.MESSAGE.value,
+            "node_id": conversation.get("node_id"),
+            "timestamp": conversation.get("timestamp", datetime.utcnow()),
+            "sender": conversation.get("sender"),
+            "content": conversation.get("content"),
+            "content_type": conversation.get("content_type", "text"),
+            "metadata": None,
+            "is_question": conversation.get("is_question", False),
+            "is_form": conversation.get("is_form", False)
+        })
+
+    # Seules les paires explicites (track_question_answer) sont migrées : les
+    # autres documents de `qa_pairs` se déduisent des messages
+    explicit_qa_ids = set(session.get("qa_pairs_ids", []))
+    if explicit_qa_ids:
+        async for qa in db[LEGACY_QA_PAIRS_COLLECTION].find({"session_id": session_id}):
+            if str(qa["_id"]) not in explicit_qa_ids:
+                continue
+            events.append({
+                "_id": qa["_id"],
+                "session_id": session_id,
+                "type": SessionEventType.QA_PAIR.value,
+                "node_id": qa.get("node_id"),
+                "timestamp": qa.get("timestamp", datetime.utcnow()),
+                "question": qa.get("question"),
+                "answer": qa.get("answer")
+            })
+
+    async for response in db[LEGACY_USER_RESPONSES_COLLECTION].find({"session_id": session_id}):
+        events.append({
+            "_id": response["_id"],
+            "session_id": session_id,
+            "type": SessionEventType.USER_RESPONSE.value,
+            "node_id": response.get("node_id"),
+            "timestamp": response.get("timestamp", datetime.utcnow()),
+            "field_name": response.get("field_name"),
+            "response_value": response.get("response_value")
+        })
+
+    async for form in db[LEGACY_FORM_SUBMISSIONS_COLLECTION].find({"session_id": session_id}):
+        events.append({
+            "_id": form["_id"],
+            "session_id": session_id,
+            "type": SessionEventType.FORM_SUBMISSION.value,
+            "node_id": form.get("node_id"),
+            "timestamp": form.get("timestamp", datetime.utcnow()),
+            "form_data": form.get("form_data")
+        })
+
+    return events
+
+
+async def migrate_legacy_collections(drop_legacy: bool = False) -> Dict[str, int]:
+    """
+    Migre les conversations stockées dans les anciennes collections vers le
+    journal d'événements. Peut être relancée sans créer de doublons.
+    """
+    db = await get_database()
+    stats = {"sessions": 0, "events": 0}
+
+    projection = {"_id": 1, "qa_pairs_ids": 1}
+    async for session in db[SESSIONS_COLLECTION].find({"event_log": {"$ne": True}}, projection):
+        events = await _legacy_events_for_session(db, session)
+        if events:
+            await db[EVENTS_COLLECTION].bulk_write(
+                [ReplaceOne({"_id": event["_id"]}, event, upsert=True) for event in events],
+                ordered=False
+            )
+
+        await db[SESSIONS_COLLECTION].update_one(
+            {"_id": session["_id"]},
+            {
+                "$set": {"event_log": True},
+                "$unset": {field: "" for field in LEGACY_ID_FIELDS}
+            }
+        )
+        stats["sessions"] += 1
+        stats["events"] += len(events)
+
+    if drop_legacy:
+        for collection in (
+            LEGACY_MESSAGES_COLLECTION,
+            LEGACY_CONVERSATIONS_COLLECTION,
+            LEGACY_QA_PAIRS_COLLECTION,
+            LEGACY_USER_RESPONSES_COLLECTION,
+            LEGACY_FORM_SUBMISSIONS_COLLECTION
+        ):
+            await db.drop_collection(collection)
+
+    return stats
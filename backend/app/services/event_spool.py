@@ -0,0 +1,547 @@
+"""
+Spool local des événements de chat (mode dégradé)
+
+Quand MongoDB est lent ou indisponible (bascule du replica set, saturation),
+les événements de conversation ne doivent ni bloquer le widget public ni être
+perdus. Chaque écriture d'événement (document du journal `session_events` et
+mises à jour de compteurs associées) est tentée dans MongoDB avec un budget de
+latence ; si elle le dépasse ou échoue sur une erreur transitoire (réseau,
+sélection du serveur, bascule du primaire), l'enregistrement est ajouté à un
+fichier local en ajout seul, puis rejoué en tâche de fond quand la base répond
+de nouveau. Une erreur permanente (document refusé par MongoDB) ne déclenche
+pas le mode dégradé : l'enregistrement est écrit dans le fichier des rejets
+(`dead-letter.jsonl`, non rejoué), avec l'erreur, pour examen.
+
+- Les fichiers sont découpés en segments (`EVENT_SPOOL_SEGMENT_BYTES`) ; un
+  segment fermé est rejoué puis supprimé.
+- Les ajouts concurrents sont regroupés : un seul write + fsync par lot, et la
+  requête ne répond qu'une fois son enregistrement sur disque.
+- Après un échec, les écritures suivantes vont directement dans le spool
+  pendant `EVENT_SPOOL_DEGRADED_SECONDS`, sans attendre le budget de latence.
+- Le rejeu est idempotent : les événements portent un `_id` généré par
+  l'application et sont insérés par `bulk_write` ; un doublon (écriture
+  finalement aboutie malgré le dépassement du budget, segment rejoué deux fois)
+  est ignoré. Un événement rejoué est inséré avec le drapeau
+  `counters_pending`, retiré une fois ses compteurs appliqués : si le rejeu
+  échoue entre les deux (bascule, erreur transitoire), le segment est conservé
+  et le rejeu suivant réapplique les compteurs des doublons encore marqués.
+  Insertions et compteurs sont envoyés sans ordre (`ordered=False`) : un
+  enregistrement refusé (événement ou compteur) part dans le fichier des
+  rejets sans bloquer les autres, et le drapeau est retiré de tous les
+  événements dont les compteurs ont été appliqués.
+  Si une écriture directe a dépassé le budget après avoir inséré l'événement
+  mais avant ses compteurs, ceux-ci ne sont pas rejoués : les événements ne
+  sont jamais perdus ni dupliqués, les compteurs peuvent exceptionnellement
+  être sous-estimés (ou, pour un lot de rejeu interrompu au milieu de ses
+  compteurs, surestimés).
+
+Les traitements qui dépendent de la base (progression d'une session après un
+message : lecture de la session et du flow, étapes, statut de lead, fin de
+session) ne sont pas abandonnés en mode dégradé : `defer` les ajoute au spool
+comme tâches, exécutées au rejeu par le gestionnaire enregistré sous leur nom
+(`register_handler`). Une tâche est marquée dans `spool_tasks` comme les
+événements à compteurs (drapeau `counters_pending`) : un rejeu interrompu ne la
+réexécute que si elle n'a pas abouti.
+
+Chaque segment est verrouillé (flock) par le worker qui l'écrit ou le rejoue :
+plusieurs workers peuvent partager le même répertoire.
+
+Variables d'environnement :
+- EVENT_SPOOL_ENABLED : "0" pour désactiver (les erreurs MongoDB remontent alors)
+- EVENT_SPOOL_DIR : répertoire des segments (défaut backend/spool)
+- EVENT_SPOOL_LATENCY_BUDGET_MS : budget d'une écriture MongoDB (défaut 500)
+- EVENT_SPOOL_DEGRADED_SECONDS : durée du mode dégradé après un échec (défaut 5)
+- EVENT_SPOOL_SEGMENT_BYTES : taille maximale d'un segment (défaut 4 Mo)
+- EVENT_SPOOL_FSYNC_MS : fenêtre de regroupement des fsync (défaut 5)
+- EVENT_SPOOL_REPLAY_SECONDS : intervalle du rejeu (défaut 5)
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.json_util import CANONICAL_JSON_OPTIONS, dumps, loads
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, ExecutionTimeout, PyMongoError
+
+from app.database.mongodb import get_database
+from app.utils.metrics import register_buffer_depth, registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPOOL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "spool")
+
+SEGMENT_PREFIX = "events-"
+SEGMENT_SUFFIX = ".jsonl"
+# Enregistrements refusés par MongoDB (erreur permanente), jamais rejoués
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+# Enregistrements rejoués par appel à bulk_write
+REPLAY_BATCH_SIZE = 500
+
+# Code d'erreur MongoDB d'une clé dupliquée
+DUPLICATE_KEY_ERROR = 11000
+
+# Drapeau des événements rejoués dont les compteurs restent à appliquer
+COUNTERS_PENDING_FIELD = "counters_pending"
+
+# Tâches différées du mode dégradé (voir `EventSpool.defer`)
+TASKS_COLLECTION = "spool_tasks"
+
+EVENT_SPOOL_WRITES = registry.counter(
+    "event_spool_writes_total",
+    "Événements écrits dans le spool local au lieu de MongoDB, par raison",
+    ["reason"]
+)
+EVENT_SPOOL_REPLAYED = registry.counter(
+    "event_spool_replayed_total",
+    "Événements du spool rejoués dans MongoDB (inserted) ou déjà présents (duplicate)",
+    ["result"]
+)
+EVENT_SPOOL_DEAD_LETTERS = registry.counter(
+    "event_spool_dead_letters_total",
+    "Enregistrements refusés par MongoDB (erreur permanente), écrits dans le fichier des rejets",
+    ["stage"]
+)
+
+
+def counter_update(collection: str, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = True) -> Dict[str, Any]:
+    """
+    Mise à jour de compteurs associée à un événement, appliquée après lui
+    """
+    return {"collection": collection, "filter": filter, "update": update, "upsert": upsert}
+
+
+def is_transient_error(error: PyMongoError) -> bool:
+    """
+    Erreur due à l'indisponibilité de la base (réseau, sélection du serveur,
+    bascule du primaire, délai dépassé) : l'écriture aboutira plus tard. Les
+    autres erreurs (document refusé) se reproduiraient à chaque rejeu.
+    """
+    return (
+        isinstance(error, (ConnectionFailure, ExecutionTimeout))
+        or error.has_error_label("RetryableWriteError")
+        or error.has_error_label("TransientTransactionError")
+    )
+
+
+def _has_effects(record: Dict[str, Any]) -> bool:
+    """
+    Enregistrement dont l'application ne se limite pas à l'insertion
+    (compteurs ou tâche différée)
+    """
+    return bool(record["updates"]) or record.get("handler") is not None
+
+
+def _env_enabled(name: str) -> bool:
+    return os.getenv(name, "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+class EventSpool:
+    def __init__(
+        self,
+        directory: str = DEFAULT_SPOOL_DIR,
+        enabled: bool = True,
+        latency_budget: float = 0.5,
+        degraded_seconds: float = 5,
+        segment_bytes: int = 4 * 1024 * 1024,
+        fsync_interval: float = 0.005,
+        replay_interval: float = 5
+    ):
+        self.directory = directory
+        self.enabled = enabled
+        self.latency_budget = latency_budget
+        self.degraded_seconds = degraded_seconds
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.replay_interval = replay_interval
+        # Enregistrements dans le spool (non encore rejoués), tous workers confondus
+        self.depth = 0
+        self._degraded_until = 0.0
+        self._pending: List[Tuple[bytes, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._replay_task: Optional[asyncio.Task] = None
+        self._file_lock = asyncio.Lock()
+        self._file = None
+        self._file_size = 0
+        self._sequence = 0
+        self._worker = f"{os.getpid()}-{int(time.time())}"
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]] = {}
+        register_buffer_depth("event_spool", lambda: self.depth + len(self._pending))
+
+    @classmethod
+    def from_env(cls) -> "EventSpool":
+        return cls(
+            directory=os.getenv("EVENT_SPOOL_DIR") or DEFAULT_SPOOL_DIR,
+            enabled=_env_enabled("EVENT_SPOOL_ENABLED"),
+            latency_budget=float(os.getenv("EVENT_SPOOL_LATENCY_BUDGET_MS", "500")) / 1000,
+            degraded_seconds=float(os.getenv("EVENT_SPOOL_DEGRADED_SECONDS", "5")),
+            segment_bytes=int(os.getenv("EVENT_SPOOL_SEGMENT_BYTES", str(4 * 1024 * 1024))),
+            fsync_interval=float(os.getenv("EVENT_SPOOL_FSYNC_MS", "5")) / 1000,
+            replay_interval=float(os.getenv("EVENT_SPOOL_REPLAY_SECONDS", "5"))
+        )
+
+    @property
+    def degraded(self) -> bool:
+        return time.monotonic() < self._degraded_until
+
+    # ------------------------------------------------------------------
+    # Écriture
+    # ------------------------------------------------------------------
+
+    async def write(self, collection: str, event: Dict[str, Any], updates: Iterable[Dict[str, Any]] = ()) -> bool:
+        """
+        Insère `event` dans `collection` puis applique les mises à jour de
+        compteurs `updates` (voir `counter_update`). Retourne False si
+        l'enregistrement a été écrit dans le spool plutôt que dans MongoDB.
+        """
+        updates = list(updates)
+        if event.get("_id") is None:
+            event["_id"] = ObjectId()
+
+        if not self.enabled:
+            await self._write_to_mongo(collection, event, updates)
+            return True
+
+        if self.degraded:
+            reason = "degraded"
+        else:
+            try:
+                await asyncio.wait_for(self._write_to_mongo(collection, event, updates), self.latency_budget)
+                return True
+            except asyncio.TimeoutError:
+                reason = "timeout"
+            except PyMongoError as e:
+                if not is_transient_error(e):
+                    logger.error("Événement %s refusé par MongoDB, écrit dans le fichier des rejets: %s", event["_id"], e)
+                    await self._dead_letter([{"collection": collection, "event": event, "updates": updates}], e, "write")
+                    return False
+                reason = "error"
+                logger.warning("Écriture MongoDB en échec, événement %s écrit dans le spool: %s", event["_id"], e)
+            self._degraded_until = time.monotonic() + self.degraded_seconds
+
+        await self._append({"collection": collection, "event": event, "updates": updates})
+        EVENT_SPOOL_WRITES.inc(reason=reason)
+        return False
+
+    def register_handler(self, name: str, handler: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        """
+        Enregistre le gestionnaire des tâches différées `name` (voir `defer`)
+        """
+        self._handlers[name] = handler
+
+    async def defer(self, name: str, payload: Dict[str, Any]):
+        """
+        Diffère une tâche jusqu'au retour de la base : elle est ajoutée au spool
+        et exécutée au rejeu par le gestionnaire `name`, avec `payload`. Spool
+        désactivé : la tâche est exécutée immédiatement.
+        """
+        if not self.enabled:
+            await self._handlers[name](payload)
+            return
+        task = {"_id": ObjectId(), "handler": name, "payload": payload, "created_at": datetime.utcnow()}
+        await self._append({"collection": TASKS_COLLECTION, "event": task, "updates": [], "handler": name})
+        EVENT_SPOOL_WRITES.inc(reason="deferred")
+
+    @staticmethod
+    async def _write_to_mongo(collection: str, event: Dict[str, Any], updates: List[Dict[str, Any]]):
+        db = await get_database()
+        await db[collection].insert_one(event)
+        for update in updates:
+            await db[update["collection"]].update_one(update["filter"], update["update"], upsert=update["upsert"])
+
+    async def _append(self, record: Dict[str, Any]):
+        """
+        Ajoute un enregistrement au segment courant ; rend la main une fois le
+        lot qui le contient écrit et synchronisé sur disque
+        """
+        line = (dumps(record, json_options=CANONICAL_JSON_OPTIONS) + "\n").encode("utf-8")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((line, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+        await future
+
+    async def _flush(self):
+        # Laisser les requêtes concurrentes rejoindre le lot
+        await asyncio.sleep(self.fsync_interval)
+        batch, self._pending = self._pending, []
+        self._flush_task = None
+        try:
+            async with self._file_lock:
+                await asyncio.to_thread(self._write_batch, b"".join(line for line, _ in batch))
+        except Exception as e:
+            logger.error("Impossible d'écrire dans le spool %s: %s", self.directory, e)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.depth += len(batch)
+        for _, future in batch:
+            future.set_result(None)
+
+    async def _dead_letter(self, records: List[Dict[str, Any]], error: Any, stage: str):
+        """
+        Ajoute des enregistrements refusés par MongoDB au fichier des rejets
+        """
+        lines = b"".join(
+            (dumps({**record, "error": str(error)}, json_options=CANONICAL_JSON_OPTIONS) + "\n").encode("utf-8")
+            for record in records
+        )
+        async with self._file_lock:
+            await asyncio.to_thread(self._write_dead_letters, lines)
+        EVENT_SPOOL_DEAD_LETTERS.inc(stage=stage, amount=len(records))
+
+    def _write_dead_letters(self, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE), "ab") as handle:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            handle.write(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    def _segment_path(self, sequence: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{self._worker}-{sequence:08d}{SEGMENT_SUFFIX}")
+
+    def _write_batch(self, data: bytes):
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = open(self._segment_path(self._sequence), "ab")
+            # Le segment en cours d'écriture n'est pas rejoué par les autres workers
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            self._file_size = 0
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file_size += len(data)
+        if self._file_size >= self.segment_bytes:
+            self._close_segment()
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._sequence += 1
+
+    # ------------------------------------------------------------------
+    # Rejeu
+    # ------------------------------------------------------------------
+
+    async def start(self):
+        """
+        Démarre le rejeu périodique (y compris des segments laissés par un
+        arrêt précédent)
+        """
+        if not self.enabled or self._replay_task is not None:
+            return
+        self.depth = await asyncio.to_thread(self._count_spooled)
+        if self.depth:
+            logger.warning("%s événement(s) en attente dans le spool %s", self.depth, self.directory)
+        self._replay_task = asyncio.create_task(self._replay_loop())
+
+    async def stop(self):
+        if self._replay_task is not None:
+            self._replay_task.cancel()
+            try:
+                await self._replay_task
+            except asyncio.CancelledError:
+                pass
+            self._replay_task = None
+        if self._flush_task is not None:
+            await self._flush_task
+        async with self._file_lock:
+            self._close_segment()
+
+    async def _replay_loop(self):
+        while True:
+            await asyncio.sleep(self.replay_interval)
+            try:
+                await self.replay()
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                logger.warning("MongoDB toujours indisponible, rejeu du spool reporté: %s", e)
+            except Exception:
+                logger.exception("Erreur lors du rejeu du spool")
+
+    async def replay(self) -> int:
+        """
+        Rejoue les segments fermés dans MongoDB, du plus ancien au plus récent,
+        et retourne le nombre d'événements rejoués
+        """
+        if not self.depth and not await asyncio.to_thread(self._segments):
+            return 0
+
+        # Fermer le segment courant pour qu'il puisse être rejoué
+        async with self._file_lock:
+            self._close_segment()
+
+        replayed = 0
+        for path in await asyncio.to_thread(self._segments):
+            handle = await asyncio.to_thread(self._lock_segment, path)
+            if handle is None:
+                continue
+            try:
+                records = await asyncio.to_thread(self._read_segment, handle, path)
+                for start in range(0, len(records), REPLAY_BATCH_SIZE):
+                    await self._replay_batch(records[start:start + REPLAY_BATCH_SIZE])
+                os.unlink(path)
+            finally:
+                handle.close()
+            replayed += len(records)
+            logger.info("Segment %s rejoué (%s événement(s))", os.path.basename(path), len(records))
+
+        self.depth = await asyncio.to_thread(self._count_spooled)
+        if replayed:
+            # La base répond de nouveau : inutile d'attendre la fin du mode dégradé
+            self._degraded_until = 0.0
+        return replayed
+
+    async def _replay_batch(self, records: List[Dict[str, Any]]):
+        db = await get_database()
+        # Enregistrements refusés par MongoDB, avec l'erreur : index -> message
+        rejected: Dict[int, str] = {}
+
+        # Insertion des événements (et des tâches différées), regroupés par
+        # collection ; ceux qui ont des compteurs ou une tâche à exécuter sont
+        # marqués jusqu'à ce qu'ils soient appliqués
+        inserted = set(range(len(records)))
+        by_collection: Dict[str, List[int]] = {}
+        for index, record in enumerate(records):
+            by_collection.setdefault(record["collection"], []).append(index)
+        for collection, indexes in by_collection.items():
+            operations = [
+                InsertOne({**records[i]["event"], COUNTERS_PENDING_FIELD: True} if _has_effects(records[i]) else records[i]["event"])
+                for i in indexes
+            ]
+            try:
+                await db[collection].bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    index = indexes[error["index"]]
+                    inserted.discard(index)
+                    if error["code"] != DUPLICATE_KEY_ERROR:
+                        rejected[index] = error.get("errmsg", "")
+
+        # Doublons : déjà présents, mais dont les compteurs n'ont pas été
+        # appliqués si un rejeu précédent a échoué avant de retirer le drapeau
+        pending = {index for index in inserted if _has_effects(records[index])}
+        for collection, indexes in by_collection.items():
+            duplicates = {
+                records[i]["event"]["_id"]: i
+                for i in indexes if i not in inserted and i not in rejected and _has_effects(records[i])
+            }
+            if duplicates:
+                marked = await db[collection].find(
+                    {"_id": {"$in": list(duplicates)}, COUNTERS_PENDING_FIELD: True}, {"_id": 1}
+                ).to_list(length=None)
+                pending.update(duplicates[event["_id"]] for event in marked)
+
+        # Compteurs, sans ordre : un compteur refusé n'empêche pas les autres
+        updates: Dict[str, List[Tuple[int, UpdateOne]]] = {}
+        for index in sorted(pending):
+            for update in records[index]["updates"]:
+                updates.setdefault(update["collection"], []).append(
+                    (index, UpdateOne(update["filter"], update["update"], upsert=update["upsert"]))
+                )
+        for collection, operations in updates.items():
+            try:
+                await db[collection].bulk_write([operation for _, operation in operations], ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    rejected.setdefault(operations[error["index"]][0], error.get("errmsg", ""))
+
+        # Tâches différées, dans l'ordre du spool (après les événements du lot) ;
+        # une erreur transitoire interrompt le rejeu, le segment est conservé
+        for index in sorted(pending):
+            name = records[index].get("handler")
+            if name is None or index in rejected:
+                continue
+            handler = self._handlers.get(name)
+            if handler is None:
+                rejected[index] = f"Aucun gestionnaire pour la tâche {name}"
+                continue
+            try:
+                await handler(records[index]["event"]["payload"])
+            except PyMongoError as e:
+                if is_transient_error(e):
+                    raise
+                rejected[index] = str(e)
+            except Exception as e:
+                logger.exception("Tâche différée %s en échec", name)
+                rejected[index] = repr(e)
+
+        applied: Dict[str, List[Any]] = {}
+        for index in pending:
+            if index not in rejected:
+                applied.setdefault(records[index]["collection"], []).append(records[index]["event"]["_id"])
+        for collection, event_ids in applied.items():
+            await db[collection].update_many({"_id": {"$in": event_ids}}, {"$unset": {COUNTERS_PENDING_FIELD: ""}})
+
+        for index, error in rejected.items():
+            logger.error("Événement %s refusé par MongoDB lors du rejeu: %s", records[index]["event"]["_id"], error)
+            await self._dead_letter([records[index]], error, "replay")
+
+        EVENT_SPOOL_REPLAYED.inc(result="inserted", amount=len(inserted))
+        EVENT_SPOOL_REPLAYED.inc(result="duplicate", amount=len(records) - len(inserted | set(rejected)))
+
+    def _segments(self) -> List[str]:
+        """
+        Segments présents dans le répertoire, du plus ancien au plus récent
+        """
+        try:
+            names = [
+                name for name in os.listdir(self.directory)
+                if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+            ]
+        except FileNotFoundError:
+            return []
+        paths = [os.path.join(self.directory, name) for name in names]
+        return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+    @staticmethod
+    def _lock_segment(path: str):
+        """
+        Ouvre et verrouille un segment ; retourne None s'il est en cours
+        d'écriture ou de rejeu par un autre worker, ou s'il a déjà été rejoué
+        """
+        try:
+            handle = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # Le segment a pu être rejoué et supprimé entre l'ouverture et le verrou
+            if os.fstat(handle.fileno()).st_ino != os.stat(path).st_ino:
+                raise FileNotFoundError(path)
+        except (BlockingIOError, FileNotFoundError):
+            handle.close()
+            return None
+        return handle
+
+    @staticmethod
+    def _read_segment(handle, path: str) -> List[Dict[str, Any]]:
+        records = []
+        for number, line in enumerate(handle, start=1):
+            try:
+                records.append(loads(line.decode("utf-8")))
+            except ValueError:
+                # Dernière ligne tronquée par un arrêt brutal pendant l'écriture
+                logger.error("Ligne %s illisible dans le segment %s, ignorée", number, path)
+        return records
+
+    def _count_spooled(self) -> int:
+        count = 0
+        for path in self._segments():
+            try:
+                with open(path, "rb") as handle:
+                    count += sum(1 for _ in handle)
+            except FileNotFoundError:
+                continue
+        return count
+
+
+event_spool = EventSpool.from_env()
@@ -0,0 +1,198 @@
+"""
+Moteur de conversation côté serveur
+
+Reprend la logique du widget (nodeProcessor.js, eventHandlers.js) : à partir
+du nœud courant d'une session et de la réponse de l'utilisateur (option
+choisie, saisie libre, formulaire), détermine le ou les nœuds suivants à
+afficher. Les nœuds sans élément interactif sont enchaînés jusqu'au prochain
+nœud qui attend une réponse, de sorte qu'un tour de conversation tient en une
+seule requête (POST /api/sessions/{id}/advance).
+
+Le module ne fait aucun accès à la base : l'enregistrement des événements et
+la mise à jour de la session sont faits par l'API.
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.flow_graph import (
+    build_adjacency, compiled_graph, find_form_field, find_start_node_ids, form_field_name, is_end_node,
+    node_data, node_elements
+)
+from app.utils.cache import TTLCache
+
+# Nombre maximal de nœuds enchaînés en un tour (protège des boucles sans interaction)
+MAX_CHAINED_NODES = 20
+
+# Champs d'éléments contenant une URL de média
+MEDIA_URL_FIELDS = ("mediaUrl", "imageUrl")
+
+# Flows compilés, par hash du snapshot publié (contenu immuable)
+_compiled_flows = TTLCache("compiled_flows", maxsize=512, ttl=float("inf"))
+
+
+def is_interactive(element: Dict[str, Any]) -> bool:
+    """
+    Élément qui attend une réponse de l'utilisateur (même règle que le widget)
+    """
+    element_type = element.get("type")
+    if element.get("options"):
+        return True
+    if element_type == "form":
+        return bool(element.get("formFields"))
+    return element_type in ("input", "wait_input")
+
+
+def node_question(node: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """
+    Question affichée par un nœud (enregistrée dans le journal comme message du bot)
+    """
+    if node.get("question"):
+        return {"content": node["question"], "type": node.get("type") or "text"}
+    elements = node_elements(node)
+    if elements and elements[0].get("content"):
+        return {"content": elements[0]["content"], "type": elements[0].get("type") or "text"}
+    return None
+
+
+def node_responses(node: Dict[str, Any], message_type: str, content: Any) -> List[Tuple[str, str]]:
+    """
+    Réponses nommées (champ, valeur) contenues dans la réponse de l'utilisateur
+    à `node` : une par champ déclaré d'un formulaire (une par valeur cochée), ou la
+    réponse à l'élément interactif (option choisie, saisie libre), nommée par
+    l'identifiant de l'élément. Aucune si le nœud n'attend pas de réponse.
+    """
+    elements = [element for element in node_elements(node) if is_interactive(element)]
+    if not elements or content in (None, ""):
+        return []
+
+    if message_type == "form":
+        try:
+            form_data = json.loads(content) if isinstance(content, str) else content
+        except ValueError:
+            return []
+        if not isinstance(form_data, dict):
+            return []
+        # Seuls les champs déclarés dans le formulaire du nœud sont retenus
+        responses = []
+        for field_name, value in form_data.items():
+            field = find_form_field(node, field_name)
+            if field is None:
+                continue
+            for item in value if isinstance(value, list) else [value]:
+                if item not in (None, "") and not isinstance(item, (dict, list)):
+                    responses.append((form_field_name(field), str(item)))
+        return responses
+
+    # Option choisie (par son texte ou son identifiant), sinon saisie libre
+    for element in elements:
+        for option in element.get("options") or []:
+            if isinstance(option, dict) and content in (option.get("text"), option.get("id")):
+                return [(element.get("id") or node["id"], option.get("text") or str(content))]
+    if message_type == "option":
+        return []
+    element = next((element for element in elements if element.get("type") in ("input", "wait_input")), None)
+    if element is None:
+        return []
+    return [(element.get("id") or node["id"], str(content))]
+
+
+def resolve_media_urls(value: Any, base_url: str) -> Any:
+    """
+    Copie de `value` où les URL de médias relatives (/static/media/...) sont
+    rendues absolues
+    """
+    if isinstance(value, list):
+        return [resolve_media_urls(item, base_url) for item in value]
+    if not isinstance(value, dict):
+        return value
+    resolved = {}
+    for key, item in value.items():
+        if key in MEDIA_URL_FIELDS and isinstance(item, str) and item.startswith("/"):
+            resolved[key] = f"{base_url}{item}"
+        else:
+            resolved[key] = resolve_media_urls(item, base_url)
+    return resolved
+
+
+class CompiledFlow:
+    """
+    Index d'un flow pour le parcours : nœuds par identifiant, nœud suivant par
+    défaut (première cible de la liste d'adjacence) et nœud de départ. Le graphe
+    compilé enregistré avec le flow (`compiled_flow`) est utilisé s'il est à
+    jour ; sinon il est recalculé depuis les nœuds et les connexions.
+    """
+
+    def __init__(self, flow: Dict[str, Any]):
+        nodes = [node for node in flow.get("nodes") or [] if node.get("id")]
+        self.nodes: Dict[str, Dict[str, Any]] = {node["id"]: node for node in nodes}
+        graph = compiled_graph(flow)
+        if graph is not None:
+            adjacency = graph["adjacency"]
+            start_ids = graph["start_node_ids"]
+        else:
+            edges = flow.get("edges") or []
+            adjacency = build_adjacency(nodes, edges)
+            start_ids = find_start_node_ids(nodes, edges)
+        self.default_next: Dict[str, str] = {
+            node_id: targets[0] for node_id, targets in adjacency.items() if targets and node_id in self.nodes
+        }
+        self.start_node_id: Optional[str] = start_ids[0] if start_ids else None
+
+    def awaits_input(self, node_id: str) -> bool:
+        return any(is_interactive(element) for element in node_elements(self.nodes[node_id]))
+
+    def next_node_id(self, node_id: str, option: Optional[str] = None) -> Optional[str]:
+        """
+        Nœud suivant : cible de l'option choisie si elle en a une, sinon
+        première cible de la liste d'adjacence
+        """
+        if option is not None:
+            for element in node_elements(self.nodes[node_id]):
+                for candidate in element.get("options") or []:
+                    if not isinstance(candidate, dict) or option not in (candidate.get("text"), candidate.get("id")):
+                        continue
+                    target = candidate.get("targetNodeId")
+                    if target in self.nodes:
+                        return target
+        return self.default_next.get(node_id)
+
+    def chain_from(self, node_id: Optional[str]) -> List[str]:
+        """
+        Nœuds à afficher à partir de `node_id` : il est suivi des nœuds sans
+        interaction jusqu'au premier qui attend une réponse ou termine le flow
+        """
+        chain: List[str] = []
+        while node_id in self.nodes and node_id not in chain and len(chain) < MAX_CHAINED_NODES:
+            chain.append(node_id)
+            node = self.nodes[node_id]
+            if self.awaits_input(node_id) or is_end_node(node):
+                break
+            node_id = self.default_next.get(node_id)
+        return chain
+
+    def render(self, node_id: str, base_url: str) -> Dict[str, Any]:
+        """
+        Nœud tel que renvoyé au widget : éléments avec URL de médias absolues
+        """
+        node = self.nodes[node_id]
+        return {
+            "id": node_id,
+            "type": node_data(node).get("type") or node.get("type"),
+            "elements": resolve_media_urls(node_elements(node), base_url),
+            "awaits_input": self.awaits_input(node_id),
+            "is_end": is_end_node(node)
+        }
+
+
+def compile_flow(flow: Dict[str, Any], content_hash: Optional[str] = None) -> CompiledFlow:
+    """
+    Compile un flow ; le résultat est mis en cache quand le flow est un
+    snapshot publié (identifié par son hash)
+    """
+    if content_hash is None:
+        return CompiledFlow(flow)
+    compiled = _compiled_flows.get(content_hash)
+    if compiled is None:
+        compiled = CompiledFlow(flow)
+        _compiled_flows.set(content_hash, compiled)
+    return compiled
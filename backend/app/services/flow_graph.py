@@ -0,0 +1,362 @@
+"""
+Analyse du graphe d'un flow (nœuds et connexions d'un assistant)
+
+`compile_graph` est exécuté à l'enregistrement et à la publication d'un
+assistant ; son résultat est stocké avec l'assistant (champ `compiled_flow`) et
+avec chaque snapshot publié, pour que le suivi des sessions lise la
+progression sans reparcourir le graphe.
+"""
+from collections import deque
+from typing import Dict, List, Any, Optional, Set
+
+
+def node_data(node: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Données d'un nœud (`data`), ou un dictionnaire vide
+    """
+    data = node.get("data")
+    return data if isinstance(data, dict) else {}
+
+
+def is_start_node(node: Dict[str, Any]) -> bool:
+    """
+    Un nœud de départ est typé "start" (éditeur) ou "startNode" (widget)
+    """
+    return node.get("type") in ("start", "startNode") or node_data(node).get("type") == "start"
+
+
+def node_elements(node: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Éléments d'un nœud (stockés dans `data.elements` par l'éditeur, ou à la racine)
+    """
+    elements = node_data(node).get("elements") or node.get("elements") or []
+    return [element for element in elements if isinstance(element, dict)]
+
+
+def build_adjacency(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """
+    Construit les listes d'adjacence du flow à partir des connexions et des
+    options qui ciblent directement un nœud (`targetNodeId`)
+    """
+    node_ids = {node.get("id") for node in nodes if node.get("id")}
+    adjacency: Dict[str, List[str]] = {node_id: [] for node_id in node_ids}
+
+    def link(source: str, target: str):
+        if source in adjacency and target in node_ids and target not in adjacency[source]:
+            adjacency[source].append(target)
+
+    for edge in edges:
+        link(edge.get("source"), edge.get("target"))
+
+    for node in nodes:
+        for element in node_elements(node):
+            for option in element.get("options") or []:
+                if isinstance(option, dict) and option.get("targetNodeId"):
+                    link(node.get("id"), option["targetNodeId"])
+
+    return adjacency
+
+
+def find_start_node_ids(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> List[str]:
+    """
+    Nœuds de départ : nœuds typés "start", sinon nœuds sans connexion entrante
+    (même règle que le widget)
+    """
+    explicit = [node["id"] for node in nodes if node.get("id") and is_start_node(node)]
+    if explicit:
+        return explicit
+
+    targets = {edge.get("target") for edge in edges}
+    return [node["id"] for node in nodes if node.get("id") and node["id"] not in targets]
+
+
+def reachable_node_ids(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> Set[str]:
+    """
+    Ensemble des nœuds atteignables depuis les nœuds de départ (parcours en largeur)
+    """
+    adjacency = build_adjacency(nodes, edges)
+    reachable: Set[str] = set()
+    queue = deque(find_start_node_ids(nodes, edges))
+
+    while queue:
+        node_id = queue.popleft()
+        if node_id in reachable:
+            continue
+        reachable.add(node_id)
+        queue.extend(target for target in adjacency.get(node_id, []) if target not in reachable)
+
+    return reachable
+
+
+def count_reachable_nodes(assistant: Dict[str, Any]) -> int:
+    """
+    Nombre de nœuds atteignables d'un assistant (dénominateur du pourcentage de
+    complétion), lu dans le graphe compilé s'il est à jour
+    """
+    nodes = assistant.get("nodes") or []
+    compiled = compiled_graph(assistant)
+    if compiled is not None:
+        return compiled["reachable_count"] or len(nodes)
+    edges = assistant.get("edges") or []
+    return len(reachable_node_ids(nodes, edges)) or len(nodes)
+
+
+# ---------------------------------------------------------------------------
+# Compilation
+# ---------------------------------------------------------------------------
+
+# À incrémenter quand le format de `compile_graph` change : les graphes compilés
+# d'une version antérieure sont ignorés (recalcul à la lecture)
+COMPILER_VERSION = 1
+
+COMPILED_FLOW_FIELD = "compiled_flow"
+
+
+def node_flag(node: Dict[str, Any], flag: str) -> bool:
+    """
+    Propriété booléenne d'un nœud (is_partial_lead, is_complete_lead,
+    is_final_node), à la racine ou dans `data`
+    """
+    return bool(node.get(flag) or node_data(node).get(flag))
+
+
+def is_end_node(node: Dict[str, Any]) -> bool:
+    return node.get("type") == "end" or node_data(node).get("type") == "end"
+
+
+def _error(code: str, message: str, node_id: Optional[str] = None) -> Dict[str, Any]:
+    return {"code": code, "node_id": node_id, "message": message}
+
+
+def _distances(sources: List[str], adjacency: Dict[str, List[str]]) -> Dict[str, int]:
+    """
+    Distance (en connexions) depuis l'ensemble `sources`, par parcours en largeur
+    """
+    distances = {source: 0 for source in sources}
+    queue = deque(sources)
+    while queue:
+        node_id = queue.popleft()
+        for target in adjacency.get(node_id, []):
+            if target not in distances:
+                distances[target] = distances[node_id] + 1
+                queue.append(target)
+    return distances
+
+
+def _longest_path(node_ids: Set[str], adjacency: Dict[str, List[str]]) -> Optional[int]:
+    """
+    Longueur du plus long chemin (en connexions) entre nœuds de `node_ids`, ou
+    None si ce sous-graphe contient un cycle (tri topologique de Kahn)
+    """
+    indegree = {node_id: 0 for node_id in node_ids}
+    for node_id in node_ids:
+        for target in adjacency.get(node_id, []):
+            if target in indegree:
+                indegree[target] += 1
+
+    queue = deque(node_id for node_id, degree in indegree.items() if degree == 0)
+    longest = {node_id: 0 for node_id in node_ids}
+    visited = 0
+    while queue:
+        node_id = queue.popleft()
+        visited += 1
+        for target in adjacency.get(node_id, []):
+            if target not in indegree:
+                continue
+            longest[target] = max(longest[target], longest[node_id] + 1)
+            indegree[target] -= 1
+            if indegree[target] == 0:
+                queue.append(target)
+
+    if visited < len(node_ids):
+        return None
+    return max(longest.values(), default=0)
+
+
+def compile_graph(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Compile le graphe d'un flow :
+    - listes d'adjacence (connexions et cibles des options) ;
+    - profondeur de chaque nœud atteignable (distance minimale depuis le départ) ;
+    - distance restante de chaque nœud jusqu'au nœud final le plus proche
+      (None si aucun nœud final n'est atteignable depuis ce nœud) ;
+    - nœuds finaux et nœuds de lead, nœuds orphelins et impasses ;
+    - erreurs de validation, affichées dans l'éditeur.
+    """
+    node_ids = [node["id"] for node in nodes if node.get("id")]
+    known = set(node_ids)
+    nodes_by_id = {node["id"]: node for node in nodes if node.get("id")}
+    adjacency = build_adjacency(nodes, edges)
+    errors: List[Dict[str, Any]] = []
+
+    for edge in edges:
+        source, target = edge.get("source"), edge.get("target")
+        if source not in known or target not in known:
+            errors.append(_error(
+                "invalid_edge",
+                f"Connexion vers ou depuis un nœud inexistant ({source} → {target})",
+                source if source in known else None
+            ))
+    for node in nodes:
+        for element in node_elements(node):
+            for option in element.get("options") or []:
+                if isinstance(option, dict) and option.get("targetNodeId") and option["targetNodeId"] not in known:
+                    errors.append(_error(
+                        "invalid_option_target",
+                        f"L'option « {option.get('text') or option.get('id')} » cible un nœud inexistant",
+                        node.get("id")
+                    ))
+
+    start_node_ids = find_start_node_ids(nodes, edges)
+    if not start_node_ids and node_ids:
+        errors.append(_error("missing_start_node", "Aucun nœud de départ"))
+
+    depth = _distances(start_node_ids, adjacency)
+    reachable = set(depth)
+
+    # Nœuds finaux : marqués comme tels ou nœuds de fin ; à défaut, les nœuds
+    # atteignables sans connexion sortante terminent la conversation
+    final_node_ids = [
+        node_id for node_id in node_ids
+        if node_flag(nodes_by_id[node_id], "is_final_node") or is_end_node(nodes_by_id[node_id])
+    ]
+    sinks = [node_id for node_id in node_ids if node_id in reachable and not adjacency.get(node_id)]
+    if not final_node_ids and node_ids:
+        errors.append(_error("no_final_node", "Aucun nœud final (nœud de fin ou marqué comme final)"))
+    targets = final_node_ids or sinks
+
+    reverse: Dict[str, List[str]] = {node_id: [] for node_id in node_ids}
+    for source, source_targets in adjacency.items():
+        for target in source_targets:
+            reverse[target].append(source)
+    remaining = _distances(targets, reverse)
+
+    orphan_node_ids = [node_id for node_id in node_ids if node_id not in reachable]
+    for node_id in orphan_node_ids:
+        errors.append(_error("unreachable_node", "Nœud inaccessible depuis le départ", node_id))
+
+    final_set = set(final_node_ids)
+    dead_end_node_ids = [node_id for node_id in sinks if final_set and node_id not in final_set]
+    for node_id in dead_end_node_ids:
+        errors.append(_error("dead_end", "Nœud sans suite qui ne termine pas la conversation", node_id))
+
+    return {
+        "version": COMPILER_VERSION,
+        "adjacency": adjacency,
+        "start_node_ids": start_node_ids,
+        "node_count": len(node_ids),
+        "reachable_count": len(reachable),
+        "depth": depth,
+        "remaining": {node_id: remaining.get(node_id) for node_id in node_ids},
+        "longest_path": _longest_path(reachable, adjacency),
+        "final_node_ids": final_node_ids,
+        "partial_lead_node_ids": [node_id for node_id in node_ids if node_flag(nodes_by_id[node_id], "is_partial_lead")],
+        "complete_lead_node_ids": [node_id for node_id in node_ids if node_flag(nodes_by_id[node_id], "is_complete_lead")],
+        "orphan_node_ids": orphan_node_ids,
+        "dead_end_node_ids": dead_end_node_ids,
+        "errors": errors
+    }
+
+
+def compile_assistant(assistant: Dict[str, Any]) -> Dict[str, Any]:
+    return compile_graph(assistant.get("nodes") or [], assistant.get("edges") or [])
+
+
+def compiled_graph(flow: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Graphe compilé stocké avec un assistant ou un flow publié, s'il est à jour
+    """
+    compiled = flow.get(COMPILED_FLOW_FIELD)
+    if isinstance(compiled, dict) and compiled.get("version") == COMPILER_VERSION:
+        return compiled
+    return None
+
+
+def remaining_distance(flow: Dict[str, Any], node_id: Optional[str]) -> Optional[int]:
+    """
+    Nombre de nœuds restant à parcourir depuis `node_id` jusqu'à un nœud final,
+    ou None s'il est inconnu
+    """
+    compiled = compiled_graph(flow)
+    if compiled is None or node_id is None:
+        return None
+    return compiled["remaining"].get(node_id)
+
+
+# ---------------------------------------------------------------------------
+# Champs de réponse
+# ---------------------------------------------------------------------------
+
+# Réponses à valeurs fixées par le flow (compteurs exacts) ou saisies libres
+# (résumé top-K à taille bornée, voir app.utils.sketches)
+CATEGORICAL_FIELD = "categorical"
+FREE_TEXT_FIELD = "free_text"
+
+CATEGORICAL_FORM_FIELD_TYPES = ("select", "radio", "checkbox")
+
+
+def _option_value(option: Any) -> Optional[str]:
+    if isinstance(option, dict):
+        value = option.get("text") or option.get("value") or option.get("label")
+        return str(value) if value is not None else None
+    return str(option) if option is not None else None
+
+
+def find_form_field(node: Dict[str, Any], field_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Champ de formulaire du nœud désigné par son nom, son libellé ou son identifiant
+    """
+    for element in node_elements(node):
+        for field in element.get("formFields") or []:
+            if isinstance(field, dict) and field_name in (field.get("name"), field.get("label"), field.get("id")):
+                return field
+    return None
+
+
+def form_field_name(field: Dict[str, Any]) -> str:
+    """
+    Nom sous lequel les réponses à un champ de formulaire sont enregistrées
+    """
+    return str(field.get("name") or field.get("label") or field.get("id"))
+
+
+def response_field(flow: Dict[str, Any], node_id: str, field_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Champ de réponse déclaré dans le flow, ou None s'il n'existe pas :
+    - `kind` : "categorical" quand les valeurs possibles sont fixées par le flow
+      (options d'un choix, champ de formulaire select, radio ou case à cocher),
+      "free_text" sinon (saisie libre) ;
+    - `values` : valeurs déclarées (textes des options), seules comptées
+      exactement.
+
+    Hors formulaire, le champ est l'élément interactif du nœud (son identifiant,
+    ou celui du nœud, voir `flow_engine.node_responses`).
+    """
+    node = next((node for node in flow.get("nodes") or [] if node.get("id") == node_id), None)
+    if node is None:
+        return None
+    elements = node_elements(node)
+
+    field = find_form_field(node, field_name)
+    if field is not None:
+        values = [value for value in map(_option_value, field.get("options") or []) if value is not None]
+        if field.get("type") == "checkbox" and not values:
+            values = ["True", "False"]
+        categorical = field.get("type") in CATEGORICAL_FORM_FIELD_TYPES or bool(values)
+        return {"kind": CATEGORICAL_FIELD if categorical else FREE_TEXT_FIELD, "values": values}
+
+    interactive = [
+        element for element in elements
+        if element.get("options") or element.get("type") in ("input", "wait_input")
+    ]
+    if field_name != node_id and field_name not in {element.get("id") for element in interactive}:
+        return None
+
+    # Hors formulaire : réponse à un choix si le nœud ne propose que des options
+    values = [
+        value for element in elements for value in map(_option_value, element.get("options") or []) if value is not None
+    ]
+    has_free_input = any(
+        element.get("type") in ("input", "wait_input") or element.get("formFields") for element in elements
+    )
+    return {"kind": CATEGORICAL_FIELD if values and not has_free_input else FREE_TEXT_FIELD, "values": values}
@@ -0,0 +1,350 @@
+"""
+Analyse hors ligne des parcours (collection `session_steps`)
+
+Les étapes d'un assistant sur une période sont chargées en colonnes NumPy
+(identifiants de sessions et de nœuds remplacés par des entiers, horodatages en
+millisecondes), triées par session puis par date. Les analyses — funnel le long
+d'un chemin, séquences de nœuds les plus fréquentes, temps entre deux étapes,
+points d'abandon — sont ensuite des opérations vectorisées sur ces tableaux,
+sans boucle Python par étape.
+
+Utilisé par GET /api/analytics/step-analysis et par le script
+`analyze_steps.py`.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.models.session import SessionStatus
+
+logger = logging.getLogger(__name__)
+
+# Collections MongoDB
+SESSIONS_COLLECTION = "sessions"
+STEPS_COLLECTION = "session_steps"
+
+# Nombre de sessions par requête $in lors du chargement des étapes
+SESSION_CHUNK_SIZE = 1000
+# Taille des lots du curseur MongoDB
+CURSOR_BATCH_SIZE = 10000
+
+# Période maximale analysée par GET /api/analytics/step-analysis (jours)
+MAX_ANALYSIS_DAYS = 365
+
+# Longueur maximale des séquences de nœuds comptées par `path_frequencies`
+MAX_NGRAM = 8
+
+# Centiles des distributions de temps entre étapes
+PERCENTILES = (50, 90, 99)
+
+
+class StepColumns:
+    """
+    Étapes en colonnes, triées par session puis par date. Les étapes
+    consécutives d'une session sur un même nœud (question puis réponse) sont
+    fusionnées en une seule.
+
+    - `sessions` : indice de la session dans `session_ids` (int32)
+    - `nodes` : indice du nœud dans `node_ids` (int32)
+    - `timestamps` : date de l'étape en millisecondes (int64)
+    - `completed` : sessions terminées normalement, par indice de session
+    """
+
+    def __init__(
+        self,
+        sessions: np.ndarray,
+        nodes: np.ndarray,
+        timestamps: np.ndarray,
+        session_ids: List[str],
+        node_ids: List[str],
+        completed: np.ndarray
+    ):
+        order = np.lexsort((timestamps, sessions))
+        sessions, nodes, timestamps = sessions[order], nodes[order], timestamps[order]
+
+        keep = np.ones(len(sessions), dtype=bool)
+        keep[1:] = (sessions[1:] != sessions[:-1]) | (nodes[1:] != nodes[:-1])
+        self.sessions = sessions[keep]
+        self.nodes = nodes[keep]
+        self.timestamps = timestamps[keep]
+        self.session_ids = session_ids
+        self.node_ids = node_ids
+        self.completed = completed
+
+        # Première et dernière étape de chaque session
+        self.starts = np.ones(len(self.sessions), dtype=bool)
+        self.starts[1:] = self.sessions[1:] != self.sessions[:-1]
+        self.ends = np.ones(len(self.sessions), dtype=bool)
+        self.ends[:-1] = self.starts[1:]
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def node_code(self, node_id: str) -> int:
+        try:
+            return self.node_ids.index(node_id)
+        except ValueError:
+            return -1
+
+    def session_count(self) -> int:
+        return int(self.starts.sum())
+
+
+def _read_step_columns(database, assistant_id: str, start: datetime, end: Optional[datetime]) -> StepColumns:
+    """
+    Lecture des étapes avec le client PyMongo synchrone (appelée dans un thread)
+    """
+    session_filter: Dict[str, Any] = {"assistant_id": assistant_id, "started_at": {"$gte": start}}
+    if end is not None:
+        session_filter["started_at"]["$lt"] = end
+
+    session_ids: List[str] = []
+    completed: List[bool] = []
+    cursor = database[SESSIONS_COLLECTION].find(session_filter, {"_id": 1, "status": 1}).batch_size(CURSOR_BATCH_SIZE)
+    for session in cursor:
+        session_ids.append(str(session["_id"]))
+        completed.append(session.get("status") == SessionStatus.COMPLETED.value)
+    session_index = {session_id: index for index, session_id in enumerate(session_ids)}
+
+    node_index: Dict[str, int] = {}
+    sessions: List[int] = []
+    nodes: List[int] = []
+    timestamps: List[datetime] = []
+    for offset in range(0, len(session_ids), SESSION_CHUNK_SIZE):
+        chunk = session_ids[offset:offset + SESSION_CHUNK_SIZE]
+        cursor = database[STEPS_COLLECTION].find(
+            {"session_id": {"$in": chunk}},
+            {"_id": 0, "session_id": 1, "node_id": 1, "timestamp": 1}
+        ).batch_size(CURSOR_BATCH_SIZE)
+        for step in cursor:
+            node_id = step.get("node_id")
+            if not node_id or not step.get("timestamp"):
+                continue
+            sessions.append(session_index[step["session_id"]])
+            nodes.append(node_index.setdefault(node_id, len(node_index)))
+            timestamps.append(step["timestamp"])
+
+    logger.info("Analyse des étapes: %s étape(s), %s session(s), %s nœud(s)", len(sessions), len(session_ids), len(node_index))
+    return StepColumns(
+        np.array(sessions, dtype=np.int32),
+        np.array(nodes, dtype=np.int32),
+        np.array(timestamps, dtype="datetime64[ms]").astype(np.int64),
+        session_ids,
+        list(node_index),
+        np.array(completed, dtype=bool)
+    )
+
+
+async def load_step_columns(db, assistant_id: str, start: datetime, end: Optional[datetime] = None) -> StepColumns:
+    """
+    Charge les étapes des sessions d'un assistant démarrées entre `start` et
+    `end` (par défaut maintenant). La lecture document par document se fait
+    dans un thread, avec la base PyMongo sous-jacente au client Motor
+    (`db.delegate`), pour ne pas bloquer la boucle d'événements.
+    """
+    return await asyncio.to_thread(_read_step_columns, db.delegate, assistant_id, start, end)
+
+
+def funnel(columns: StepColumns, path: List[str]) -> List[Dict[str, Any]]:
+    """
+    Funnel strict le long de `path` : une session atteint l'étape k si elle
+    visite les nœuds path[0] … path[k] dans cet ordre (d'autres nœuds peuvent
+    s'intercaler)
+    """
+    positions = np.arange(len(columns))
+    # Position de la dernière étape du funnel atteinte, par session
+    reached_at = np.zeros(len(columns.session_ids), dtype=np.int64)
+    alive = np.ones(len(columns.session_ids), dtype=bool)
+
+    result = []
+    for index, node_id in enumerate(path):
+        code = columns.node_code(node_id)
+        mask = (columns.nodes == code) & alive[columns.sessions]
+        if index > 0:
+            mask &= positions > reached_at[columns.sessions]
+        sessions = columns.sessions[mask]
+        # Étapes triées par session : la première de chaque session est la plus ancienne
+        first = np.ones(len(sessions), dtype=bool)
+        first[1:] = sessions[1:] != sessions[:-1]
+
+        alive[:] = False
+        alive[sessions[first]] = True
+        reached_at[sessions[first]] = positions[mask][first]
+
+        count = int(first.sum())
+        previous = result[-1]["sessions"] if result else count
+        entered = result[0]["sessions"] if result else count
+        result.append({
+            "node_id": node_id,
+            "sessions": count,
+            "conversion_rate": round(count / entered * 100, 2) if entered else 0,
+            "drop_off": previous - count,
+            "drop_off_rate": round((previous - count) / previous * 100, 2) if previous else 0
+        })
+    return result
+
+
+def _unique_counts(keys: np.ndarray):
+    """
+    Valeurs distinctes de `keys` et leur nombre d'occurrences (tri puis
+    découpage aux changements de valeur, plus rapide que np.unique sur de
+    grands tableaux d'entiers)
+    """
+    keys = np.sort(keys)
+    if not len(keys):
+        return keys, np.zeros(0, dtype=np.int64)
+    boundaries = np.flatnonzero(np.diff(keys)) + 1
+    starts = np.concatenate(([0], boundaries))
+    counts = np.diff(np.concatenate((starts, [len(keys)])))
+    return keys[starts], counts
+
+
+def path_frequencies(columns: StepColumns, length: int = 3, top: int = 20) -> List[Dict[str, Any]]:
+    """
+    Séquences de `length` nœuds consécutifs les plus fréquentes
+    """
+    length = max(1, min(length, MAX_NGRAM))
+    count = len(columns) - length + 1
+    if count <= 0:
+        return []
+
+    # Fenêtres entièrement contenues dans une session
+    valid = columns.sessions[:count] == columns.sessions[length - 1:]
+    windows = np.stack([columns.nodes[offset:offset + count] for offset in range(length)], axis=1)[valid]
+    if not len(windows):
+        return []
+
+    base = len(columns.node_ids)
+    if base ** length < 2 ** 62:
+        # Séquence codée en un entier : np.unique 1D, bien plus rapide que axis=0
+        keys = np.zeros(len(windows), dtype=np.int64)
+        for offset in range(length):
+            keys = keys * base + windows[:, offset]
+        keys, counts = _unique_counts(keys)
+        sequences = np.zeros((len(keys), length), dtype=np.int64)
+        for offset in range(length - 1, -1, -1):
+            sequences[:, offset] = keys % base
+            keys = keys // base
+    else:
+        sequences, counts = np.unique(windows, axis=0, return_counts=True)
+
+    order = np.argsort(-counts, kind="stable")[:top]
+    total = int(counts.sum())
+    return [
+        {
+            "path": [columns.node_ids[code] for code in sequences[index]],
+            "count": int(counts[index]),
+            "share": round(int(counts[index]) / total * 100, 2)
+        }
+        for index in order
+    ]
+
+
+def _percentiles(values: np.ndarray) -> Dict[str, float]:
+    if not len(values):
+        return {f"p{p}": 0.0 for p in PERCENTILES}
+    return {f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+def time_between_steps(columns: StepColumns, bins: int = 20) -> Dict[str, Any]:
+    """
+    Distribution du temps (en secondes) entre deux étapes consécutives d'une
+    session : centiles, histogramme à intervalles logarithmiques et temps par
+    nœud de départ
+    """
+    same_session = ~columns.starts[1:]
+    deltas = (np.diff(columns.timestamps)[same_session]) / 1000.0
+    sources = columns.nodes[:-1][same_session]
+
+    histogram = []
+    if len(deltas):
+        edges = np.unique(np.concatenate(([0.0], np.geomspace(1, max(float(deltas.max()), 1.0) + 1, bins))))
+        counts, edges = np.histogram(deltas, bins=edges)
+        histogram = [
+            {"from": round(float(edges[i]), 2), "to": round(float(edges[i + 1]), 2), "count": int(counts[i])}
+            for i in range(len(counts))
+        ]
+
+    # Centiles par nœud : tri par (nœud, durée) puis découpage aux changements de nœud
+    by_node = []
+    if len(deltas):
+        order = np.lexsort((deltas, sources))
+        sorted_sources, sorted_deltas = sources[order], deltas[order]
+        boundaries = np.flatnonzero(np.diff(sorted_sources)) + 1
+        for group_sources, group_deltas in zip(np.split(sorted_sources, boundaries), np.split(sorted_deltas, boundaries)):
+            by_node.append({
+                "node_id": columns.node_ids[int(group_sources[0])],
+                "count": len(group_deltas),
+                "mean": round(float(group_deltas.mean()), 2),
+                **_percentiles(group_deltas)
+            })
+        by_node.sort(key=lambda row: row["count"], reverse=True)
+
+    return {
+        "count": int(len(deltas)),
+        "mean": round(float(deltas.mean()), 2) if len(deltas) else 0.0,
+        **_percentiles(deltas),
+        "histogram": histogram,
+        "by_node": by_node
+    }
+
+
+def dropouts(columns: StepColumns, top: int = 20) -> List[Dict[str, Any]]:
+    """
+    Nœuds où les sessions non terminées s'arrêtent : nombre d'abandons et taux
+    rapporté aux sessions qui ont atteint le nœud
+    """
+    base = len(columns.node_ids)
+    if not base:
+        return []
+
+    last = columns.ends & ~columns.completed[columns.sessions]
+    exits = np.bincount(columns.nodes[last], minlength=base)
+    # Sessions distinctes ayant visité chaque nœud
+    visits, _ = _unique_counts(columns.sessions.astype(np.int64) * base + columns.nodes)
+    reached = np.bincount(visits % base, minlength=base)
+
+    order = np.argsort(-exits, kind="stable")[:top]
+    return [
+        {
+            "node_id": columns.node_ids[code],
+            "dropouts": int(exits[code]),
+            "sessions": int(reached[code]),
+            "dropout_rate": round(int(exits[code]) / int(reached[code]) * 100, 2) if reached[code] else 0
+        }
+        for code in order if exits[code]
+    ]
+
+
+def analyze(columns: StepColumns, path: Optional[List[str]] = None, ngram: int = 3, top: int = 20) -> Dict[str, Any]:
+    """
+    Rapport complet (calcul NumPy, à exécuter hors de la boucle d'événements)
+    """
+    return {
+        "steps": len(columns),
+        "sessions": columns.session_count(),
+        "nodes": len(columns.node_ids),
+        "funnel": funnel(columns, path) if path else [],
+        "paths": path_frequencies(columns, ngram, top),
+        "time_between_steps": time_between_steps(columns),
+        "dropouts": dropouts(columns, top)
+    }
+
+
+async def analyze_assistant(
+    db,
+    assistant_id: str,
+    start: datetime,
+    end: Optional[datetime] = None,
+    path: Optional[List[str]] = None,
+    ngram: int = 3,
+    top: int = 20
+) -> Dict[str, Any]:
+    """
+    Charge les étapes d'un assistant et calcule le rapport dans un thread
+    """
+    columns = await load_step_columns(db, assistant_id, start, end)
+    return await asyncio.to_thread(analyze, columns, path, ngram, top)
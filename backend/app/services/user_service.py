@@ -1,11 +1,24 @@
 from typing import Optional, Dict, Any, List
 from bson import ObjectId
 from app.database.mongodb import get_database
+from app.services.cache_invalidation import invalidation_bus
+from app.utils.cache import TTLCache
 from app.models.auth import UserRegister, UserResponse
 from app.utils.auth_utils import get_password_hash, verify_password
 from pymongo.errors import DuplicateKeyError
 from fastapi import HTTPException, status
 
+USERS_COLLECTION = "users"
+
+# Utilisateurs authentifiés par email (lus à chaque requête authentifiée)
+_users_cache = TTLCache("users", maxsize=10000, ttl=60)
+
+def forget_user(user_id: str):
+    """Retire un utilisateur modifié du cache (appelé par le bus d'invalidation)."""
+    _users_cache.evict_where(lambda key, value: value["id"] == user_id)
+
+invalidation_bus.register(USERS_COLLECTION, forget_user, _users_cache.clear)
+
 async def get_user_collection():
     """Récupère la collection users de la base de données."""
     db = await get_database()
@@ -61,6 +74,16 @@ async def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     
     return user
 
+async def get_cached_user_by_email(email: str) -> Optional[Dict[str, Any]]:
+    """Récupère un utilisateur par son email, via le cache des utilisateurs authentifiés."""
+    user = _users_cache.get(email)
+    if user is None:
+        user = await get_user_by_email(email)
+        if not user:
+            return None
+        _users_cache.set(email, user)
+    return user.copy()
+
 async def authenticate_user(email: str, password: str) -> Optional[Dict[str, Any]]:
     """Authentifie un utilisateur avec son email et son mot de passe."""
     user = await get_user_by_email(email)
@@ -92,6 +115,7 @@ async def update_user_password(email: str, new_password: str) -> bool:
         {"email": email},
         {"$set": {"password": hashed_password}}
     )
+    await invalidation_bus.publish(USERS_COLLECTION, str(user["_id"]))
     
     return result.modified_count > 0
 
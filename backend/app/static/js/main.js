@@ -110,11 +110,16 @@ async function initializeApp() {
   console.log('🔍 Récupération des données du flow pour l\'assistant:', publicId);
   
   try {
-    // Vérifier si les données sont déjà en cache
-    const cachedData = localStorage.getItem(`assistant_${publicId}`);
+    // Données du flow incluses dans la page par le serveur (toujours à jour)
+    const inlineData = readInlineFlow();
+    // Sinon, vérifier si les données sont déjà en cache
+    const cachedData = inlineData ? null : localStorage.getItem(`assistant_${publicId}`);
     let data;
     
-    if (cachedData) {
+    if (inlineData) {
+      console.log('📦 Données du flow incluses dans la page');
+      data = inlineData;
+    } else if (cachedData) {
       console.log('📦 Données trouvées dans le cache local');
       data = JSON.parse(cachedData);
       console.log('📋 Données du cache:', data);
@@ -172,7 +177,8 @@ async function initializeApp() {
             userAgent: navigator.userAgent,
             language: navigator.language,
             timestamp: new Date().toISOString(),
-            public_id: publicId // Ajouté pour référence
+            public_id: publicId, // Ajouté pour référence
+            visitor_id: getVisitorId() // Visiteurs uniques (analytics)
           }
         })
       });
@@ -208,6 +214,35 @@ async function initializeApp() {
   }
 }
 
+// Identifiant anonyme du visiteur, conservé d'une visite à l'autre
+function getVisitorId() {
+  try {
+    let visitorId = localStorage.getItem('leadflow_visitor_id');
+    if (!visitorId) {
+      visitorId = window.crypto?.randomUUID
+        ? window.crypto.randomUUID()
+        : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+      localStorage.setItem('leadflow_visitor_id', visitorId);
+    }
+    return visitorId;
+  } catch (error) {
+    // localStorage indisponible (navigation privée, cookies bloqués)
+    return null;
+  }
+}
+
+function readInlineFlow() {
+  const element = document.getElementById('assistant-flow');
+  if (!element) return null;
+  try {
+    const data = JSON.parse(element.textContent);
+    return data && Array.isArray(data.nodes) ? data : null;
+  } catch (error) {
+    console.error('❌ Données du flow incluses invalides:', error);
+    return null;
+  }
+}
+
 function getPublicIdFromUrl() {
   const urlParams = new URLSearchParams(window.location.search);
   let publicId = urlParams.get('id');
@@ -0,0 +1,205 @@
+"""
+Contrôle d'admission : limites de concurrence par groupe de routes
+
+Les requêtes sont réparties en groupes (chat public, dashboard, analytics).
+Chaque groupe a un nombre maximal de requêtes traitées simultanément ; au-delà,
+les requêtes attendent dans une file bornée pendant un temps limité, puis sont
+rejetées immédiatement (503 + Retry-After) plutôt que de ralentir tout le
+monde. Une rafale de requêtes d'analytics ne peut ainsi pas saturer la boucle
+d'événements ni le pool MongoDB au détriment des conversations en cours.
+
+Variables d'environnement (format "groupe=valeur,...", voir DEFAULT_LIMITS) :
+- ADMISSION_CONTROL : "0" pour désactiver
+- ADMISSION_CONCURRENCY : requêtes simultanées par groupe
+- ADMISSION_MAX_QUEUE : requêtes en attente par groupe
+- ADMISSION_QUEUE_TIMEOUT_MS : attente maximale dans la file
+- ADMISSION_RETRY_AFTER : valeur de l'en-tête Retry-After (secondes)
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Optional
+
+from app.utils.metrics import registry
+
+CHAT = "chat"
+DASHBOARD = "dashboard"
+ANALYTICS = "analytics"
+
+# Valeurs par défaut : le chat public garde la plus grande part des ressources
+DEFAULT_LIMITS = {
+    "concurrency": {CHAT: 200, DASHBOARD: 32, ANALYTICS: 8},
+    "max_queue": {CHAT: 1000, DASHBOARD: 64, ANALYTICS: 16},
+    "queue_timeout_ms": {CHAT: 2000, DASHBOARD: 1000, ANALYTICS: 500},
+    "retry_after": {CHAT: 1, DASHBOARD: 2, ANALYTICS: 5}
+}
+
+ADMISSION_QUEUE_DEPTH = registry.gauge(
+    "admission_queue_depth",
+    "Requêtes en attente d'admission, par groupe de routes",
+    ["group"]
+)
+ADMISSION_IN_FLIGHT = registry.gauge(
+    "admission_in_flight",
+    "Requêtes admises en cours de traitement, par groupe de routes",
+    ["group"]
+)
+ADMISSION_SHED = registry.counter(
+    "admission_shed_total",
+    "Requêtes rejetées (503) par le contrôle d'admission",
+    ["group", "reason"]
+)
+ADMISSION_WAIT = registry.histogram(
+    "admission_queue_wait_seconds",
+    "Temps d'attente avant admission",
+    ["group"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+)
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """
+    Groupe de routes d'une requête, ou None si elle n'est pas limitée
+    (fichiers statiques, métriques, documentation)
+    """
+    if path.startswith("/chat/"):
+        return CHAT
+    if not path.startswith("/api/"):
+        return None
+    if path.startswith("/api/sessions/by-assistant/") or path.startswith("/api/analytics/"):
+        # Le suivi des messages vient du widget, pas du dashboard
+        return CHAT if path.startswith("/api/analytics/track_") else ANALYTICS
+    if path.startswith("/api/sessions/") and method in ("POST", "PUT"):
+        return CHAT
+    if path.startswith("/api/assistants/public/") or (path.startswith("/api/assistants/") and "/flow" in path):
+        return CHAT
+    return DASHBOARD
+
+
+def parse_limits(spec: Optional[str], defaults: Dict[str, float]) -> Dict[str, float]:
+    """
+    Lit "groupe=valeur,autre=valeur" ; les entrées invalides sont ignorées
+    """
+    limits = dict(defaults)
+    for item in (spec or "").split(","):
+        name, _, value = item.partition("=")
+        try:
+            if name.strip():
+                limits[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return limits
+
+
+class AdmissionGroup:
+    """
+    Sémaphore avec file d'attente bornée et délai d'attente maximal
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, queue_timeout: float, retry_after: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        ADMISSION_QUEUE_DEPTH.set_function(lambda: self.waiting, group=name)
+        ADMISSION_IN_FLIGHT.set_function(lambda: self.in_flight, group=name)
+
+    async def acquire(self) -> bool:
+        """
+        Retourne True si la requête est admise (il faudra appeler `release`)
+        """
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            self.in_flight += 1
+            ADMISSION_WAIT.observe(0.0, group=self.name)
+            return True
+
+        if self.waiting >= self.max_queue:
+            ADMISSION_SHED.inc(group=self.name, reason="queue_full")
+            return False
+
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            ADMISSION_SHED.inc(group=self.name, reason="timeout")
+            return False
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        ADMISSION_WAIT.observe(time.perf_counter() - start, group=self.name)
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+class AdmissionControlMiddleware:
+    """
+    Middleware ASGI : la place est conservée jusqu'à la fin de l'envoi de la
+    réponse (y compris pour les réponses en streaming)
+    """
+
+    def __init__(self, app, groups: Optional[Dict[str, AdmissionGroup]] = None):
+        self.app = app
+        self.enabled = os.getenv("ADMISSION_CONTROL", "1").strip().lower() not in ("0", "false", "no", "off")
+        self.groups = groups if groups is not None else self.groups_from_env()
+
+    @staticmethod
+    def groups_from_env() -> Dict[str, AdmissionGroup]:
+        concurrency = parse_limits(os.getenv("ADMISSION_CONCURRENCY"), DEFAULT_LIMITS["concurrency"])
+        max_queue = parse_limits(os.getenv("ADMISSION_MAX_QUEUE"), DEFAULT_LIMITS["max_queue"])
+        timeouts = parse_limits(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS"), DEFAULT_LIMITS["queue_timeout_ms"])
+        retry_after = parse_limits(os.getenv("ADMISSION_RETRY_AFTER"), DEFAULT_LIMITS["retry_after"])
+        return {
+            name: AdmissionGroup(
+                name,
+                concurrency=max(1, int(concurrency[name])),
+                max_queue=max(0, int(max_queue[name])),
+                queue_timeout=timeouts[name] / 1000,
+                retry_after=max(1, int(retry_after[name]))
+            )
+            for name in (CHAT, DASHBOARD, ANALYTICS)
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        group = self.groups.get(classify(scope["method"], scope["path"]))
+        if group is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await group.acquire():
+            await self._reject(group, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            group.release()
+
+    @staticmethod
+    async def _reject(group: AdmissionGroup, send):
+        body = json.dumps(
+            {"detail": "Service momentanément surchargé, veuillez réessayer"},
+            ensure_ascii=False
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(group.retry_after).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
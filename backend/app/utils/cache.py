@@ -0,0 +1,75 @@
+"""
+Cache LRU en mémoire avec durée de vie (TTL)
+
+Utilisé pour les lectures fréquentes et peu changeantes (résolution des
+identifiants d'assistants, etc.). Chaque processus a son propre cache.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from app.utils.metrics import registry
+
+CACHE_REQUESTS = registry.counter(
+    "cache_requests_total",
+    "Lectures des caches en mémoire (hit / miss)",
+    ["cache", "result"]
+)
+CACHE_SIZE = registry.gauge(
+    "cache_entries",
+    "Nombre d'entrées des caches en mémoire",
+    ["cache"]
+)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Cache LRU borné : les entrées expirent après `ttl` secondes et les moins
+    récemment utilisées sont évincées au-delà de `maxsize`
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 300.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        CACHE_SIZE.set_function(lambda: len(self._data), cache=name)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is not _MISSING:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                CACHE_REQUESTS.inc(cache=self.name, result="hit")
+                return value
+            del self._data[key]
+        CACHE_REQUESTS.inc(cache=self.name, result="miss")
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def evict_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """
+        Supprime les entrées qui vérifient `predicate(clé, valeur)` ; retourne leur nombre
+        """
+        keys = [key for key, (_, value) in self._data.items() if predicate(key, value)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,146 @@
+"""
+Clés d'idempotence des POST du chat public (en-tête Idempotency-Key)
+
+Un client qui renvoie une requête après un délai dépassé (widget mobile,
+coupure réseau) réutilise la même clé : la requête d'origine n'est exécutée
+qu'une fois et les renvois reçoivent sa réponse, sans nouvelle écriture
+(message, étape, compteurs d'analytics).
+
+La clé est réservée dans la collection `idempotency_keys` avant l'exécution
+(insertion sur `_id`, unique), puis la réponse y est enregistrée. Les entrées
+expirent via un index TTL. Une clé réutilisée avec un autre corps de requête
+est refusée (422) ; un renvoi pendant que la requête d'origine est encore en
+cours reçoit un 409. Si la requête d'origine échoue, la clé est libérée pour
+que le renvoi puisse être exécuté.
+
+Variables d'environnement :
+- IDEMPOTENCY_TTL_SECONDS : durée de conservation des réponses (défaut 3600)
+- IDEMPOTENCY_LOCK_SECONDS : durée après laquelle une clé restée en cours
+  (worker arrêté pendant la requête) peut être reprise (défaut 30)
+"""
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from app.database.mongodb import get_database
+from app.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "30"))
+
+PENDING = "pending"
+COMPLETED = "completed"
+
+IDEMPOTENT_REQUESTS = registry.counter(
+    "idempotent_requests_total",
+    "Requêtes portant une clé d'idempotence : exécutées, rejouées ou refusées",
+    ["result"]
+)
+
+
+def _request_hash(method: str, path: str, body: bytes) -> str:
+    return hashlib.sha256(method.encode() + b" " + path.encode() + b"\n" + body).hexdigest()
+
+
+async def _reserve(collection, key_id: str, request_hash: str) -> Optional[dict]:
+    """
+    Réserve la clé ; retourne None si la requête doit être exécutée, sinon
+    l'entrée existante (requête déjà traitée ou en cours)
+    """
+    now = datetime.utcnow()
+    try:
+        await collection.insert_one({
+            "_id": key_id,
+            "state": PENDING,
+            "request_hash": request_hash,
+            "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+            "expires_at": now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+
+    # Reprise d'une clé abandonnée par un worker arrêté en cours de requête
+    taken_over = await collection.find_one_and_update(
+        {"_id": key_id, "state": PENDING, "request_hash": request_hash, "locked_until": {"$lt": now}},
+        {"$set": {"locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}},
+        return_document=ReturnDocument.AFTER
+    )
+    if taken_over:
+        return None
+    return await collection.find_one({"_id": key_id}) or {"state": PENDING, "request_hash": request_hash}
+
+
+async def idempotent(request: Request, response: Response, run: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Exécute `run` une seule fois par clé d'idempotence (en-tête
+    Idempotency-Key, propre au chemin de la requête) et retourne sa réponse.
+    Sans en-tête, `run` est simplement exécutée.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return await run()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} trop long (maximum {MAX_KEY_LENGTH} caractères)")
+
+    key_id = f"{request.method} {request.url.path}:{key}"
+    request_hash = _request_hash(request.method, request.url.path, await request.body())
+
+    try:
+        db = await get_database()
+        collection = db[IDEMPOTENCY_COLLECTION]
+        existing = await _reserve(collection, key_id, request_hash)
+    except PyMongoError as e:
+        # Stockage indisponible : exécuter la requête sans déduplication
+        logger.error("Clés d'idempotence indisponibles: %s", e)
+        return await run()
+
+    if existing is not None:
+        if existing["request_hash"] != request_hash:
+            IDEMPOTENT_REQUESTS.inc(result="mismatch")
+            raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} déjà utilisé pour une autre requête")
+        if existing["state"] != COMPLETED:
+            IDEMPOTENT_REQUESTS.inc(result="in_progress")
+            raise HTTPException(
+                status_code=409,
+                detail="Requête identique en cours de traitement",
+                headers={"Retry-After": "1"}
+            )
+        IDEMPOTENT_REQUESTS.inc(result="replayed")
+        response.headers[REPLAYED_HEADER] = "true"
+        return existing["response"]
+
+    try:
+        result = await run()
+    except BaseException:
+        # Libérer la clé : le renvoi pourra être exécuté
+        try:
+            await collection.delete_one({"_id": key_id, "state": PENDING})
+        except PyMongoError as e:
+            logger.error("Impossible de libérer la clé d'idempotence %s: %s", key_id, e)
+        raise
+
+    IDEMPOTENT_REQUESTS.inc(result="executed")
+    try:
+        await collection.update_one(
+            {"_id": key_id},
+            {"$set": {"state": COMPLETED, "response": jsonable_encoder(result)}, "$unset": {"locked_until": ""}}
+        )
+    except PyMongoError as e:
+        logger.error("Impossible d'enregistrer la réponse de la clé d'idempotence %s: %s", key_id, e)
+    return result
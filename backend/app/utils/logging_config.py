@@ -0,0 +1,121 @@
+"""
+Configuration centralisée du logging
+
+Variables d'environnement :
+- LOG_FORMAT : "json" (une ligne JSON par événement, défaut) ou "text"
+- LOG_LEVEL : niveau par défaut (INFO)
+- LOG_LEVELS : niveaux par logger, ex. "session_api=DEBUG,pymongo=WARNING"
+- LOG_REQUEST_SAMPLE_RATE : part des requêtes réussies journalisées (0 à 1, défaut 1)
+- LOG_SLOW_REQUEST_MS : au-delà de cette durée une requête est toujours journalisée
+- DEBUG_LOGS : "1" pour activer les logs de debug des chemins critiques
+"""
+import json
+import logging
+import os
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# Attributs standards d'un LogRecord (tout le reste provient de `extra=`)
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Loggers applicatifs passés en DEBUG par DEBUG_LOGS
+APP_LOGGERS = ("leadflow-api", "session_api", "assistant_api", "media_api", "auth_api", "api", "app")
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+DEBUG_LOGS = _env_flag("DEBUG_LOGS")
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formate chaque enregistrement en une ligne JSON. Le message n'est construit
+    (record.getMessage) que si l'enregistrement passe le filtre de niveau.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def parse_levels(spec: Optional[str]) -> Dict[str, int]:
+    """
+    Lit "logger=NIVEAU,autre=NIVEAU" ; les entrées invalides sont ignorées
+    """
+    levels = {}
+    for item in (spec or "").split(","):
+        name, _, level = item.partition("=")
+        level_value = logging.getLevelName(level.strip().upper())
+        if name.strip() and isinstance(level_value, int):
+            levels[name.strip()] = level_value
+    return levels
+
+
+def configure_logging():
+    """
+    Installe le handler racine (remplace les basicConfig des modules) et
+    applique les niveaux par logger
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    if os.getenv("LOG_FORMAT", "json").lower() == "text":
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        handler.setFormatter(JsonFormatter())
+
+    root_level = logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").upper())
+    logging.basicConfig(
+        level=root_level if isinstance(root_level, int) else logging.INFO,
+        handlers=[handler],
+        force=True
+    )
+
+    if DEBUG_LOGS:
+        for name in APP_LOGGERS:
+            logging.getLogger(name).setLevel(logging.DEBUG)
+
+    for name, level in parse_levels(os.getenv("LOG_LEVELS")).items():
+        logging.getLogger(name).setLevel(level)
+
+
+class RequestLogSampler:
+    """
+    Décide si une requête terminée doit être journalisée : les erreurs et les
+    requêtes lentes le sont toujours, les autres selon le taux d'échantillonnage
+    """
+
+    def __init__(self, sample_rate: float = 1.0, slow_ms: float = 1000.0):
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.slow_ms = slow_ms
+
+    @classmethod
+    def from_env(cls) -> "RequestLogSampler":
+        try:
+            sample_rate = float(os.getenv("LOG_REQUEST_SAMPLE_RATE", "1"))
+        except ValueError:
+            sample_rate = 1.0
+        try:
+            slow_ms = float(os.getenv("LOG_SLOW_REQUEST_MS", "1000"))
+        except ValueError:
+            slow_ms = 1000.0
+        return cls(sample_rate, slow_ms)
+
+    def should_log(self, status_code: int, duration_ms: float) -> bool:
+        if status_code >= 400 or duration_ms >= self.slow_ms:
+            return True
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
@@ -0,0 +1,355 @@
+"""
+Métriques au format texte Prometheus (sans dépendance externe)
+
+Compteurs, jauges et histogrammes avec labels, exposés par GET /metrics, ainsi
+que les écouteurs pymongo qui mesurent les commandes MongoDB et le pool de
+connexions.
+"""
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+# Bornes par défaut des histogrammes de latence (en secondes)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Dict[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra.items())
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        """
+        La valeur est calculée à chaque collecte (ex: profondeur d'une file)
+        """
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                values[key] = function()
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [compteurs par borne..., somme, nombre]
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for index, bound in enumerate(self.buckets):
+                cumulative += series[index]
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Registre des métriques du processus
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# ---------------------------------------------------------------------------
+# Métriques HTTP
+# ---------------------------------------------------------------------------
+
+REQUEST_LATENCY = registry.histogram(
+    "http_request_duration_seconds",
+    "Durée de traitement des requêtes HTTP par gabarit de route",
+    ["method", "route", "status"]
+)
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight",
+    "Requêtes HTTP en cours de traitement"
+)
+
+_route_templates: Dict[object, str] = {}
+
+
+def route_template(app, scope) -> str:
+    """
+    Gabarit de la route qui a traité la requête (ex: /api/sessions/{session_id}/messages),
+    pour éviter un label par URL
+    """
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if not _route_templates:
+        for route in app.routes:
+            target = getattr(route, "endpoint", None) or getattr(route, "app", None)
+            if target is not None:
+                _route_templates.setdefault(target, route.path)
+    return _route_templates.get(endpoint, "unmatched")
+
+
+# ---------------------------------------------------------------------------
+# Métriques MongoDB (pymongo command monitoring)
+# ---------------------------------------------------------------------------
+
+MONGO_COMMAND_DURATION = registry.histogram(
+    "mongodb_command_duration_seconds",
+    "Durée des commandes MongoDB par collection et opération",
+    ["command", "collection"]
+)
+MONGO_COMMAND_FAILURES = registry.counter(
+    "mongodb_command_failures_total",
+    "Commandes MongoDB en échec par collection et opération",
+    ["command", "collection"]
+)
+MONGO_POOL_CONNECTIONS = registry.gauge(
+    "mongodb_pool_connections",
+    "Connexions ouvertes dans le pool MongoDB",
+    ["address"]
+)
+MONGO_POOL_CHECKED_OUT = registry.gauge(
+    "mongodb_pool_checked_out_connections",
+    "Connexions du pool MongoDB en cours d'utilisation",
+    ["address"]
+)
+MONGO_POOL_CHECKOUT_FAILURES = registry.counter(
+    "mongodb_pool_checkout_failures_total",
+    "Échecs d'obtention d'une connexion du pool MongoDB",
+    ["address", "reason"]
+)
+
+# Commandes dont le premier champ ne désigne pas une collection
+_NON_COLLECTION_COMMANDS = {"ping", "hello", "ismaster", "isMaster", "buildinfo", "buildInfo", "endSessions", "getMore"}
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Mesure la durée de chaque commande MongoDB, par collection et opération
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[object, int], Tuple[str, str]] = {}
+
+    def started(self, event):
+        command = event.command_name
+        if command == "getMore":
+            collection = event.command.get("collection", "")
+        elif command in _NON_COLLECTION_COMMANDS:
+            collection = ""
+        else:
+            value = event.command.get(command)
+            collection = value if isinstance(value, str) else ""
+        self._pending[(event.connection_id, event.request_id)] = (command, collection)
+
+    def _finish(self, event, failed: bool):
+        command, collection = self._pending.pop((event.connection_id, event.request_id), (event.command_name, ""))
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1_000_000, command=command, collection=collection)
+        if failed:
+            MONGO_COMMAND_FAILURES.inc(command=command, collection=collection)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """
+    Suit l'état du pool de connexions MongoDB
+    """
+
+    @staticmethod
+    def _address(event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        address = self._address(event)
+        MONGO_POOL_CONNECTIONS.set(0, address=address)
+        MONGO_POOL_CHECKED_OUT.set(0, address=address)
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc(address=self._address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec(address=self._address(event))
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILURES.inc(address=self._address(event), reason=str(event.reason))
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CHECKED_OUT.inc(address=self._address(event))
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec(address=self._address(event))
+
+
+def mongo_event_listeners() -> List[object]:
+    """
+    Écouteurs à passer au client MongoDB (paramètre `event_listeners`)
+    """
+    return [MongoCommandListener(), MongoPoolListener()]
+
+
+# ---------------------------------------------------------------------------
+# Tampons internes
+# ---------------------------------------------------------------------------
+
+ANALYTICS_BUFFER_DEPTH = registry.gauge(
+    "analytics_buffer_depth",
+    "Événements analytics en attente d'écriture dans MongoDB",
+    ["buffer"]
+)
+
+
+def register_buffer_depth(buffer: str, depth: Callable[[], float]):
+    """
+    Expose la profondeur d'un tampon d'écriture analytics (lue à chaque collecte)
+    """
+    ANALYTICS_BUFFER_DEPTH.set_function(depth, buffer=buffer)
@@ -0,0 +1,219 @@
+"""
+Limitation de débit (token bucket) des endpoints publics non authentifiés
+
+Chaque règle associe un débit (jetons par seconde) et une capacité (rafale
+maximale) à une clé : adresse IP du client, assistant visé ou session. La
+vérification est faite dans une dépendance FastAPI, avant tout accès à la base ;
+une requête refusée reçoit un 429 avec l'en-tête Retry-After.
+
+Les compteurs sont gardés en mémoire (par worker) ou, avec
+RATE_LIMIT_BACKEND=mongo, dans la collection `rate_limits` partagée par tous les
+workers. Les deux stockages ont la même interface (`take`) : le stockage en
+mémoire remplace le stockage partagé en local et dans les tests.
+
+Variables d'environnement :
+- RATE_LIMIT_ENABLED : "0" pour désactiver
+- RATE_LIMIT_BACKEND : memory (défaut) ou mongo
+- RATE_LIMITS : surcharge des règles, ex. "session_create_ip=0.5/20,message_session=5/30"
+  (jetons par seconde / capacité)
+- RATE_LIMIT_TRUST_PROXY : "1" pour lire l'IP client dans X-Forwarded-For
+"""
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+
+from app.database.mongodb import get_database
+from app.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITS_COLLECTION = "rate_limits"
+
+# règle -> (jetons par seconde, capacité)
+DEFAULT_RULES: Dict[str, Tuple[float, float]] = {
+    "session_create_ip": (0.5, 20),
+    "session_create_assistant": (50, 500),
+    "message_ip": (20, 100),
+    "message_session": (5, 30),
+    "track_message_ip": (20, 100),
+    "track_message_session": (5, 30),
+    "upload_ip": (0.2, 10)
+}
+
+RATE_LIMITED = registry.counter(
+    "rate_limit_rejections_total",
+    "Requêtes refusées (429) par la limitation de débit",
+    ["rule"]
+)
+
+
+def parse_rules(spec: Optional[str], defaults: Dict[str, Tuple[float, float]]) -> Dict[str, Tuple[float, float]]:
+    """
+    Lit "règle=débit/capacité,..." ; les entrées invalides sont ignorées
+    """
+    rules = dict(defaults)
+    for item in (spec or "").split(","):
+        name, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        try:
+            if name.strip():
+                rules[name.strip()] = (float(rate), float(burst or rate))
+        except ValueError:
+            continue
+    return rules
+
+
+class MemoryRateLimitStore:
+    """
+    Seaux en mémoire, propres au worker. Les moins récemment utilisés sont
+    oubliés au-delà de `maxsize` (ils repartent alors pleins).
+    """
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """
+        Consomme `cost` jetons ; retourne 0 si la requête est acceptée, sinon le
+        délai (secondes) avant que les jetons soient disponibles
+        """
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class MongoRateLimitStore:
+    """
+    Seaux partagés entre workers : une seule mise à jour atomique (pipeline)
+    par requête. Les seaux inactifs expirent via un index TTL.
+    """
+
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = datetime.utcnow()
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]}
+
+        db = await get_database()
+        bucket = await db[RATE_LIMITS_COLLECTION].find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", cost]},
+                    "updated_at": now,
+                    "expires_at": now + timedelta(seconds=self.ttl)
+                }},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]}}}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (cost - bucket["tokens"]) / rate
+
+
+class RateLimiter:
+    def __init__(self, store=None, rules: Optional[Dict[str, Tuple[float, float]]] = None, enabled: bool = True):
+        self.store = store or MemoryRateLimitStore()
+        self.rules = rules or dict(DEFAULT_RULES)
+        self.enabled = enabled
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        backend = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+        return cls(
+            store=MongoRateLimitStore() if backend == "mongo" else MemoryRateLimitStore(),
+            rules=parse_rules(os.getenv("RATE_LIMITS"), DEFAULT_RULES),
+            enabled=os.getenv("RATE_LIMIT_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+        )
+
+    async def check(self, rule: str, key: str):
+        """
+        Lève une HTTPException 429 si la clé a dépassé le débit de la règle
+        """
+        if not self.enabled:
+            return
+        rate, burst = self.rules[rule]
+        try:
+            wait = await self.store.take(f"{rule}:{key}", rate, burst)
+        except Exception as e:
+            # Le stockage partagé est indisponible : ne pas bloquer le trafic légitime
+            logger.error("Limitation de débit indisponible (%s): %s", rule, e)
+            return
+        if wait > 0:
+            RATE_LIMITED.inc(rule=rule)
+            raise HTTPException(
+                status_code=429,
+                detail="Trop de requêtes, veuillez réessayer plus tard",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))}
+            )
+
+
+rate_limiter = RateLimiter.from_env()
+
+TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "").strip().lower() in ("1", "true", "yes", "on")
+
+KeyFunction = Callable[[Request], Awaitable[Optional[str]]]
+
+
+async def client_ip(request: Request) -> Optional[str]:
+    if TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+def path_param(name: str) -> KeyFunction:
+    async def key(request: Request) -> Optional[str]:
+        return request.path_params.get(name)
+    return key
+
+
+def body_field(name: str) -> KeyFunction:
+    """
+    Champ du corps JSON (déjà lu et mis en cache par FastAPI ou par l'endpoint)
+    """
+    async def key(request: Request) -> Optional[str]:
+        try:
+            body = await request.json()
+        except Exception:
+            return None
+        value = body.get(name) if isinstance(body, dict) else None
+        return str(value) if value else None
+    return key
+
+
+def rate_limit(rule: str, key: KeyFunction = client_ip):
+    """
+    Dépendance FastAPI appliquant la règle `rule` à la clé extraite de la requête
+    """
+    async def dependency(request: Request):
+        value = await key(request)
+        if value:
+            await rate_limiter.check(rule, value)
+    return dependency
@@ -0,0 +1,94 @@
+"""
+Sérialisation JSON rapide des réponses volumineuses
+
+Les documents MongoDB (ObjectId, datetime, Enum) sont écrits directement en
+octets JSON avec orjson, sans passer par jsonable_encoder ni par la validation
+du `response_model` (qui reste déclaré sur les routes pour le schéma OpenAPI).
+Le résultat peut être mis en cache par version de document (`updated_at`).
+"""
+from typing import Any, Callable, Dict, Iterable
+
+import orjson
+from bson import ObjectId
+from pydantic import BaseModel
+from starlette.responses import Response
+
+from app.utils.cache import TTLCache
+
+# Clés de dictionnaire non textuelles acceptées (comme json.dumps)
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+# Réponses sérialisées par (type, id, version). Les graphes pouvant peser
+# plusieurs centaines de Ko, le nombre d'entrées reste modeste.
+serialized_cache = TTLCache("serialized_documents", maxsize=128, ttl=3600)
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    raise TypeError(f"Type non sérialisable en JSON: {type(value).__name__}")
+
+
+def dumps(content: Any, sort_keys: bool = False) -> bytes:
+    """
+    Sérialise en JSON (octets) ; les ObjectId deviennent des chaînes et les
+    datetime sont écrites au format ISO 8601, comme jsonable_encoder.
+    Avec `sort_keys`, la sortie est canonique (utilisable pour un hash de contenu).
+    """
+    option = ORJSON_OPTIONS | orjson.OPT_SORT_KEYS if sort_keys else ORJSON_OPTIONS
+    return orjson.dumps(content, default=_default, option=option)
+
+
+def dumps_for_script(content: Any) -> str:
+    """
+    JSON à insérer dans un bloc <script type="application/json"> : "<", ">" et "&"
+    sont échappés pour qu'une valeur ne puisse pas fermer la balise
+    """
+    return (
+        dumps(content).decode("utf-8")
+        .replace("<", "\\u003c")
+        .replace(">", "\\u003e")
+        .replace("&", "\\u0026")
+    )
+
+
+def dumps_list(fragments: Iterable[bytes]) -> bytes:
+    """
+    Assemble des éléments déjà sérialisés en tableau JSON
+    """
+    return b"[" + b",".join(fragments) + b"]"
+
+
+def dumps_document(kind: str, document: Dict[str, Any], build: Callable[[Dict[str, Any]], Any]) -> bytes:
+    """
+    Sérialise `build(document)` en réutilisant le résultat tant que le document
+    n'a pas changé (clé : type de réponse, _id, updated_at)
+    """
+    version = document.get("updated_at")
+    if version is None:
+        return dumps(build(document))
+
+    key = (kind, str(document["_id"]), version)
+    payload = serialized_cache.get(key)
+    if payload is None:
+        payload = dumps(build(document))
+        serialized_cache.set(key, payload)
+    return payload
+
+
+class FastJSONResponse(Response):
+    """
+    Réponse JSON sérialisée avec orjson ; accepte aussi des octets déjà encodés
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
@@ -0,0 +1,47 @@
+"""
+Regroupement des appels concurrents identiques (singleflight)
+
+Quand plusieurs requêtes demandent la même donnée au même moment (cache vide
+après un déploiement, embed très fréquenté qui vient d'être publié), un seul
+appel à la base est lancé ; les autres attendent et reçoivent le même résultat
+(ou la même exception).
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from app.utils.metrics import registry
+
+SINGLEFLIGHT_CALLS = registry.counter(
+    "singleflight_calls_total",
+    "Appels regroupés : exécutés (leader) ou partagés avec un appel en cours (shared)",
+    ["group", "result"]
+)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Un appel en cours au plus par clé. Le résultat est partagé tel quel entre
+    les appelants : il ne doit pas être modifié.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, "asyncio.Task"] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            SINGLEFLIGHT_CALLS.inc(group=self.name, result="leader")
+            # L'appel tourne dans sa propre tâche : l'annulation d'un appelant
+            # (client déconnecté) n'interrompt pas les autres
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            SINGLEFLIGHT_CALLS.inc(group=self.name, result="shared")
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._calls)
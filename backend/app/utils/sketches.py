@@ -0,0 +1,222 @@
+"""
+Résumés probabilistes (sketches) à taille bornée, fusionnables entre jours
+
+- `SpaceSaving` : les K valeurs les plus fréquentes d'un flux (algorithme
+  Space-Saving de Metwally et al.). Une valeur hors du top-K remplace la moins
+  fréquente et hérite de son compteur, qui devient sa marge d'erreur : le
+  nombre réel d'occurrences est compris entre `count - error` et `count`.
+- `HyperLogLog` : estimation du nombre de valeurs distinctes avec 2^p
+  registres d'un octet (erreur relative ≈ 1,04 / √(2^p)), stockés en binaire.
+
+Les deux structures se fusionnent (union de plusieurs jours) sans perte par
+rapport à un sketch construit sur l'ensemble du flux.
+
+`update_sketch` applique une modification à un sketch stocké dans un document
+MongoDB par lecture puis écriture conditionnelle sur un numéro de version
+(compare-and-swap), pour que deux écritures concurrentes ne s'écrasent pas.
+"""
+import hashlib
+import logging
+import math
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from bson import Binary
+
+from app.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Nombre de tentatives d'une mise à jour compare-and-swap
+CAS_RETRIES = 5
+
+SKETCH_UPDATES = registry.counter(
+    "sketch_updates_total",
+    "Mises à jour des sketches stockés (compare-and-swap) : réussies, inutiles, conflits, abandonnées",
+    ["sketch", "result"]
+)
+
+
+class SpaceSaving:
+    """
+    Top-K des valeurs les plus fréquentes, avec au plus `capacity` compteurs
+    """
+
+    def __init__(self, capacity: int = 32):
+        self.capacity = capacity
+        # valeur -> [nombre d'occurrences (majorant), erreur]
+        self.items: Dict[str, List[int]] = {}
+
+    def add(self, value: str, count: int = 1):
+        entry = self.items.get(value)
+        if entry is not None:
+            entry[0] += count
+        elif len(self.items) < self.capacity:
+            self.items[value] = [count, 0]
+        else:
+            evicted = min(self.items, key=lambda item: self.items[item][0])
+            floor = self.items.pop(evicted)[0]
+            self.items[value] = [floor + count, floor]
+
+    def min_count(self) -> int:
+        """
+        Compteur minimal d'un résumé plein (majorant des valeurs non suivies),
+        0 si le résumé n'est pas plein (il est alors exact)
+        """
+        if len(self.items) < self.capacity:
+            return 0
+        return min(entry[0] for entry in self.items.values())
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        """
+        Fusionne `other` (algorithme d'Agarwal et al.) : une valeur absente d'un
+        des deux résumés reçoit son compteur minimal, puis seuls les
+        `capacity` plus grands compteurs sont conservés
+        """
+        floor, other_floor = self.min_count(), other.min_count()
+        merged: Dict[str, List[int]] = {}
+        for value in set(self.items) | set(other.items):
+            count, error = self.items.get(value, [floor, floor])
+            other_count, other_error = other.items.get(value, [other_floor, other_floor])
+            merged[value] = [count + other_count, error + other_error]
+
+        capacity = max(self.capacity, other.capacity)
+        top = sorted(merged.items(), key=lambda item: item[1][0], reverse=True)[:capacity]
+        self.capacity = capacity
+        self.items = dict(top)
+        return self
+
+    def top(self, limit: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        """
+        Valeurs triées par fréquence décroissante : (valeur, nombre, erreur)
+        """
+        ranked = sorted(self.items.items(), key=lambda item: item[1][0], reverse=True)
+        return [(value, count, error) for value, (count, error) in ranked[:limit]]
+
+    def to_doc(self) -> Dict[str, Any]:
+        return {"capacity": self.capacity, "items": [list(item) for item in self.top()]}
+
+    @classmethod
+    def from_doc(cls, doc: Optional[Dict[str, Any]], capacity: int = 32) -> "SpaceSaving":
+        sketch = cls((doc or {}).get("capacity", capacity))
+        for value, count, error in (doc or {}).get("items", []):
+            sketch.items[value] = [count, error]
+        return sketch
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """
+    Estimation du nombre de valeurs distinctes (registres de 2^`precision` octets)
+    """
+
+    def __init__(self, precision: int = 10, registers: Optional[bytes] = None):
+        if not 4 <= precision <= 16:
+            raise ValueError("La précision d'un HyperLogLog doit être comprise entre 4 et 16")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError("Taille des registres incompatible avec la précision")
+
+    def add(self, value: str) -> bool:
+        """
+        Ajoute une valeur ; retourne False si les registres sont inchangés
+        (valeur déjà vue, ou masquée par une autre)
+        """
+        hashed = _hash64(value)
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        # Rang du premier bit à 1 dans les 64 - p bits restants
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def update(self, values: Iterable[str]):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise ValueError("Fusion de HyperLogLog de précisions différentes")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.size) if self.size >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[self.size]
+        estimate = alpha * self.size ** 2 / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Petites cardinalités : comptage linéaire des registres vides
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+    def to_binary(self) -> Binary:
+        return Binary(bytes(self.registers))
+
+    @classmethod
+    def from_binary(cls, data: Optional[bytes], precision: int = 10) -> "HyperLogLog":
+        """
+        HyperLogLog stocké (la précision se déduit de la taille des registres),
+        ou vide si `data` est None
+        """
+        if not data:
+            return cls(precision)
+        return cls(len(data).bit_length() - 1, bytes(data))
+
+
+def document_path(document: Optional[Dict[str, Any]], path: str) -> Any:
+    """
+    Valeur d'un champ imbriqué (`a.b.c`) d'un document, ou None
+    """
+    value: Any = document
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+async def update_sketch(
+    collection,
+    filter: Dict[str, Any],
+    path: str,
+    apply: Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]],
+    sketch: str,
+    retries: int = CAS_RETRIES
+) -> bool:
+    """
+    Remplace le sous-document `path` du document `filter` par
+    `apply(valeur actuelle)`, seulement s'il n'a pas changé entre la lecture et
+    l'écriture (champ `version`). Le document est créé s'il n'existe pas ;
+    aucune écriture n'est faite si `apply` retourne None (sketch inchangé).
+    Retourne False si toutes les tentatives sont en conflit.
+    """
+    for _ in range(retries):
+        document = await collection.find_one(filter, {path: 1})
+        if document is None:
+            await collection.update_one(filter, {"$setOnInsert": filter}, upsert=True)
+            document = {}
+
+        current = document_path(document, path)
+        version = current.get("version", 0) if isinstance(current, dict) else 0
+        updated = apply(current if isinstance(current, dict) else None)
+        if updated is None:
+            SKETCH_UPDATES.inc(sketch=sketch, result="unchanged")
+            return True
+        updated = {**updated, "version": version + 1}
+
+        guard = {f"{path}.version": version} if version else {f"{path}.version": {"$exists": False}}
+        result = await collection.update_one({**filter, **guard}, {"$set": {path: updated}})
+        if result.modified_count:
+            SKETCH_UPDATES.inc(sketch=sketch, result="ok")
+            return True
+        SKETCH_UPDATES.inc(sketch=sketch, result="conflict")
+
+    SKETCH_UPDATES.inc(sketch=sketch, result="dropped")
+    logger.warning("Mise à jour du sketch %s abandonnée après %s conflits", path, retries)
+    return False
@@ -0,0 +1,453 @@
+"""
+Banc d'essai de performance de l'API leadflow
+
+Démarre l'application FastAPI en mémoire contre une base de remplacement
+(mongomock-motor) ou un mongod local, génère des données synthétiques puis
+exécute des charges réalistes (sessions de chat et requêtes du dashboard) en
+mesurant la latence de chaque endpoint.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Callable, Awaitable
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BENCH_DB_NAME = "leadflow_bench"
+BENCH_USER_EMAIL = "bench@leadflow.local"
+
+
+@dataclass
+class BenchConfig:
+    assistants: int = 5
+    nodes_per_assistant: int = 12
+    seeded_sessions: int = 200
+    chat_sessions: int = 100
+    messages_per_session: int = 8
+    dashboard_rounds: int = 20
+    concurrency: int = 10
+    days: int = 30
+    mongo_url: Optional[str] = None
+    seed: int = 42
+    quiet: bool = True
+
+
+@dataclass
+class EndpointStats:
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+
+    def record(self, latency: float, ok: bool):
+        self.latencies.append(latency)
+        if not ok:
+            self.errors += 1
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """
+    Percentile par la méthode du rang le plus proche (valeurs déjà triées)
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    """
+    Enregistre les latences par endpoint (gabarit de route, pas l'URL brute)
+    """
+
+    def __init__(self):
+        self.stats: Dict[str, EndpointStats] = {}
+        self.started_at = time.perf_counter()
+        self.ended_at: Optional[float] = None
+
+    async def call(self, client: httpx.AsyncClient, label: str, method: str, url: str, **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        latency = time.perf_counter() - start
+        self.stats.setdefault(label, EndpointStats()).record(latency, response.status_code < 400)
+        return response
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        elapsed = (self.ended_at or time.perf_counter()) - self.started_at
+        report = {}
+        for label, stats in sorted(self.stats.items()):
+            values = sorted(stats.latencies)
+            report[label] = {
+                "count": len(values),
+                "errors": stats.errors,
+                "throughput": len(values) / elapsed if elapsed > 0 else 0.0,
+                "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000
+            }
+        return report
+
+
+# ---------------------------------------------------------------------------
+# Démarrage de l'application
+# ---------------------------------------------------------------------------
+
+async def boot_app(config: BenchConfig):
+    """
+    Branche l'application sur la base de remplacement et exécute ses événements
+    de démarrage. Retourne l'application FastAPI.
+    """
+    # L'application monte ses fichiers statiques avec des chemins relatifs
+    os.chdir(BACKEND_DIR)
+    
+    # Tous les visiteurs simulés partagent la même IP : la limitation de débit
+    # par IP rejetterait une partie de la charge mesurée
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+    from app.database import mongodb
+
+    if config.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        mongodb.client = AsyncIOMotorClient(config.mongo_url)
+        mongodb.DB_NAME = BENCH_DB_NAME
+        await mongodb.client.drop_database(BENCH_DB_NAME)
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("mongomock-motor est requis sans --mongo-url (pip install -r requirements-bench.txt)")
+        mongodb.client = AsyncMongoMockClient()
+
+    from app.main import app
+
+    if config.quiet:
+        logging.disable(logging.WARNING)
+
+    await app.router.startup()
+    return app
+
+
+async def shutdown_app(app, config: BenchConfig):
+    from app.database import mongodb
+
+    if config.mongo_url and mongodb.client is not None:
+        await mongodb.client.drop_database(BENCH_DB_NAME)
+    await app.router.shutdown()
+
+
+# ---------------------------------------------------------------------------
+# Données synthétiques
+# ---------------------------------------------------------------------------
+
+def build_flow(node_count: int) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Flow linéaire : un nœud de départ, des questions à options qui mènent au
+    nœud suivant, et un nœud final marqué comme lead complet
+    """
+    nodes = []
+    edges = []
+    for index in range(node_count):
+        node_id = "start" if index == 0 else f"node-{index}"
+        next_id = f"node-{index + 1}" if index + 1 < node_count else None
+        is_last = next_id is None
+        element = {
+            "id": f"el-{index}",
+            "type": "options" if next_id else "text",
+            "content": f"Question {index} ?" if next_id else "Merci !",
+            "displayMode": "after",
+            "options": [
+                {"id": f"opt-{index}-{choice}", "text": f"Choix {choice}", "targetNodeId": next_id}
+                for choice in range(3)
+            ] if next_id else None
+        }
+        nodes.append({
+            "id": node_id,
+            "label": f"Nœud {index}",
+            "type": "custom",
+            "position": {"x": index * 320, "y": 0},
+            "data": {
+                "label": f"Nœud {index}",
+                "type": "start" if index == 0 else ("end" if is_last else "question"),
+                "elements": [element],
+                "is_complete_lead": is_last,
+                "is_final_node": is_last
+            }
+        })
+        if next_id:
+            edges.append({"id": f"edge-{index}", "source": node_id, "target": next_id})
+    return {"nodes": nodes, "edges": edges}
+
+
+async def seed_database(config: BenchConfig) -> Dict[str, Any]:
+    """
+    Crée l'utilisateur de test, les assistants publiés et un historique de
+    sessions et d'analytics réparti sur la période analysée
+    """
+    from app.database.mongodb import get_database
+    from app.utils.auth_utils import create_access_token, get_password_hash
+
+    rng = random.Random(config.seed)
+    db = await get_database()
+    now = datetime.utcnow()
+
+    user = await db.users.insert_one({
+        "email": BENCH_USER_EMAIL,
+        "password": get_password_hash("bench"),
+        "full_name": "Bench",
+        "company_name": "leadflow"
+    })
+    token = create_access_token(data={"sub": BENCH_USER_EMAIL})
+
+    assistants = []
+    for index in range(config.assistants):
+        flow = build_flow(config.nodes_per_assistant)
+        public_id = f"bot-{uuid.UUID(int=rng.getrandbits(128))}"
+        doc = {
+            "name": f"Assistant {index}",
+            "description": "Assistant généré pour le banc d'essai",
+            "nodes": flow["nodes"],
+            "edges": flow["edges"],
+            "is_published": True,
+            "public_id": public_id,
+            "public_url": f"http://bench/chat/{public_id}",
+            "publish_date": now,
+            "user_id": str(user.inserted_id),
+            "created_at": now,
+            "updated_at": now
+        }
+        result = await db.assistants.insert_one(doc)
+        assistants.append({"id": str(result.inserted_id), "public_id": public_id, "nodes": flow["nodes"]})
+
+    sessions = []
+    analytics: Dict[tuple, Dict[str, Any]] = {}
+    for _ in range(config.seeded_sessions):
+        assistant = rng.choice(assistants)
+        started_at = now - timedelta(days=rng.randrange(config.days), seconds=rng.randrange(86400))
+        depth = rng.randrange(1, config.nodes_per_assistant + 1)
+        completed = depth == config.nodes_per_assistant
+        visited = [node["id"] for node in assistant["nodes"][:depth]]
+        sessions.append({
+            "assistant_id": assistant["id"],
+            "user_info": {"source": rng.choice(["website", "facebook", "direct"])},
+            "status": "completed" if completed else "abandoned",
+            "lead_status": "complete" if completed else ("partial" if depth > 1 else "none"),
+            "started_at": started_at,
+            "ended_at": started_at + timedelta(seconds=depth * 20),
+            "current_node_id": visited[-1],
+            "visited_nodes": visited,
+            "visited_nodes_count": depth,
+            "completion_percentage": depth / config.nodes_per_assistant * 100,
+            "event_log": True
+        })
+
+        key = (started_at.strftime("%Y-%m-%d"), assistant["id"])
+        day = analytics.setdefault(key, {
+            "date": key[0], "assistant_id": key[1], "sessions_count": 0, "completed_sessions": 0,
+            "abandoned_sessions": 0, "leads_count": 0, "complete_leads": 0, "partial_leads": 0,
+            "messages_count": 0, "session_durations": [], "nodes": {}
+        })
+        day["sessions_count"] += 1
+        day["completed_sessions" if completed else "abandoned_sessions"] += 1
+        day["complete_leads" if completed else "partial_leads"] += 1
+        day["leads_count"] += 1 if completed else 0
+        day["messages_count"] += depth * 2
+        day["session_durations"].append(depth * 20)
+        for node_id in visited:
+            node = day["nodes"].setdefault(node_id, {"visits": 0, "completions": 0, "times": []})
+            node["visits"] += 1
+            node["completions"] += 1
+            node["times"].append(rng.uniform(2, 30))
+
+    if sessions:
+        result = await db.sessions.insert_many(sessions)
+        events = []
+        for session_id, session in zip(result.inserted_ids, sessions):
+            for node_id in session["visited_nodes"]:
+                for sender, content in (("bot", f"Question {node_id} ?"), ("user", "Choix 1")):
+                    events.append({
+                        "session_id": str(session_id),
+                        "type": "message",
+                        "node_id": node_id,
+                        "timestamp": session["started_at"],
+                        "sender": sender,
+                        "content": content,
+                        "content_type": "option",
+                        "metadata": None,
+                        "is_question": sender == "bot",
+                        "is_form": False
+                    })
+        if events:
+            await db.session_events.insert_many(events)
+        await db.analytics.insert_many(list(analytics.values()))
+
+    return {
+        "token": token,
+        "assistants": assistants,
+        "session_ids": [str(session_id) for session_id in result.inserted_ids] if sessions else []
+    }
+
+
+# ---------------------------------------------------------------------------
+# Charges
+# ---------------------------------------------------------------------------
+
+async def chat_session_workload(client: httpx.AsyncClient, recorder: Recorder, seed_data: Dict[str, Any],
+                                config: BenchConfig, rng: random.Random):
+    """
+    Parcours d'un visiteur : chargement du widget, création de session,
+    N échanges question/réponse, fin de session, puis une seconde session
+    menée par le moteur côté serveur (POST /advance)
+    """
+    assistant = rng.choice(seed_data["assistants"])
+    public_id = assistant["public_id"]
+    nodes = assistant["nodes"]
+
+    page = await recorder.call(client, "GET /chat/{public_id}", "GET", f"/chat/{public_id}")
+    # Comme le widget : le flow n'est demandé à l'API que s'il n'est pas inclus dans la page
+    if 'id="assistant-flow"' not in page.text:
+        await recorder.call(client, "GET /api/assistants/{public_id}/flow", "GET", f"/api/assistants/{public_id}/flow")
+
+    response = await recorder.call(
+        client, "POST /api/sessions/", "POST", "/api/sessions/",
+        json={"assistant_id": assistant["id"], "user_info": {"public_id": public_id, "source": "bench"}}
+    )
+    if response.status_code >= 400:
+        return
+    session_id = response.json()["id"]
+
+    for index in range(config.messages_per_session):
+        node = nodes[min(index, len(nodes) - 1)]
+        await recorder.call(
+            client, "POST /api/analytics/track_message", "POST", "/api/analytics/track_message",
+            json={"session_id": session_id, "content": f"Question {node['id']} ?", "is_question": True,
+                  "message_type": "options", "node_id": node["id"]}
+        )
+        await recorder.call(
+            client, "POST /api/sessions/{session_id}/nodes/{node_id}/viewed", "POST",
+            f"/api/sessions/{session_id}/nodes/{node['id']}/viewed"
+        )
+        await recorder.call(
+            client, "POST /api/sessions/{session_id}/messages", "POST", f"/api/sessions/{session_id}/messages",
+            json={"sender": "user", "content": f"Choix {rng.randrange(3)}", "content_type": "option", "node_id": node["id"]}
+        )
+
+    await recorder.call(client, "PUT /api/sessions/{session_id}/end", "PUT", f"/api/sessions/{session_id}/end")
+
+    # Même visiteur via le moteur côté serveur : un tour de conversation par requête
+    response = await recorder.call(
+        client, "POST /api/sessions/", "POST", "/api/sessions/",
+        json={"assistant_id": public_id, "user_info": {"public_id": public_id, "source": "bench"}}
+    )
+    if response.status_code >= 400:
+        return
+    session_id = response.json()["id"]
+
+    body: Dict[str, Any] = {}
+    for _ in range(config.messages_per_session + 1):
+        response = await recorder.call(
+            client, "POST /api/sessions/{session_id}/advance", "POST", f"/api/sessions/{session_id}/advance", json=body
+        )
+        if response.status_code >= 400:
+            return
+        turn = response.json()
+        if turn["ended"] or not turn["current_node_id"]:
+            return
+        body = {"node_id": turn["current_node_id"], "option": f"Choix {rng.randrange(3)}"}
+
+
+async def dashboard_workload(client: httpx.AsyncClient, recorder: Recorder, seed_data: Dict[str, Any],
+                             config: BenchConfig, rng: random.Random):
+    """
+    Chargement des pages du dashboard par un utilisateur connecté
+    """
+    headers = {"Authorization": f"Bearer {seed_data['token']}"}
+    assistant_id = rng.choice(seed_data["assistants"])["id"]
+    days = config.days
+
+    await recorder.call(client, "GET /api/assistants/", "GET", "/api/assistants/", headers=headers)
+    await recorder.call(client, "GET /api/assistants/{assistant_id}", "GET", f"/api/assistants/{assistant_id}", headers=headers)
+    await recorder.call(client, "GET /api/analytics/overview", "GET", f"/api/analytics/overview?days={days}", headers=headers)
+    await recorder.call(client, "GET /api/analytics/time-series", "GET", f"/api/analytics/time-series?days={days}", headers=headers)
+    await recorder.call(client, "GET /api/analytics/leads", "GET", f"/api/analytics/leads?days={days}", headers=headers)
+    await recorder.call(
+        client, "GET /api/analytics/node-performance", "GET",
+        f"/api/analytics/node-performance?assistant_id={assistant_id}&days={days}", headers=headers
+    )
+    await recorder.call(client, "GET /api/sessions/by-assistant/{assistant_id}", "GET",
+                        f"/api/sessions/by-assistant/{assistant_id}", headers=headers)
+    if seed_data["session_ids"]:
+        session_id = rng.choice(seed_data["session_ids"])
+        await recorder.call(client, "GET /api/analytics/sessions/{session_id}/interactions", "GET",
+                            f"/api/analytics/sessions/{session_id}/interactions", headers=headers)
+
+
+async def run_workload(app, seed_data: Dict[str, Any], config: BenchConfig, iterations: int,
+                       workload: Callable[..., Awaitable[None]]) -> Dict[str, Dict[str, float]]:
+    """
+    Exécute `iterations` fois une charge avec `concurrency` utilisateurs simultanés
+    """
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(config.concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        async def one(iteration: int):
+            async with semaphore:
+                await workload(client, recorder, seed_data, config, random.Random(config.seed + iteration))
+
+        await asyncio.gather(*[one(iteration) for iteration in range(iterations)])
+
+    recorder.ended_at = time.perf_counter()
+    return recorder.report()
+
+
+async def run_benchmarks(config: BenchConfig) -> Dict[str, Any]:
+    """
+    Démarre l'application, génère les données puis exécute les charges de chat
+    et de dashboard. Retourne le rapport complet.
+    """
+    app = await boot_app(config)
+    try:
+        seed_data = await seed_database(config)
+        chat = await run_workload(app, seed_data, config, config.chat_sessions, chat_session_workload)
+        dashboard = await run_workload(app, seed_data, config, config.dashboard_rounds, dashboard_workload)
+    finally:
+        await shutdown_app(app, config)
+
+    return {
+        "config": config.__dict__,
+        "backend": "mongod" if config.mongo_url else "mongomock",
+        "generated_at": datetime.utcnow().isoformat(),
+        "workloads": {"chat": chat, "dashboard": dashboard}
+    }
+
+
+def compare_reports(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float,
+                    metric: str = "p95_ms") -> List[Dict[str, Any]]:
+    """
+    Compare deux rapports et retourne les endpoints dont `metric` s'est dégradé
+    de plus de `threshold` (ratio, ex: 0.1 = +10 %)
+    """
+    regressions = []
+    for workload, endpoints in current["workloads"].items():
+        for label, stats in endpoints.items():
+            previous = baseline.get("workloads", {}).get(workload, {}).get(label)
+            if not previous or not previous.get(metric):
+                continue
+            ratio = stats[metric] / previous[metric] - 1
+            if ratio > threshold:
+                regressions.append({
+                    "workload": workload,
+                    "endpoint": label,
+                    "metric": metric,
+                    "baseline": previous[metric],
+                    "current": stats[metric],
+                    "change": ratio
+                })
+    return regressions
@@ -0,0 +1,90 @@
+"""
+Lance le banc d'essai et affiche p50/p95/p99 et le débit par endpoint.
+
+Usage (depuis le dossier backend) :
+    python -m benchmarks.run
+    python -m benchmarks.run --chat-sessions 500 --concurrency 50 --output bench.json
+    python -m benchmarks.run --compare bench.json --threshold 0.15
+    python -m benchmarks.run --mongo-url mongodb://localhost:27017
+
+Sans --mongo-url, l'application tourne contre mongomock-motor (en mémoire). Avec
+--mongo-url, une base dédiée `leadflow_bench` est créée puis supprimée.
+Avec --compare, le code de sortie vaut 1 si un endpoint régresse au-delà du seuil.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from benchmarks.harness import BenchConfig, run_benchmarks, compare_reports
+
+
+def print_report(report):
+    print(f"Base: {report['backend']}")
+    for workload, endpoints in report["workloads"].items():
+        print(f"\n== {workload} ==")
+        print(f"{'endpoint':<58} {'n':>6} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for label, stats in endpoints.items():
+            print(
+                f"{label:<58} {stats['count']:>6} {stats['errors']:>5} {stats['throughput']:>8.1f} "
+                f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}"
+            )
+
+
+def main():
+    defaults = BenchConfig()
+    parser = argparse.ArgumentParser(description="Banc d'essai de l'API leadflow")
+    parser.add_argument("--assistants", type=int, default=defaults.assistants)
+    parser.add_argument("--nodes", type=int, default=defaults.nodes_per_assistant, help="Nœuds par assistant")
+    parser.add_argument("--seeded-sessions", type=int, default=defaults.seeded_sessions, help="Sessions historiques générées")
+    parser.add_argument("--chat-sessions", type=int, default=defaults.chat_sessions, help="Sessions de chat simulées")
+    parser.add_argument("--messages", type=int, default=defaults.messages_per_session, help="Messages par session simulée")
+    parser.add_argument("--dashboard-rounds", type=int, default=defaults.dashboard_rounds)
+    parser.add_argument("--concurrency", type=int, default=defaults.concurrency)
+    parser.add_argument("--days", type=int, default=defaults.days)
+    parser.add_argument("--mongo-url", default=None, help="mongod local à utiliser à la place de mongomock")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--verbose", action="store_true", help="Conserver les logs de l'application")
+    parser.add_argument("--output", help="Fichier JSON où écrire le rapport")
+    parser.add_argument("--compare", help="Rapport JSON de référence")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Dégradation tolérée du p95 (0.10 = +10 %%)")
+    args = parser.parse_args()
+
+    config = BenchConfig(
+        assistants=args.assistants,
+        nodes_per_assistant=args.nodes,
+        seeded_sessions=args.seeded_sessions,
+        chat_sessions=args.chat_sessions,
+        messages_per_session=args.messages,
+        dashboard_rounds=args.dashboard_rounds,
+        concurrency=args.concurrency,
+        days=args.days,
+        mongo_url=args.mongo_url,
+        seed=args.seed,
+        quiet=not args.verbose
+    )
+    report = asyncio.run(run_benchmarks(config))
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nRapport écrit dans {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} régression(s) au-delà de {args.threshold:.0%} :")
+            for item in regressions:
+                print(
+                    f"  [{item['workload']}] {item['endpoint']}: {item['metric']} "
+                    f"{item['baseline']:.2f} -> {item['current']:.2f} ms ({item['change']:+.0%})"
+                )
+            sys.exit(1)
+        print("\nAucune régression par rapport à la référence")
+
+
+if __name__ == "__main__":
+    main()
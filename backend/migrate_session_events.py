@@ -0,0 +1,33 @@
+"""
+Migre les conversations des anciennes collections (messages, conversations,
+qa_pairs, user_responses, form_submissions) vers le journal d'événements
+`session_events`.
+
+Usage :
+    python migrate_session_events.py            # migration seule
+    python migrate_session_events.py --drop     # migration puis suppression des anciennes collections
+
+Le script est idempotent : il peut être relancé sans créer de doublons.
+"""
+import argparse
+import asyncio
+
+from app.database.indexes import ensure_indexes
+from app.database.mongodb import close_mongo_connection
+from app.services.event_log import migrate_legacy_collections
+
+
+async def main(drop_legacy: bool):
+    await ensure_indexes()
+    stats = await migrate_legacy_collections(drop_legacy=drop_legacy)
+    print(f"Migration terminée: {stats['sessions']} session(s), {stats['events']} événement(s)")
+    if drop_legacy:
+        print("Anciennes collections supprimées")
+    await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migration vers le journal d'événements des sessions")
+    parser.add_argument("--drop", action="store_true", help="Supprimer les anciennes collections après la migration")
+    args = parser.parse_args()
+    asyncio.run(main(args.drop))
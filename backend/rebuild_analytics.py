@@ -0,0 +1,61 @@
+"""
+Reconstruit les documents d'analytics quotidiens à partir des données brutes
+(sessions, session_steps, journal d'événements), en parallèle par assistant et
+par jour.
+
+Usage :
+    python rebuild_analytics.py                                  # 30 derniers jours
+    python rebuild_analytics.py --since 2024-01-01 --until 2025-01-01 --workers 8
+    python rebuild_analytics.py --assistant <assistant_id> --days 365 --dry-run
+
+Par défaut la période s'arrête au début du jour courant (UTC) : les compteurs
+du jour sont encore incrémentés par l'API et une reconstruction concurrente
+perdrait ces incréments. Le script est idempotent.
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from app.database.mongodb import DB_NAME, MONGODB_URL
+from app.services.analytics_rebuild import rebuild_analytics
+
+
+def print_progress(stats: dict):
+    rate = stats["done"] / stats["elapsed"] if stats["elapsed"] else 0
+    print(f"  {stats['done']}/{stats['partitions']} partition(s), {stats['sessions']} session(s), {rate:.1f} partitions/s")
+
+
+def main(args):
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    until = datetime.fromisoformat(args.until) if args.until else today
+    since = datetime.fromisoformat(args.since) if args.since else until - timedelta(days=args.days)
+
+    print(f"Reconstruction des analytics du {since:%Y-%m-%d} au {until:%Y-%m-%d} (exclu)"
+          + (" — simulation, aucune écriture" if args.dry_run else ""))
+    stats = rebuild_analytics(
+        MONGODB_URL,
+        DB_NAME,
+        since,
+        until,
+        assistant_ids=args.assistant,
+        workers=args.workers,
+        dry_run=args.dry_run,
+        progress=None if args.quiet else print_progress
+    )
+
+    print(f"Terminé en {stats['elapsed']:.1f}s : {stats['documents']} document(s) reconstruit(s), "
+          f"{stats['deleted_days']} journée(s) sans session supprimée(s), {stats['writes']} bulk_write")
+    print(f"Données lues : {stats['sessions']} session(s), {stats['steps']} étape(s), {stats['events']} événement(s)")
+    print(f"Débit : {stats['partitions_per_second']:.1f} partitions/s, {stats['sessions_per_second']:.0f} sessions/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruction des analytics quotidiennes")
+    parser.add_argument("--days", type=int, default=30, help="Nombre de jours à reconstruire (défaut 30)")
+    parser.add_argument("--since", help="Début de la période (AAAA-MM-JJ), prioritaire sur --days")
+    parser.add_argument("--until", help="Fin de la période (AAAA-MM-JJ, exclue ; défaut : aujourd'hui)")
+    parser.add_argument("--assistant", action="append", help="ID d'un assistant à reconstruire (répétable ; défaut : tous)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processus du pool (défaut : nombre de CPU)")
+    parser.add_argument("--dry-run", action="store_true", help="Calculer les documents sans les écrire")
+    parser.add_argument("--quiet", action="store_true", help="Ne pas afficher la progression")
+    main(parser.parse_args())
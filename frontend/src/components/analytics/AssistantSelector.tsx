@@ -30,7 +30,7 @@ const AssistantSelector: React.FC<AssistantSelectorProps> = ({
         setLoading(true);
         console.log('🔍 Récupération de la liste des assistants...');
         
-        const data = await AssistantService.getAll();
+        const data = await AssistantService.getSummaries();
         console.log('👤 Assistants récupérés:', data.length, 'assistants trouvés');
         
         // Transformer les données pour le sélecteur
@@ -16,7 +16,7 @@ const AssistantSelect: React.FC = () => {
 
   useEffect(() => {
     async function fetchAssistants() {
-      const assistants = await AssistantService.getAll();
+      const assistants = await AssistantService.getSummaries();
       setOptions(
         assistants.map((a: any) => ({ value: a.id, label: a.name }))
       );
@@ -1,6 +1,6 @@
 import React, { useEffect, useRef, useState } from "react";
 import { useNavigate } from "react-router-dom";
-import AssistantService, { Assistant } from "../services/api";
+import AssistantService, { Assistant, AssistantSummary } from "../services/api";
 import AssistantCard from "../components/dashboard/AssistantCard";
 import AssistantForm from "../components/dashboard/AssistantForm";
 import Spinner from "../components/ui/Spinner";
@@ -16,7 +16,7 @@ const ChatbotsPage: React.FC = () => {
     message: string;
     onConfirm: () => void;
   }>({ isOpen: false, title: '', message: '', onConfirm: () => {} });
-  const [assistants, setAssistants] = useState<Assistant[]>([]);
+  const [assistants, setAssistants] = useState<AssistantSummary[]>([]);
   const [loading, setLoading] = useState(true);
   const [search, setSearch] = useState("");
   const [importLoading, setImportLoading] = useState(false);
@@ -32,7 +32,7 @@ const ChatbotsPage: React.FC = () => {
   const fetchAssistants = async () => {
     setLoading(true);
     try {
-      const data = await AssistantService.getAll();
+      const data = await AssistantService.getSummaries();
       setAssistants(data);
     } catch (e) {
       setAssistants([]);
@@ -83,7 +83,7 @@ const DashboardPage: React.FC = () => {
       try {
         setIsLoading(true);
         setError(null);
-        const data = await AssistantService.getAll();
+        const data = await AssistantService.getSummaries();
         // Mapping pour garantir id et name
         setAssistants(
           data.map((a: any) => ({
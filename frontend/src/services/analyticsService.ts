@@ -41,6 +41,8 @@ export interface AnalyticsOverview {
   complete_leads: number;
   average_completion_percentage: number;
   average_session_duration: number;
+  unique_visitors?: number;
+  unique_leads?: number;
 }
 
 export interface TimeSeriesData {
@@ -72,6 +72,13 @@ apiClient.interceptors.response.use(
 );
 
 // Interface pour les données d'un assistant
+// Erreur détectée par la compilation du graphe (nœud inaccessible, impasse...)
+export interface FlowValidationError {
+  code: string;
+  node_id?: string | null;
+  message: string;
+}
+
 export interface Assistant {
   id?: string;
   name: string;
@@ -81,12 +88,31 @@ export interface Assistant {
   is_published?: boolean;
   publish_date?: string;
   public_id?: string;
+  published_version?: number;
   public_url?: string;
   embed_script?: string;
+  validation_errors?: FlowValidationError[];
   created_at?: string;
   updated_at?: string;
 }
 
+// Interface pour la liste allégée des assistants (sans nodes ni edges)
+export interface AssistantSummary {
+  id?: string;
+  name: string;
+  description?: string;
+  is_published?: boolean;
+  public_id?: string;
+  node_count?: number;
+  created_at?: string;
+  updated_at?: string;
+  stats?: {
+    sessions_count: number;
+    leads_count: number;
+    conversion_rate: number;
+  };
+}
+
 // Interface pour la réponse du script d'intégration
 export interface EmbedScriptResponse {
   script: string;
@@ -123,6 +149,17 @@ const AssistantService = {
     }
   },
 
+  // Récupérer la liste allégée des assistants (cartes, sélecteurs)
+  async getSummaries(): Promise<AssistantSummary[]> {
+    try {
+      const response = await apiClient.get('/assistants/summary');
+      return response.data;
+    } catch (error: any) {
+      logError('Erreur lors de la récupération des assistants', error);
+      throw error;
+    }
+  },
+
   // Récupérer un assistant par son ID
   async getById(id: string): Promise<Assistant> {
     try {